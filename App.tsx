@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { AnalyticsView } from './components/AnalyticsView';
 import { SettingsView } from './components/SettingsView';
 import { RealtimeDetectionView } from './components/RealtimeDetectionView';
@@ -9,7 +9,7 @@ import { VehicleOwnerView } from './components/VehicleOwnerView';
 import { Registry } from './components/Registry';
 import { History } from './components/History';
 import { ReviewQueue } from './components/ReviewQueue';
-import { analyzeVehicleImageLocal as analyzeVehicleImage } from './services/api';
+import { analyzeVehicleImageLocal as analyzeVehicleImage, syncList, subscribeDetectionEvents } from './services/api';
 import { AnalysisResult, TollRecord, VehicleType, TollRate } from './types';
 import { TOLL_RATES as DEFAULT_RATES } from './constants';
 import { DashboardMenu } from './components/DashboardMenu';
@@ -17,6 +17,9 @@ import { LiveMonitor } from './components/LiveMonitor';
 
 export default function App() {
   const [history, setHistory] = useState<TollRecord[]>([]);
+  // Raw rows and watermark from the last history sync
+  const historyRowsRef = useRef<any[]>([]);
+  const historyWatermarkRef = useRef<string | null>(null);
   const [isAnalyzing, setIsAnalyzing] = useState(false);
   const [currentResult, setCurrentResult] = useState<AnalysisResult | null>(null);
   const [currentScanImage, setCurrentScanImage] = useState<string | null>(null);
@@ -45,9 +48,11 @@ export default function App() {
 
   const fetchHistory = async () => {
     try {
-      const res = await fetch('http://localhost:8000/api/history');
-      if (res.ok) {
-        const data = await res.json();
+      const synced = await syncList<any>('/api/history', historyRowsRef.current, historyWatermarkRef.current, 50);
+      if (synced) {
+        historyRowsRef.current = synced.rows;
+        historyWatermarkRef.current = synced.watermark;
+        const data = synced.rows;
         const mappedRecords: TollRecord[] = data.map((d: any) => {
           let timestamp = Date.now();
           try {
@@ -68,7 +73,7 @@ export default function App() {
             licensePlate: d.license_plate || 'UNKNOWN',
             confidence: parseFloat(d.confidence) || 0,
             tollAmount: d.toll_amount || 0,
-            imageUrl: d.image_path ? `http://localhost:8000${d.image_path}` : '',
+            imageUrl: (d.image_path || d.thumbnail_path) ? `http://localhost:8000${d.image_path || d.thumbnail_path}` : '',
             status: d.status === 'verified' ? 'processed' : 'manual_review',
             color: 'Detected',
             makeModel: d.make_model || `Detected ${d.vehicle_type || 'Vehicle'}`,
@@ -85,11 +90,24 @@ export default function App() {
   useEffect(() => {
     fetchHistory();
     fetchSummary();
-    const interval = setInterval(() => {
-      fetchHistory();
-      fetchSummary();
-    }, 5000);
-    return () => clearInterval(interval);
+    // Re-sync (delta only) when the server reports a change, batching bursts
+    let pending: ReturnType<typeof setTimeout> | null = null;
+    const unsubscribe = subscribeDetectionEvents(event => {
+      if (event.type === 'resync') {
+        historyWatermarkRef.current = null;
+      }
+      if (!pending) {
+        pending = setTimeout(() => {
+          pending = null;
+          fetchHistory();
+          fetchSummary();
+        }, 1000);
+      }
+    });
+    return () => {
+      unsubscribe();
+      if (pending) clearTimeout(pending);
+    };
   }, []);
 
   const handleRegisterFromHistory = (plate: string) => {
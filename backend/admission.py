@@ -0,0 +1,226 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+# SLO-driven admission control for /analyze and /ws/frames.
+#
+# Every admitted frame's latency is measured against a target (p95 over a
+# short window). The oldest frame still in flight counts too, so a backlog
+# that has not produced slow answers yet already shows up. When the signal
+# exceeds the target the controller steps up one degradation level at a time,
+# and steps back down once it has stayed well below the target for a while:
+#
+#   0 normal              full pipeline
+#   1 reduced_resolution  JPEG frames are decoded smaller before YOLO and OCR
+#   2 deferred_ocr        one-off uploads skip OCR: the Detection is flagged
+#                         pending_review and its plate is read later, once the
+#                         load is gone; camera frames only OCR tracks that have
+#                         no plate reading yet
+#   3 shedding            a camera frame arriving while the same camera has one
+#                         in flight is dropped
+#   4 rejecting           new frames get a fast 503 with Retry-After, except
+#                         when nothing is in flight (so latency is still measured)
+#
+# Each level includes the ones below it.
+
+LEVELS = ("normal", "reduced_resolution", "deferred_ocr", "shedding", "rejecting")
+NORMAL, REDUCED_RESOLUTION, DEFERRED_OCR, SHEDDING, REJECTING = range(len(LEVELS))
+
+LEVEL = metrics.gauge("autotoll_admission_level", "Active degradation level (0 = normal, 4 = rejecting)")
+LEVEL_CHANGES = metrics.counter(
+    "autotoll_admission_level_changes_total", "Degradation level changes", labels=("direction",)
+)
+ADMITTED = metrics.counter("autotoll_admission_admitted_total", "Frames admitted, by degradation level", labels=("level",))
+REJECTED = metrics.counter("autotoll_admission_rejected_total", "Frames answered 503 while rejecting")
+DROPPED = metrics.counter("autotoll_admission_dropped_total", "Camera frames dropped behind a newer one while shedding")
+IN_FLIGHT = metrics.gauge("autotoll_admission_in_flight", "Admitted frames not answered yet")
+LATENCY = metrics.histogram(
+    "autotoll_admission_latency_seconds", "Latency of admitted frames",
+    buckets=[0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0],
+)
+DEFERRED = metrics.counter("autotoll_admission_ocr_deferred_total", "Detections whose OCR was deferred")
+DEFERRED_DONE = metrics.counter("autotoll_admission_ocr_rerun_total", "Deferred OCR re-runs completed")
+DEFERRED_LOST = metrics.counter(
+    "autotoll_admission_ocr_backlog_dropped_total", "Deferred OCR runs dropped from a full backlog (left to reviewers)"
+)
+
+
+class OverloadedError(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Server overloaded")
+        self.retry_after = retry_after
+
+
+class StaleFrameError(Exception):
+    pass
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class AdmissionController:
+    """Degradation level from recent latency; target_ms=0 measures only and never degrades."""
+
+    def __init__(self, target_ms=0.0, percentile=0.95, window_s=5.0, min_samples=5, raise_every_s=1.0,
+                 recover_ratio=0.7, recover_after_s=5.0, max_level=REJECTING, retry_after_s=2):
+        self.target = target_ms / 1000
+        self.percentile = percentile
+        self.window_s = window_s
+        self.min_samples = min_samples
+        self.raise_every_s = raise_every_s
+        self.recover_ratio = recover_ratio
+        self.recover_after_s = recover_after_s
+        self.max_level = max(0, min(max_level, REJECTING))
+        self.retry_after_s = retry_after_s
+        self._level = NORMAL
+        self._changed = time.monotonic()
+        self._samples = deque()       # (finished, seconds)
+        self._stages = {}             # stage -> deque of (finished, seconds)
+        self._in_flight = {}          # ticket -> (started, camera_id)
+        self._cameras = {}            # camera_id -> frames in flight
+        self._tickets = 0
+        self._lock = threading.Lock()
+        LEVEL.set(NORMAL)
+
+    @property
+    def enabled(self):
+        return self.target > 0
+
+    @property
+    def level(self):
+        with self._lock:
+            self._evaluate(time.monotonic())
+            return self._level
+
+    def _signal(self, now):
+        """(p95 of the samples since the last level change or None, age of the oldest frame in flight)."""
+        while self._samples and self._samples[0][0] < now - self.window_s:
+            self._samples.popleft()
+        since = max(now - self.window_s, self._changed)
+        recent = [seconds for finished, seconds in self._samples if finished >= since]
+        p = _percentile(recent, self.percentile) if len(recent) >= self.min_samples else None
+        oldest = now - min((started for started, _ in self._in_flight.values()), default=now)
+        return p, oldest
+
+    def _evaluate(self, now):
+        if not self.enabled:
+            return
+        p, oldest = self._signal(now)
+        held = now - self._changed
+        if max(p or 0.0, oldest) > self.target:
+            if self._level < self.max_level and held >= self.raise_every_s:
+                self._set(self._level + 1, now, "up")
+        elif self._level > NORMAL and held >= self.recover_after_s:
+            if (p is None or p < self.target * self.recover_ratio) and oldest < self.target * self.recover_ratio:
+                self._set(self._level - 1, now, "down")
+
+    def _set(self, level, now, direction):
+        print(f"Admission level {LEVELS[self._level]} -> {LEVELS[level]}")
+        self._level = level
+        self._changed = now
+        LEVEL.set(level)
+        LEVEL_CHANGES.labels(direction).inc()
+
+    @contextmanager
+    def admit(self, camera_id=None):
+        """Admit one frame for the duration of the block, yielding the degradation level to apply.
+
+        Raises OverloadedError while rejecting and StaleFrameError for a camera
+        frame that is shed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evaluate(now)
+            level = self._level
+            if level >= REJECTING and self._in_flight:
+                REJECTED.inc()
+                raise OverloadedError(self.retry_after_s)
+            if level >= SHEDDING and camera_id and self._cameras.get(camera_id):
+                DROPPED.inc()
+                raise StaleFrameError(camera_id)
+            self._tickets += 1
+            ticket = self._tickets
+            self._in_flight[ticket] = (now, camera_id)
+            if camera_id:
+                self._cameras[camera_id] = self._cameras.get(camera_id, 0) + 1
+            IN_FLIGHT.set(len(self._in_flight))
+        ADMITTED.labels(LEVELS[level]).inc()
+        try:
+            yield level
+        finally:
+            finished = time.monotonic()
+            with self._lock:
+                started, camera_id = self._in_flight.pop(ticket)
+                if camera_id:
+                    self._cameras[camera_id] -= 1
+                    if not self._cameras[camera_id]:
+                        del self._cameras[camera_id]
+                self._samples.append((finished, finished - started))
+                IN_FLIGHT.set(len(self._in_flight))
+            LATENCY.observe(finished - started)
+
+    def observe_stages(self, timings):
+        """Per-stage seconds of one frame, for the windowed breakdown in stats()."""
+        now = time.monotonic()
+        with self._lock:
+            for stage, seconds in timings.items():
+                samples = self._stages.setdefault(stage, deque())
+                samples.append((now, seconds))
+                while samples[0][0] < now - self.window_s:
+                    samples.popleft()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            self._evaluate(now)
+            p, oldest = self._signal(now)
+            stages = {
+                stage: round(_percentile([s for t, s in samples if t >= now - self.window_s], self.percentile) * 1000, 1)
+                for stage, samples in self._stages.items()
+                if samples and samples[-1][0] >= now - self.window_s
+            }
+            return {
+                "settings": {
+                    "target_ms": self.target * 1000,
+                    "percentile": self.percentile,
+                    "window_s": self.window_s,
+                    "max_level": LEVELS[self.max_level],
+                },
+                "level": self._level,
+                "mode": LEVELS[self._level],
+                "level_held_s": round(now - self._changed, 1),
+                "latency_ms": round(p * 1000, 1) if p is not None else None,
+                "oldest_in_flight_ms": round(oldest * 1000, 1),
+                "in_flight": len(self._in_flight),
+                "stage_ms": stages,
+                "metrics": metrics.snapshot("autotoll_admission_"),
+            }
+
+
+class OcrBacklog:
+    """Frames whose OCR was deferred, newest kept when full; drained once the load is gone."""
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._items = deque()
+
+    def put(self, detection_id, contents, raw_shape=None):
+        DEFERRED.inc()
+        self._items.append((detection_id, contents, raw_shape))
+        while len(self._items) > self.max_size:
+            self._items.popleft()
+            DEFERRED_LOST.inc()
+
+    def pop(self):
+        return self._items.popleft() if self._items else None
+
+    def done(self):
+        DEFERRED_DONE.inc()
+
+    def __len__(self):
+        return len(self._items)
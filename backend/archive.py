@@ -0,0 +1,355 @@
+import datetime
+import os
+import time
+import uuid
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sqlalchemy import func
+
+import metrics
+from database import ArchiveSegment, Detection
+
+# Parquet archive of old detections.
+#
+# Settled detections (anything but pending_review) older than the archive age
+# move out of the detections table into Parquet files partitioned by UTC
+# month, <root>/month=YYYY-MM/part-<first id>-<last id>-<random>.parquet,
+# rows sorted by time. The segment manifest (ArchiveSegment) is written in the same
+# transaction that deletes the rows, so a file only counts once its rows are
+# gone from the database; files left behind by a crash in between are never
+# read and are cleaned up by a later run. Every run adds a file to the months
+# it touched, so a month with more than compact_after files is rewritten as
+# one: opening a file costs far more than reading a month of rows from it.
+#
+# The rollups and the toll ledger keep counting archived detections, so the
+# dashboard and vehicle status do not change when rows move. Reports that need
+# the rows themselves (unique plates, status mix over a year) read the files
+# overlapping their range, only the columns they use, through memory maps,
+# and aggregate them together with the matching hot rows in Arrow.
+
+ROWS_ARCHIVED = metrics.counter("autotoll_archive_rows_total", "Detections moved to the Parquet archive")
+SEGMENTS_WRITTEN = metrics.counter("autotoll_archive_segments_written_total", "Parquet files written by the archiver")
+RUN_SECONDS = metrics.histogram(
+    "autotoll_archive_run_seconds", "Duration of an archival run",
+    buckets=[0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0],
+)
+REPORT_SECONDS = metrics.histogram(
+    "autotoll_archive_report_seconds", "Duration of a report over the archive and hot table",
+    buckets=[0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0],
+)
+
+SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("timestamp", pa.timestamp("us")),
+    ("updated_at", pa.timestamp("us")),
+    ("vehicle_type", pa.string()),
+    ("license_plate", pa.string()),
+    ("confidence", pa.float64()),
+    ("toll_amount", pa.int64()),
+    ("status", pa.string()),
+    ("known_vehicle_id", pa.int64()),
+    ("is_authorized", pa.int64()),
+    ("image_path", pa.string()),
+    ("thumbnail_path", pa.string()),
+    ("source_key", pa.string()),
+])
+
+# Report period -> label format; rows are grouped by their time truncated to the period
+PERIOD_FORMATS = {"day": "%Y-%m-%d", "month": "%Y-%m", "year": "%Y"}
+
+# Unreferenced files newer than this may belong to a run still in progress
+ORPHAN_AGE_S = 3600
+
+
+def _table(rows, schema):
+    """Arrow table from database result rows, column by column."""
+    return pa.table([pa.array([row[i] for row in rows], type=field.type)
+                     for i, field in enumerate(schema)], schema=schema)
+
+
+def _subschema(columns):
+    return pa.schema([SCHEMA.field(name) for name in columns])
+
+
+class DetectionArchive:
+    def __init__(self, root, batch_size=50000, compact_after=8, compression="zstd"):
+        self.root = root
+        self.batch_size = batch_size
+        self.compact_after = compact_after
+        self.compression = compression
+
+    # --- Writing ---
+
+    def archive(self, db, older_than_days):
+        """Move settled detections older than older_than_days into the archive."""
+        started = time.perf_counter()
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=older_than_days)
+        settled = (
+            Detection.timestamp < cutoff,
+            Detection.updated_at < cutoff,
+            Detection.status != "pending_review",
+        )
+        self._remove_orphans(db)
+        columns = [Detection.__table__.c[field.name] for field in SCHEMA]
+        moved = segments = 0
+        while True:
+            rows = db.query(*columns).filter(*settled).order_by(Detection.id).limit(self.batch_size).all()
+            if not rows:
+                break
+            written = self._write_batch(db, _table(rows, SCHEMA))
+            first_id, last_id = rows[0].id, rows[-1].id
+            # The same filters over the id range match exactly the rows read,
+            # unless one of them was edited (or deleted) in the meantime
+            deleted = db.query(Detection).filter(
+                Detection.id.between(first_id, last_id), *settled
+            ).delete(synchronize_session=False)
+            if deleted != len(rows):
+                db.rollback()
+                self._discard(written)
+                print(f"Archive batch {first_id}-{last_id} changed while archiving, retrying next run")
+                break
+            db.commit()
+            moved += len(rows)
+            segments += len(written)
+            ROWS_ARCHIVED.inc(len(rows))
+            SEGMENTS_WRITTEN.inc(len(written))
+        compacted = sum(self.compact(db, month) for month in self._fragmented(db))
+        RUN_SECONDS.observe(time.perf_counter() - started)
+        return {"archived": moved, "segments": segments, "compacted": compacted, "cutoff": cutoff.isoformat()}
+
+    def _write(self, db, table, first_id, last_id):
+        """Write one segment file and add its manifest row to the session; returns its path."""
+        table = table.sort_by("timestamp")
+        days = pc.cast(table["timestamp"], pa.date32())
+        first_day, last_day = pc.min(days).as_py(), pc.max(days).as_py()
+        path = f"month={first_day:%Y-%m}/part-{first_id:012d}-{last_id:012d}-{uuid.uuid4().hex[:8]}.parquet"
+        full = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        tmp = full + ".tmp"
+        pq.write_table(table, tmp, compression=self.compression)
+        os.replace(tmp, full)
+        db.add(ArchiveSegment(
+            month=f"{first_day:%Y-%m}", first_day=first_day, last_day=last_day, path=path,
+            rows=table.num_rows, first_id=first_id, last_id=last_id, bytes=os.path.getsize(full),
+        ))
+        return path
+
+    def _write_batch(self, db, table):
+        """One file per month of the batch; adds their manifest rows to the session."""
+        months = pc.floor_temporal(table["timestamp"], unit="month")
+        written = []
+        for month in pc.unique(months):
+            part = table.filter(pc.equal(months, month))
+            ids = part["id"]
+            written.append(self._write(db, part, pc.min(ids).as_py(), pc.max(ids).as_py()))
+        return written
+
+    def _fragmented(self, db):
+        """Months held in more than compact_after files."""
+        rows = db.query(ArchiveSegment.month).group_by(ArchiveSegment.month).having(
+            func.count(ArchiveSegment.id) > max(self.compact_after, 1)
+        )
+        return [month for (month,) in rows]
+
+    def compact(self, db, month):
+        """Rewrite a month held in more than compact_after files as one file; returns files merged."""
+        segments = db.query(ArchiveSegment).filter(ArchiveSegment.month == month).all()
+        if len(segments) <= max(self.compact_after, 1):
+            return 0
+        table = pa.concat_tables([self._read(segment, None) for segment in segments])
+        path = self._write(db, table, min(s.first_id for s in segments), max(s.last_id for s in segments))
+        for segment in segments:
+            db.delete(segment)
+        try:
+            db.commit()
+        except Exception:
+            # Another archiver compacted the month first
+            db.rollback()
+            self._discard([path])
+            raise
+        for segment in segments:
+            os.remove(os.path.join(self.root, segment.path))
+        return len(segments)
+
+    def _discard(self, paths):
+        # Files of a rolled back transaction
+        for path in paths:
+            os.remove(os.path.join(self.root, path))
+
+    def _remove_orphans(self, db):
+        """Delete files left by runs that crashed before committing their manifest rows."""
+        if not os.path.isdir(self.root):
+            return
+        known = {path for (path,) in db.query(ArchiveSegment.path)}
+        now = time.time()
+        for folder, _, files in os.walk(self.root):
+            for name in files:
+                full = os.path.join(folder, name)
+                path = os.path.relpath(full, self.root).replace(os.sep, "/")
+                if path not in known and now - os.path.getmtime(full) > ORPHAN_AGE_S:
+                    os.remove(full)
+
+    # --- Reading ---
+
+    def segments(self, db, start=None, end=None):
+        """Manifest rows of the segments with detections in [start, end)."""
+        query = db.query(ArchiveSegment)
+        if start is not None:
+            query = query.filter(ArchiveSegment.last_day >= start.date())
+        if end is not None:
+            query = query.filter(ArchiveSegment.first_day <= end.date())
+        return query.order_by(ArchiveSegment.first_day, ArchiveSegment.first_id).all()
+
+    def _read(self, segment, columns):
+        return pq.read_table(os.path.join(self.root, segment.path), columns=columns, memory_map=True)
+
+    def read(self, db, columns, start=None, end=None):
+        """The archived rows with timestamps in [start, end), only the given columns."""
+        schema = _subschema(columns)
+        wanted = list(dict.fromkeys([*columns, "timestamp"]))
+        tables = [self._read(segment, wanted) for segment in self.segments(db, start, end)]
+        if not tables:
+            return schema.empty_table()
+        table = pa.concat_tables(tables)
+        # Whole files were read; trim the rows outside the range
+        if start is not None:
+            table = table.filter(pc.greater_equal(table["timestamp"], pa.scalar(start, pa.timestamp("us"))))
+        if end is not None:
+            table = table.filter(pc.less(table["timestamp"], pa.scalar(end, pa.timestamp("us"))))
+        return table.select(columns)
+
+    def scan(self, db, columns):
+        """Every archived segment as a table of the given columns, one at a time."""
+        for segment in self.segments(db):
+            yield self._read(segment, columns)
+
+    # --- Totals for the rollup and ledger rebuilds ---
+
+    def rollup_totals(self, db):
+        """Archived detections summed per (hour, type) and (day, type), like rollups._totals."""
+        hourly, daily = {}, {}
+        columns = ["timestamp", "vehicle_type", "toll_amount", "confidence", "status"]
+        for table in self.scan(db, columns):
+            table = pa.table({
+                "hour": pc.floor_temporal(table["timestamp"], unit="hour"),
+                "day": pc.cast(table["timestamp"], pa.date32()),
+                "vehicle_type": pc.fill_null(table["vehicle_type"], "Unknown"),
+                "volume": pa.array([1] * table.num_rows, pa.int64()),
+                "revenue": pc.fill_null(table["toll_amount"], 0),
+                "confidence_sum": pc.fill_null(table["confidence"], 0.0),
+                "pending_review": pc.cast(pc.equal(table["status"], "pending_review"), pa.int64()),
+            })
+            for buckets, key in ((hourly, "hour"), (daily, "day")):
+                grouped = table.group_by([key, "vehicle_type"]).aggregate([
+                    ("volume", "sum"), ("revenue", "sum"), ("confidence_sum", "sum"), ("pending_review", "sum"),
+                ])
+                for row in grouped.to_pylist():
+                    totals = buckets.setdefault((row[key], row["vehicle_type"]), {
+                        "volume": 0, "revenue": 0, "confidence_sum": 0.0, "pending_review": 0,
+                    })
+                    for name in totals:
+                        totals[name] += row[f"{name}_sum"] or 0
+        return hourly, daily
+
+    def ledger_totals(self, db):
+        """Archived detections and tolls per (plate, vehicle), like ledger._expected."""
+        totals = {}
+        for table in self.scan(db, ["license_plate", "known_vehicle_id", "toll_amount"]):
+            table = pa.table({
+                "license_plate": pc.fill_null(table["license_plate"], ""),
+                "vehicle_id": pc.fill_null(table["known_vehicle_id"], 0),
+                "toll_amount": pc.fill_null(table["toll_amount"], 0),
+            })
+            grouped = table.group_by(["license_plate", "vehicle_id"]).aggregate([
+                ("toll_amount", "count"), ("toll_amount", "sum"),
+            ])
+            for row in grouped.to_pylist():
+                key = (row["license_plate"], row["vehicle_id"])
+                count, total = totals.get(key, (0, 0))
+                totals[key] = (count + row["toll_amount_count"], total + row["toll_amount_sum"])
+        return totals
+
+    def has_rows(self, db):
+        return db.query(ArchiveSegment.id).first() is not None
+
+    def stats(self, db):
+        rows, size, segments, first, last = db.query(
+            func.coalesce(func.sum(ArchiveSegment.rows), 0),
+            func.coalesce(func.sum(ArchiveSegment.bytes), 0),
+            func.count(ArchiveSegment.id),
+            func.min(ArchiveSegment.first_day),
+            func.max(ArchiveSegment.last_day),
+        ).one()
+        return {
+            "root": self.root,
+            "rows": int(rows),
+            "bytes": int(size),
+            "segments": segments,
+            "first_day": first.isoformat() if first else None,
+            "last_day": last.isoformat() if last else None,
+            **metrics.snapshot("autotoll_archive_"),
+        }
+
+
+# --- Long-range reports ---
+
+REPORT_COLUMNS = ["timestamp", "vehicle_type", "license_plate", "toll_amount", "confidence", "status"]
+
+
+def _hot_rows(db, start, end):
+    """The matching rows still in the detections table, as an Arrow table."""
+    columns = [Detection.__table__.c[name] for name in REPORT_COLUMNS]
+    rows = db.query(*columns).filter(Detection.timestamp >= start, Detection.timestamp < end).all()
+    return _table(rows, _subschema(REPORT_COLUMNS))
+
+
+def detection_report(db, archive, start, end, period="month"):
+    """Volume, revenue, unique plates, vehicle mix and status mix per period in [start, end)."""
+    started = time.perf_counter()
+    archived = archive.read(db, REPORT_COLUMNS, start, end) if archive else _subschema(REPORT_COLUMNS).empty_table()
+    hot = _hot_rows(db, start, end)
+    table = pa.concat_tables([archived, hot])
+    table = pa.table({
+        "period": pc.floor_temporal(table["timestamp"], unit=period),
+        "vehicle_type": pc.fill_null(table["vehicle_type"], "Unknown"),
+        "status": pc.fill_null(table["status"], "unknown"),
+        "license_plate": table["license_plate"],
+        "toll_amount": pc.fill_null(table["toll_amount"], 0),
+        "confidence": pc.fill_null(table["confidence"], 0.0),
+    })
+
+    totals = table.group_by("period").aggregate([
+        ("toll_amount", "count"), ("toll_amount", "sum"), ("confidence", "mean"),
+        ("license_plate", "count_distinct"),
+    ])
+    by_type = table.group_by(["period", "vehicle_type"]).aggregate([("toll_amount", "count")])
+    by_status = table.group_by(["period", "status"]).aggregate([("toll_amount", "count")])
+
+    periods = {}
+    for row in totals.to_pylist():
+        periods[row["period"]] = {
+            "period": row["period"].strftime(PERIOD_FORMATS[period]),
+            "volume": row["toll_amount_count"],
+            "revenue": row["toll_amount_sum"] or 0,
+            "avgConfidence": round((row["confidence_mean"] or 0) * 100, 1),
+            "uniquePlates": row["license_plate_count_distinct"],
+            "vehicleMix": {},
+            "statuses": {},
+        }
+    for row in by_type.to_pylist():
+        periods[row["period"]]["vehicleMix"][row["vehicle_type"]] = row["toll_amount_count"]
+    for row in by_status.to_pylist():
+        periods[row["period"]]["statuses"][row["status"]] = row["toll_amount_count"]
+
+    elapsed = time.perf_counter() - started
+    REPORT_SECONDS.observe(elapsed)
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "period": period,
+        "periods": [periods[key] for key in sorted(periods)],
+        "sources": {"archived_rows": archived.num_rows, "hot_rows": hot.num_rows},
+        "elapsed_ms": round(elapsed * 1000, 1),
+    }
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# Dynamic micro-batching for YOLO. Concurrent /analyze requests drop their
+# decoded frames into a queue; a single scheduler task collects them until the
+# batch is full or the oldest frame has waited max_wait_ms, runs the model once
+# on the whole batch and hands each frame its own result.
+
+BATCH_SIZE = metrics.histogram(
+    "autotoll_batch_size", "Frames per YOLO batch",
+    buckets=[1, 2, 4, 8, 16, 32, 64],
+)
+QUEUE_WAIT = metrics.histogram(
+    "autotoll_batch_queue_wait_seconds", "Time a frame waited before its batch ran",
+    buckets=[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0],
+)
+BATCH_LATENCY = metrics.histogram(
+    "autotoll_batch_inference_seconds", "Model time per batch",
+    buckets=[0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0],
+)
+QUEUE_DEPTH = metrics.gauge("autotoll_batch_queue_depth", "Frames waiting for a batch")
+REJECTED = metrics.counter("autotoll_batch_rejected_total", "Frames refused because the queue was full")
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class BatchScheduler:
+    def __init__(self, infer_batch, max_batch_size=8, max_wait_ms=5.0, max_queue_depth=64):
+        # infer_batch: callable taking a list of frames and returning one result per frame
+        self.infer_batch = infer_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_queue_depth = max_queue_depth
+        self._queue = None
+        self._task = None
+        # Inference runs on its own thread so the event loop keeps accepting frames
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="yolo-batch")
+
+    def settings(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+    def _ensure_started(self):
+        # Started lazily so the queue binds to the loop that serves requests
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue(maxsize=self.max_queue_depth)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, frame):
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((frame, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            REJECTED.inc()
+            raise QueueFullError("Inference queue is full")
+        QUEUE_DEPTH.set(self._queue.qsize())
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already queued before waiting for more
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            QUEUE_DEPTH.set(self._queue.qsize())
+
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                QUEUE_WAIT.observe(started - enqueued)
+            BATCH_SIZE.observe(len(batch))
+
+            frames = [frame for frame, _, _ in batch]
+            try:
+                results = await loop.run_in_executor(self._executor, self.infer_batch, frames)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                BATCH_LATENCY.observe(time.perf_counter() - started)
+
+            for (_, future, _), result in zip(batch, results):
+                # The waiting request may have been cancelled (client went away)
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        return {"settings": self.settings(), "metrics": metrics.snapshot("autotoll_batch_")}
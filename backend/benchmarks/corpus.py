@@ -0,0 +1,117 @@
+"""Synthetic lane-frame corpus for the benchmarks.
+
+Generates a reproducible set of JPEG frames (same --seed, same bytes) with a
+vehicle-like block and a plate carrying known text, plus some empty-lane
+frames, at one or more camera resolutions. manifest.json records the plate
+text and vehicle box of every frame:
+
+    python backend/benchmarks/corpus.py --out bench-corpus [--frames 200] \\
+        [--sizes 1280x720 1920x1080] [--empty 0.2] [--seed 0]
+
+The frames are not photographs; they exercise decode, detection and OCR
+costs at realistic sizes. Use recorded lane frames where accuracy matters.
+"""
+import argparse
+import json
+import os
+import random
+import string
+
+import cv2
+import numpy as np
+
+MANIFEST = "manifest.json"
+STATES = ("KA", "MH", "DL", "TN", "AP", "GJ", "RJ", "UP")
+
+
+def plate_text(rng):
+    return (f"{rng.choice(STATES)}{rng.randrange(1, 100):02d}"
+            f"{''.join(rng.choices(string.ascii_uppercase, k=2))}{rng.randrange(10000):04d}")
+
+
+def lane_frame(rng, width, height, vehicle=True):
+    """(frame, plate, box) for one synthetic frame; plate and box are None for an empty lane."""
+    np_rng = np.random.default_rng(rng.randrange(2 ** 32))
+    # Road surface: a vertical gradient plus sensor noise
+    road = np.linspace(60, 120, height, dtype=np.float32)[:, None, None]
+    frame = np.clip(road + np_rng.normal(0, 6, (height, width, 3)), 0, 255).astype(np.uint8)
+    cv2.line(frame, (width // 2, 0), (width // 2, height), (200, 200, 200), max(2, width // 200))
+    if not vehicle:
+        return frame, None, None
+
+    vw = int(width * rng.uniform(0.3, 0.55))
+    vh = int(vw * rng.uniform(0.6, 0.9))
+    x1 = rng.randrange(0, width - vw)
+    y1 = rng.randrange(height // 8, max(height // 8 + 1, height - vh))
+    x2, y2 = x1 + vw, min(height - 1, y1 + vh)
+    color = tuple(int(c) for c in np_rng.integers(30, 230, 3))
+    cv2.rectangle(frame, (x1, y1), (x2, y2), color, -1)
+    # Windscreen and wheels so the block is not a flat rectangle
+    cv2.rectangle(frame, (x1 + vw // 8, y1 + vh // 10), (x2 - vw // 8, y1 + vh // 3), (40, 40, 40), -1)
+    for wx in (x1 + vw // 6, x2 - vw // 6):
+        cv2.circle(frame, (wx, y2), vh // 8, (20, 20, 20), -1)
+
+    plate = plate_text(rng)
+    plate_w, plate_h = vw // 2, max(18, vh // 7)
+    px1, py1 = (x1 + x2 - plate_w) // 2, y2 - plate_h * 2
+    cv2.rectangle(frame, (px1, py1), (px1 + plate_w, py1 + plate_h), (255, 255, 255), -1)
+    scale = cv2.getFontScaleFromHeight(cv2.FONT_HERSHEY_SIMPLEX, int(plate_h * 0.6), 2)
+    (text_w, _), _ = cv2.getTextSize(plate, cv2.FONT_HERSHEY_SIMPLEX, scale, 2)
+    scale *= min(1.0, (plate_w - 8) / max(1, text_w))
+    cv2.putText(frame, plate, (px1 + 4, py1 + int(plate_h * 0.8)), cv2.FONT_HERSHEY_SIMPLEX,
+                scale, (0, 0, 0), 2, cv2.LINE_AA)
+    if rng.random() < 0.3:
+        # Motion blur on some frames
+        frame = cv2.blur(frame, (rng.choice((3, 5)), 1))
+    return frame, plate, [x1, y1, x2, y2]
+
+
+def generate(directory, frames=200, sizes=((1280, 720),), empty=0.2, seed=0, quality=90):
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    entries = []
+    for i in range(frames):
+        width, height = sizes[i % len(sizes)]
+        frame, plate, box = lane_frame(rng, width, height, vehicle=rng.random() >= empty)
+        name = f"frame-{i:05d}-{width}x{height}.jpg"
+        cv2.imwrite(os.path.join(directory, name), frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        entries.append({"file": name, "width": width, "height": height, "plate": plate, "box": box})
+    manifest = {"seed": seed, "frames": entries}
+    with open(os.path.join(directory, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load(directory):
+    """The manifest entries of a corpus, each with the JPEG bytes under "data"."""
+    with open(os.path.join(directory, MANIFEST)) as f:
+        entries = json.load(f)["frames"]
+    for entry in entries:
+        with open(os.path.join(directory, entry["file"]), "rb") as f:
+            entry["data"] = f.read()
+    return entries
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", required=True, help="Directory to write the corpus to")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=[(1280, 720), (1920, 1080)],
+                        help="Camera resolutions, WIDTHxHEIGHT; frames cycle through them")
+    parser.add_argument("--empty", type=float, default=0.2, help="Share of empty-lane frames")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality")
+    args = parser.parse_args()
+
+    manifest = generate(args.out, args.frames, args.sizes, args.empty, args.seed, args.quality)
+    vehicles = sum(1 for e in manifest["frames"] if e["plate"])
+    print(f"{len(manifest['frames'])} frames ({vehicles} with a vehicle) in {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Detector backend benchmark.
+
+Loads each detector variant on the same fixture images and reports, per
+batch size, the latency of one detect() call and the frames per second it
+sustains, then how far each variant's boxes drift from the torch baseline:
+
+    recall     share of baseline boxes matched (same class, IoU >= 0.5)
+    precision  share of the variant's boxes that match a baseline box
+    top_class  frames whose most confident box has the baseline's class
+    conf_delta mean confidence difference over matched boxes
+
+    python backend/benchmarks/detectors.py --images path/to/fixtures \\
+        [--variants torch onnx onnx-int8 openvino openvino-int8] \\
+        [--batch-sizes 1 4 16] [--repeat 5] [--out results.json]
+
+Export the onnx / openvino variants first (python backend/detectors.py export);
+variants that are not exported or whose runtime is missing are skipped.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from detectors import calibration_frames, load_detector
+
+VARIANTS = ("torch", "onnx", "onnx-int8", "openvino", "openvino-int8")
+MATCH_IOU = 0.5
+
+
+def iou(a, b):
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def match(baseline, boxes):
+    """Greedy one-to-one matching of same-class boxes; returns [(baseline_box, box)]."""
+    pairs, used = [], set()
+    for ref in baseline:
+        best, best_iou = None, MATCH_IOU
+        for i, box in enumerate(boxes):
+            if i in used or box[5] != ref[5]:
+                continue
+            overlap = iou(ref, box)
+            if overlap >= best_iou:
+                best, best_iou = i, overlap
+        if best is not None:
+            used.add(best)
+            pairs.append((ref, boxes[best]))
+    return pairs
+
+
+def accuracy(baseline, detections):
+    ref_total = sum(len(b) for b in baseline)
+    box_total = sum(len(b) for b in detections)
+    pairs = [p for ref, boxes in zip(baseline, detections) for p in match(ref, boxes)]
+    top = [(ref[0][5] == boxes[0][5]) if ref and boxes else (not ref and not boxes)
+           for ref, boxes in zip(baseline, detections)]
+    return {
+        "recall": len(pairs) / ref_total if ref_total else 1.0,
+        "precision": len(pairs) / box_total if box_total else 1.0,
+        "top_class": sum(top) / len(top) if top else 1.0,
+        "conf_delta": statistics.mean(box[4] - ref[4] for ref, box in pairs) if pairs else 0.0,
+    }
+
+
+def timings(detector, frames, batch_size, repeat):
+    batches = [frames[i:i + batch_size] for i in range(0, len(frames), batch_size)]
+    # Pad the last batch so every call runs at the nominal size
+    batches[-1] = (batches[-1] * batch_size)[:batch_size]
+    detector.detect(batches[0])  # warm-up
+    latencies = []
+    for _ in range(repeat):
+        for batch in batches:
+            started = time.perf_counter()
+            detector.detect(batch)
+            latencies.append(time.perf_counter() - started)
+    return {
+        "batch_ms": statistics.median(latencies) * 1000,
+        "frame_ms": statistics.median(latencies) * 1000 / batch_size,
+        "fps": batch_size * len(latencies) / sum(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", required=True, help="Directory of fixture images")
+    parser.add_argument("--model", help="PyTorch weights the exports were made from (default from config)")
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--repeat", type=int, default=5, help="Passes over the fixture set per batch size")
+    parser.add_argument("--out", help="Write results as JSON")
+    args = parser.parse_args()
+
+    frames = calibration_frames(args.images, limit=None)
+    if not frames:
+        sys.exit(f"No images found in {args.images}")
+    print(f"{len(frames)} images, {frames[0].shape[1]}x{frames[0].shape[0]} first")
+
+    results, baseline = {}, None
+    for variant in args.variants:
+        backend, _, quant = variant.partition("-")
+        try:
+            detector = load_detector(args.model, backend, int8=quant == "int8")
+        except (ImportError, OSError, ValueError) as e:
+            print(f"{variant}: skipped ({e})")
+            continue
+
+        detections = [boxes for f in frames for boxes in detector.detect([f])]
+        if baseline is None:
+            # The first variant that loads is the reference (torch by default)
+            baseline, reference = detections, variant
+        result = {"batches": {}, "accuracy": accuracy(baseline, detections), "reference": reference}
+        for size in args.batch_sizes:
+            result["batches"][size] = timings(detector, frames, size, args.repeat)
+        results[variant] = result
+
+        acc = result["accuracy"]
+        print(f"{variant} (vs {reference}): recall {acc['recall']:.3f}  precision {acc['precision']:.3f}  "
+              f"top class {acc['top_class']:.3f}  conf delta {acc['conf_delta']:+.4f}")
+        for size, t in result["batches"].items():
+            print(f"  batch {size:>3}: {t['batch_ms']:8.1f}ms/batch  {t['frame_ms']:7.1f}ms/frame  "
+                  f"{t['fps']:7.1f} frames/s")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"images": len(frames), "variants": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""End-to-end load generator for the API.
+
+Camera clients post corpus frames to /analyze back to back while dashboard
+clients poll what the frontend polls (summary, history pages and deltas,
+analytics, review queue). Reports latency percentiles, throughput and status
+codes per endpoint, plus the server's own per-stage timings:
+
+    python backend/benchmarks/load.py --corpus bench-corpus \\
+        [--analyze-clients 4] [--dashboard-clients 8] [--poll-interval 1.0] \\
+        [--duration 30] [--url http://127.0.0.1:8000] [--out load.json]
+
+Without --url a server is started against a scratch database (AUTOTOLL_*
+settings in the environment are passed on) and stopped afterwards.
+"""
+import argparse
+import datetime
+import http.client
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import corpus
+import results
+from startup import BACKEND, free_port, wait_for
+
+DASHBOARD = (
+    # (name, path, weight)
+    ("summary", "/api/summary", 3),
+    ("history", "/api/history?limit=50", 2),
+    ("history_delta", "/api/history?since={since}", 4),
+    ("analytics", "/api/analytics", 1),
+    ("review_queue", "/api/review_queue?limit=50", 1),
+)
+
+
+class Client:
+    """One keep-alive connection; reconnects after errors."""
+
+    def __init__(self, base_url):
+        parts = urllib.parse.urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        """(status, seconds); status is None when the request failed outright."""
+        started = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=120)
+            self.conn.request(method, path, body=body, headers=headers or {})
+            response = self.conn.getresponse()
+            response.read()
+            return response.status, time.perf_counter() - started
+        except (OSError, http.client.HTTPException):
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = None
+            return None, time.perf_counter() - started
+
+
+def multipart(jpeg):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="frame.jpg"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + jpeg + f"\r\n--{boundary}--\r\n".encode()
+    return body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def record(self, name, status, seconds):
+        with self.lock:
+            self.statuses[name][str(status)] += 1
+            if status is not None and status < 400:
+                self.durations[name].append(seconds)
+
+
+def camera(base_url, frames, stop, recorder, seed):
+    client = Client(base_url)
+    rng = random.Random(seed)
+    while not stop.is_set():
+        body, headers = multipart(rng.choice(frames)["data"])
+        status, seconds = client.request("POST", "/analyze", body, headers)
+        recorder.record("analyze", status, seconds)
+        if status in (429, 503):
+            # Shed by the server; back off like a camera would
+            time.sleep(0.05)
+
+
+def dashboard(base_url, poll_interval, stop, recorder, seed):
+    client = Client(base_url)
+    rng = random.Random(seed)
+    names = [d[0] for d in DASHBOARD]
+    weights = [d[2] for d in DASHBOARD]
+    paths = {d[0]: d[1] for d in DASHBOARD}
+    while not stop.is_set():
+        name = rng.choices(names, weights)[0]
+        since = (datetime.datetime.utcnow() - datetime.timedelta(seconds=30)).isoformat()
+        status, seconds = client.request("GET", paths[name].format(since=urllib.parse.quote(since)))
+        recorder.record(name, status, seconds)
+        stop.wait(poll_interval * rng.uniform(0.5, 1.5))
+
+
+def server_stages(base_url):
+    with urllib.request.urlopen(f"{base_url}/api/inference/stats", timeout=30) as response:
+        stats = json.load(response)
+    return {
+        name.replace("autotoll_stage_", "").replace("_seconds", ""): {
+            "count": h["count"], "mean_ms": h["avg"] * 1000,
+        }
+        for name, h in (stats.get("stages") or {}).items()
+    }
+
+
+def run(base_url, frames, args):
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=camera, args=(base_url, frames, stop, recorder, i))
+        for i in range(args.analyze_clients)
+    ] + [
+        threading.Thread(target=dashboard, args=(base_url, args.poll_interval, stop, recorder, 1000 + i))
+        for i in range(args.dashboard_clients)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for name in sorted(recorder.statuses):
+        summary = results.summarize(recorder.durations[name])
+        summary["ok_per_s"] = len(recorder.durations[name]) / elapsed
+        summary["statuses"] = dict(recorder.statuses[name])
+        endpoints[name] = summary
+    return {
+        "analyze_clients": args.analyze_clients,
+        "dashboard_clients": args.dashboard_clients,
+        "poll_interval": args.poll_interval,
+        "duration": elapsed,
+        "endpoints": endpoints,
+        "server_stages": server_stages(base_url),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", required=True, help="Directory written by corpus.py")
+    parser.add_argument("--url", help="Running server to load; default starts one on a scratch database")
+    parser.add_argument("--analyze-clients", type=int, default=4, help="Concurrent cameras posting frames")
+    parser.add_argument("--dashboard-clients", type=int, default=8, help="Concurrent dashboards polling")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Mean seconds between dashboard polls")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Seconds to wait for the server to be ready")
+    parser.add_argument("--out", help="Write results as JSON")
+    args = parser.parse_args()
+
+    frames = corpus.load(args.corpus)
+    server = scratch = None
+    base_url = args.url
+    try:
+        if base_url is None:
+            scratch = tempfile.mkdtemp(prefix="autotoll-load-")
+            env = dict(os.environ)
+            env["PYTHONPATH"] = os.pathsep.join(p for p in (BACKEND, env.get("PYTHONPATH")) if p)
+            env["AUTOTOLL_DATABASE_URL"] = f"sqlite:///{os.path.join(scratch, 'load.db')}"
+            port = free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND,
+                 "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+                cwd=scratch, env=env, stdout=subprocess.DEVNULL,
+            )
+        wait_for(f"{base_url}/api/health/ready", server, args.timeout)
+        out = run(base_url, frames, args)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=30)
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    for name, r in out["endpoints"].items():
+        p95 = f"{r['p95_ms']:.1f}" if r["count"] else "-"
+        print(f"{name:<14} {r['ok_per_s']:8.1f} ok/s  p95 {p95:>8} ms  {r['statuses']}")
+    for stage, s in out["server_stages"].items():
+        print(f"  stage {stage:<7} {s['mean_ms']:8.2f} ms mean over {s['count']}")
+
+    if args.out:
+        results.write(args.out, "load", out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Microbenchmarks for the per-frame pipeline stages.
+
+Times each stage in isolation on a corpus from corpus.py:
+
+    decode   cv2.imdecode (full and reduced) next to the old PIL path
+    detect   the configured detector backend, one frame per call
+    ocr      read_plate in "roi" mode (manifest box) and "full" mode, with
+             the share of plates read exactly
+    merge    merge_plate_candidates on synthetic OCR fragments
+
+    python backend/benchmarks/micro.py --corpus bench-corpus \\
+        [--stages decode detect ocr merge] [--repeat 3] [--out micro.json]
+
+Stages whose models cannot be loaded are reported as skipped.
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import config
+import corpus
+import results
+from pipeline import decode_frame, decode_image, merge_plate_candidates, read_plate
+
+STAGES = ("decode", "detect", "ocr", "merge")
+
+
+def timed(function, items, repeat):
+    durations = []
+    for _ in range(repeat):
+        for item in items:
+            started = time.perf_counter()
+            function(item)
+            durations.append(time.perf_counter() - started)
+    summary = results.summarize(durations)
+    summary["ops_per_s"] = len(durations) / sum(durations) if durations else 0.0
+    return summary
+
+
+def pil_decode(contents):
+    # The decode path /analyze used before cv2.imdecode
+    image = Image.open(io.BytesIO(contents)).convert("RGB")
+    return cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+
+
+def bench_decode(frames, repeat):
+    out = {}
+    for size in sorted({(e["width"], e["height"]) for e in frames}):
+        data = [e["data"] for e in frames if (e["width"], e["height"]) == size]
+        out[f"{size[0]}x{size[1]}"] = {
+            "pil": timed(pil_decode, data, repeat),
+            "imdecode": timed(decode_image, data, repeat),
+            "imdecode_reduced": timed(
+                lambda d: decode_frame(d, reduced=True, min_width=config.DETECTOR_IMGSZ), data, repeat
+            ),
+        }
+    return out
+
+
+def bench_detect(frames, repeat):
+    from detectors import load_detector
+    detector = load_detector()
+    images = [decode_image(e["data"]) for e in frames]
+    detector.detect(images[:1])  # warm-up
+    return {detector.backend: timed(lambda img: detector.detect([img]), images, repeat)}
+
+
+def bench_ocr(frames, repeat):
+    import easyocr
+    reader = easyocr.Reader(list(config.OCR_LANGUAGES))
+    vehicles = [e for e in frames if e["plate"]]
+    images = [(decode_image(e["data"]), [[*e["box"], 1.0, 2]], e["plate"]) for e in vehicles]
+    out = {}
+    for mode in ("roi", "full"):
+        correct = []
+
+        def read(item):
+            img, boxes, plate = item
+            correct.append(read_plate(reader, img, boxes, mode=mode) == plate)
+
+        out[mode] = timed(read, images, repeat)
+        out[mode]["plates_read"] = sum(correct) / len(correct) if correct else 0.0
+    return out
+
+
+def fragments(rng, count):
+    """OCR-like candidates: plate pieces stacked near each other plus stray text."""
+    candidates = []
+    for _ in range(count):
+        cx, cy, h = rng.uniform(0, 1280), rng.uniform(0, 720), rng.uniform(10, 40)
+        text = "".join(rng.choices("ABCDEFGHJKLMNPRSTUVWXYZ0123456789", k=rng.randrange(2, 8)))
+        candidates.append({"text": text, "cx": cx, "cy": cy, "h": h, "prob": rng.random()})
+    return candidates
+
+
+def bench_merge(repeat):
+    rng = random.Random(0)
+    out = {}
+    for count in (4, 16, 64):
+        lists = [fragments(rng, count) for _ in range(200)]
+        out[f"{count}_candidates"] = timed(merge_plate_candidates, lists, repeat)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", required=True, help="Directory written by corpus.py")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the corpus per stage")
+    parser.add_argument("--limit", type=int, default=50, help="Corpus frames used by detect and ocr")
+    parser.add_argument("--out", help="Write results as JSON")
+    args = parser.parse_args()
+
+    frames = corpus.load(args.corpus)
+    out = {}
+    for stage in args.stages:
+        try:
+            if stage == "decode":
+                out[stage] = bench_decode(frames, args.repeat)
+            elif stage == "detect":
+                out[stage] = bench_detect(frames[:args.limit], args.repeat)
+            elif stage == "ocr":
+                out[stage] = bench_ocr(frames[:args.limit], args.repeat)
+            else:
+                out[stage] = bench_merge(args.repeat)
+        except (ImportError, OSError, ValueError) as e:
+            print(f"{stage}: skipped ({e})")
+            out[stage] = {"skipped": str(e)}
+            continue
+        for key, value in results.flatten(out[stage]):
+            if key.endswith(("p50_ms", "ops_per_s", "plates_read")):
+                print(f"{stage}.{key}: {value:.3f}")
+
+    if args.out:
+        results.write(args.out, "micro", out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Full-frame vs ROI OCR benchmark.
+
+Runs YOLO once per image, then times EasyOCR on the whole frame and on the
+cropped vehicle regions, and reports how often both modes read the same plate.
+
+    python backend/benchmarks/ocr_roi.py --images path/to/fixtures [--repeat 3] [--out results.json]
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from detectors import load_detector
+from pipeline import decode_image, read_plate
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+
+
+def load_images(directory):
+    paths = []
+    for pattern in IMAGE_PATTERNS:
+        paths.extend(glob.glob(os.path.join(directory, pattern)))
+    return sorted(paths)
+
+
+def time_call(fn, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return result, min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", required=True, help="Directory of fixture frames")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per image; the fastest is kept")
+    parser.add_argument("--out", help="Write per-image results as JSON")
+    args = parser.parse_args()
+
+    paths = load_images(args.images)
+    if not paths:
+        sys.exit(f"No images found in {args.images}")
+
+    import easyocr
+    detector = load_detector()
+    reader = easyocr.Reader(config.OCR_LANGUAGES)
+
+    rows = []
+    for path in paths:
+        with open(path, "rb") as f:
+            img_cv = decode_image(f.read())
+        boxes = detector.detect([img_cv])[0]
+
+        full_plate, full_s = time_call(lambda: read_plate(reader, img_cv, mode="full"), args.repeat)
+        roi_plate, roi_s = time_call(lambda: read_plate(reader, img_cv, boxes, mode="roi"), args.repeat)
+        rows.append({
+            "image": os.path.basename(path),
+            "vehicles": len(boxes),
+            "full_plate": full_plate,
+            "roi_plate": roi_plate,
+            "full_ms": full_s * 1000,
+            "roi_ms": roi_s * 1000,
+        })
+        print(f"{rows[-1]['image']:<32} full {full_s * 1000:8.1f} ms  roi {roi_s * 1000:8.1f} ms  "
+              f"{full_plate} / {roi_plate}")
+
+    full_ms = statistics.mean(r["full_ms"] for r in rows)
+    roi_ms = statistics.mean(r["roi_ms"] for r in rows)
+    agree = sum(1 for r in rows if r["full_plate"] == r["roi_plate"])
+    summary = {
+        "images": len(rows),
+        "full_mean_ms": full_ms,
+        "roi_mean_ms": roi_ms,
+        "speedup": full_ms / roi_ms if roi_ms else None,
+        "plate_agreement": agree / len(rows),
+    }
+    print(f"\nmean full {full_ms:.1f} ms, mean roi {roi_ms:.1f} ms, "
+          f"speedup x{summary['speedup']:.2f}, plate agreement {summary['plate_agreement']:.0%}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"summary": summary, "images": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Query-plan check for the detection listing endpoints.
+
+Seeds a scratch database, runs the same queries the endpoints run and asks the
+database for their plans. Exits with status 1 if any of them scans the whole
+detections table, or sorts rows that the index should already deliver in order.
+
+    python backend/benchmarks/query_plans.py [--url sqlite://] [--rows 5000]
+
+On PostgreSQL sequential scans are disabled for the check, so it verifies
+that an index can serve each query rather than the planner's choice for a
+small table.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, Detection, Owner, Vehicle, make_engine, init_db
+from pagination import list_detections, page_detections
+
+DETECTIONS = re.compile(r"\bdetections\b")
+
+
+def seed(db, rows):
+    rng = random.Random(0)
+    now = datetime.datetime.utcnow()
+    owner = Owner(name="Fleet", contact_info="", photo_path="")
+    db.add(owner)
+    db.flush()
+    db.bulk_insert_mappings(Vehicle, [
+        {"id": i, "license_plate": f"KA{i:03d}", "make_model": "", "owner_id": owner.id} for i in range(1, 300)
+    ])
+    db.bulk_insert_mappings(Detection, [
+        {
+            "vehicle_type": rng.choice(("Car", "Bus", "Truck", "Motorcycle")),
+            "license_plate": f"KA{i % 500:03d}",
+            "confidence": round(rng.uniform(0.5, 1.0), 2),
+            "timestamp": now - datetime.timedelta(minutes=i),
+            "updated_at": now - datetime.timedelta(minutes=i),
+            "toll_amount": 50,
+            "status": "pending_review" if i % 10 == 0 else "verified",
+            "known_vehicle_id": (i % 300) or None,
+        }
+        for i in range(rows)
+    ])
+    db.commit()
+
+
+def checks(db):
+    """(endpoint, run the endpoint's queries, rows must come back in index order)"""
+    vehicle = (Detection.known_vehicle_id == 7) | (Detection.license_plate == "KA007")
+    since = (datetime.datetime.utcnow() - datetime.timedelta(minutes=5)).isoformat()
+
+    def second_page(filters):
+        first = page_detections(db, filters, 50)
+        page_detections(db, filters, 50, first["next_cursor"])
+
+    return [
+        ("/api/history", lambda: list_detections(db, [], 50), True),
+        ("/api/history (next page)", lambda: second_page([]), True),
+        ("/api/history?since=", lambda: list_detections(db, [], 50, since=since), True),
+        ("/api/review_queue", lambda: list_detections(db, [Detection.status == "pending_review"], 50), True),
+        ("/api/review_queue (next page)", lambda: second_page([Detection.status == "pending_review"]), True),
+        ("/api/review_queue?since=",
+         lambda: list_detections(db, [Detection.status == "pending_review"], 50, since=since), True),
+        ("/api/vehicles/{id}/history", lambda: page_detections(db, [vehicle], 50), False),
+        ("/api/vehicle/status/{plate}", lambda: db.query(Detection).filter(vehicle).all(), False),
+    ]
+
+
+def sqlite_problems(conn, statement, parameters, ordered):
+    problems = []
+    for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters):
+        detail = row[-1]
+        if re.match(r"SCAN detections(?! USING)", detail):
+            problems.append(detail)
+        elif ordered and "TEMP B-TREE" in detail:
+            problems.append(detail)
+    return problems
+
+
+def postgres_problems(conn, statement, parameters, ordered):
+    conn.exec_driver_sql("SET enable_seqscan = off")
+    (plan,) = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).one()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    problems = []
+
+    def walk(node):
+        if node.get("Relation Name") == "detections" and node["Node Type"] == "Seq Scan":
+            problems.append("Seq Scan on detections")
+        if ordered and node["Node Type"] in ("Sort", "Incremental Sort"):
+            problems.append(f"{node['Node Type']} on {node.get('Sort Key')}")
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="sqlite://", help="Scratch database URL (tables are dropped)")
+    parser.add_argument("--rows", type=int, default=5000, help="Detections to seed")
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    Base.metadata.drop_all(bind=engine)
+    init_db(engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    explain = postgres_problems if engine.dialect.name == "postgresql" else sqlite_problems
+
+    with Session() as db:
+        seed(db, args.rows)
+        db.connection().exec_driver_sql("ANALYZE")
+        db.commit()
+
+        captured = []
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT") and DETECTIONS.search(statement):
+                captured.append((statement, parameters))
+
+        failures = 0
+        for name, run, ordered in checks(db):
+            captured.clear()
+            run()
+            statements = list(captured)
+            with engine.connect() as conn:
+                problems = [p for s, params in statements for p in explain(conn, s, params, ordered)]
+            status = "ok"
+            if problems:
+                failures += 1
+                status = "FAIL: " + "; ".join(problems)
+            print(f"{name:<34} {len(statements)} queries  {status}")
+
+    engine.dispose()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
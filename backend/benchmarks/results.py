@@ -0,0 +1,126 @@
+"""Benchmark result files.
+
+Every suite script writes the same envelope so runs can be kept and compared
+over time:
+
+    {"suite": ..., "created_at": ..., "git_commit": ..., "python": ...,
+     "platform": ..., "cpus": ..., "settings": {AUTOTOLL_* env}, "results": {...}}
+
+Compare two runs of the same suite; exits with status 1 if any timing got
+slower (or any rate lower) by more than the tolerance:
+
+    python backend/benchmarks/results.py new.json baseline.json [--tolerance 0.15]
+
+Keys ending in _ms or _s are timings (lower is better); keys ending in
+_per_s or fps are rates (higher is better). Everything else is context.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+LOWER_IS_BETTER = ("_ms", "_s")
+HIGHER_IS_BETTER = ("_per_s", "fps")
+
+
+def git_commit():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(seconds):
+    """Latency summary of a list of durations in seconds."""
+    if not seconds:
+        return {"count": 0}
+    ms = sorted(s * 1000 for s in seconds)
+
+    def pct(q):
+        return ms[min(len(ms) - 1, int(q * len(ms)))]
+
+    return {
+        "count": len(ms),
+        "mean_ms": statistics.mean(ms),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": ms[-1],
+    }
+
+
+def write(path, suite, results):
+    envelope = {
+        "suite": suite,
+        "created_at": datetime.datetime.utcnow().isoformat() + "Z",
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {k: v for k, v in sorted(os.environ.items()) if k.startswith("AUTOTOLL_")},
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(envelope, f, indent=2, default=str)
+    return envelope
+
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else str(key))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, float(value)
+
+
+def compare(current, baseline, tolerance):
+    """Regressions of current against baseline as (key, current, baseline) tuples."""
+    before = dict(flatten(baseline["results"]))
+    regressions = []
+    for key, value in flatten(current["results"]):
+        old = before.get(key)
+        if old is None or old == 0:
+            continue
+        name = key.rsplit(".", 1)[-1]
+        if name.endswith(HIGHER_IS_BETTER):
+            if value < old * (1 - tolerance):
+                regressions.append((key, value, old))
+        elif name.endswith(LOWER_IS_BETTER):
+            if value > old * (1 + tolerance):
+                regressions.append((key, value, old))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("current", help="Result file of the new run")
+    parser.add_argument("baseline", help="Result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed change (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    with open(args.current) as f:
+        current = json.load(f)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if current["suite"] != baseline["suite"]:
+        sys.exit(f"Different suites: {current['suite']} vs {baseline['suite']}")
+
+    print(f"{current['suite']}: {current.get('git_commit') or '?'} vs {baseline.get('git_commit') or '?'}")
+    regressions = compare(current, baseline, args.tolerance)
+    for key, value, old in regressions:
+        print(f"REGRESSION {key}: {value:.3f} vs {old:.3f} ({(value - old) / old:+.0%})")
+    if not regressions:
+        print("No regressions")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
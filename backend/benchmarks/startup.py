@@ -0,0 +1,162 @@
+"""Backend startup benchmark.
+
+Starts the API in fresh processes against a scratch database and measures:
+
+    import   seconds to import main (nothing heavy should load at import)
+    live     server launch until /api/health/live answers
+    ready    server launch until /api/health/ready answers 200 (models loaded and warm)
+    first    latency of the first /analyze request once ready
+    second   latency of the request after it
+
+Medians over --runs are printed. Save a run with --out and pass it back with
+--baseline to fail (exit status 1) when a step got slower than the tolerance:
+
+    python backend/benchmarks/startup.py [--runs 3] [--out startup.json] \\
+        [--baseline startup.json] [--tolerance 0.25]
+
+AUTOTOLL_* settings in the environment (execution mode, warm-up, ...) are
+passed on to the server.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+import cv2
+
+from models import warmup_frame
+
+STEPS = ("import", "live", "ready", "first", "second")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def status(url):
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def wait_for(url, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if status(url) == 200:
+            return
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        time.sleep(0.02)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def analyze(base_url, jpeg):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="frame.jpg"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + jpeg + f"\r\n--{boundary}--\r\n".encode()
+    request = urllib.request.Request(
+        f"{base_url}/analyze", data=body, method="POST",
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+    )
+    started = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=300) as response:
+        response.read()
+    return time.perf_counter() - started
+
+
+def run_once(env, cwd, jpeg, timeout):
+    result = {}
+    out = subprocess.run(
+        [sys.executable, "-c", "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"],
+        cwd=cwd, env=env, capture_output=True, text=True, check=True,
+    )
+    result["import"] = float(out.stdout.strip().splitlines()[-1])
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND,
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=cwd, env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_for(f"{base_url}/api/health/live", server, timeout)
+        result["live"] = time.perf_counter() - started
+        wait_for(f"{base_url}/api/health/ready", server, timeout)
+        result["ready"] = time.perf_counter() - started
+        result["first"] = analyze(base_url, jpeg)
+        result["second"] = analyze(base_url, jpeg)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="Cold starts to measure")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Seconds to wait for readiness")
+    parser.add_argument("--out", help="Write results as JSON")
+    parser.add_argument("--baseline", help="Earlier --out file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown per step (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    frame, _ = warmup_frame(1280, 720)
+    jpeg = cv2.imencode(".jpg", frame)[1].tobytes()
+
+    runs = []
+    for i in range(args.runs):
+        scratch = tempfile.mkdtemp(prefix="autotoll-startup-")
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(p for p in (BACKEND, env.get("PYTHONPATH")) if p)
+        env["AUTOTOLL_DATABASE_URL"] = f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+        try:
+            runs.append(run_once(env, scratch, jpeg, args.timeout))
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        print(f"run {i + 1}: " + "  ".join(f"{step} {runs[-1][step]:.3f}s" for step in STEPS))
+
+    medians = {step: statistics.median(r[step] for r in runs) for step in STEPS}
+    print("median: " + "  ".join(f"{step} {medians[step]:.3f}s" for step in STEPS))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"runs": runs, "median": medians}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["median"]
+        regressions = [
+            f"{step}: {medians[step]:.3f}s vs {baseline[step]:.3f}s"
+            for step in STEPS
+            if step in baseline and medians[step] > baseline[step] * (1 + args.tolerance)
+        ]
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,92 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import create_engine, event, Column, Integer, String, ForeignKey, DateTime, Date, Float, Enum, Index, inspect
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import StaticPool
 import datetime
+import time
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./autotoll.db"
+import config
+import metrics
+import migrations
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+# Any SQLAlchemy URL works; SQLite (default) and PostgreSQL are the supported backends
+SQLALCHEMY_DATABASE_URL = config.DATABASE_URL
+
+def _tune_sqlite(dbapi_connection, connection_record):
+    # WAL lets dashboard reads run while a detection is being written
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.execute(f"PRAGMA mmap_size={int(config.SQLITE_MMAP_SIZE)}")
+    cursor.execute(f"PRAGMA cache_size=-{int(config.SQLITE_CACHE_KB)}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def make_engine(url):
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        options = {"connect_args": {"check_same_thread": False, "timeout": config.SQLITE_BUSY_TIMEOUT_MS / 1000}}
+        if url.database in (None, "", ":memory:"):
+            # One shared connection, otherwise every session sees its own empty database
+            options["poolclass"] = StaticPool
+        else:
+            options.update(pool_size=config.DB_POOL_SIZE, max_overflow=config.DB_MAX_OVERFLOW,
+                           pool_timeout=config.DB_POOL_TIMEOUT)
+        engine = create_engine(url, **options)
+        event.listen(engine, "connect", _tune_sqlite)
+        return engine
+
+    return create_engine(
+        url,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_recycle=config.DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+DB_CONNECTIONS_OPENED = metrics.counter("autotoll_db_connections_opened_total", "New database connections")
+DB_CHECKOUTS = metrics.counter("autotoll_db_checkouts_total", "Connections handed out by the pool")
+DB_CHECKED_OUT = metrics.gauge("autotoll_db_connections_checked_out", "Connections held by a session")
+DB_IDLE = metrics.gauge("autotoll_db_connections_idle", "Open connections waiting in the pool")
+DB_HELD = metrics.histogram(
+    "autotoll_db_connection_held_seconds", "Time a session kept its connection checked out",
+    buckets=[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0],
 )
+DB_COMMITS = metrics.counter("autotoll_db_commits_total", "Session commits")
+DB_ROLLBACKS = metrics.counter("autotoll_db_rollbacks_total", "Session rollbacks")
+
+
+def instrument(engine, session_factory):
+    """Connection pool and session metrics for an engine and its sessionmaker."""
+    def on_connect(dbapi_connection, connection_record):
+        DB_CONNECTIONS_OPENED.inc()
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_CHECKOUTS.inc()
+        DB_CHECKED_OUT.inc()
+        connection_record.info["checked_out_at"] = time.perf_counter()
+
+    def on_checkin(dbapi_connection, connection_record):
+        started = connection_record.info.pop("checked_out_at", None)
+        if started is not None:
+            DB_CHECKED_OUT.dec()
+            DB_HELD.observe(time.perf_counter() - started)
+
+    event.listen(engine, "connect", on_connect)
+    event.listen(engine, "checkout", on_checkout)
+    event.listen(engine, "checkin", on_checkin)
+    event.listen(session_factory, "after_commit", lambda session: DB_COMMITS.inc())
+    event.listen(session_factory, "after_rollback", lambda session: DB_ROLLBACKS.inc())
+    # StaticPool (in-memory SQLite) has no idle count
+    checkedin = getattr(engine.pool, "checkedin", None)
+    DB_IDLE.set_function(checkedin if checkedin else lambda: 0)
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+instrument(engine, SessionLocal)
 
 Base = declarative_base()
 
@@ -40,17 +118,95 @@ class Detection(Base):
     id = Column(Integer, primary_key=True, index=True)
     vehicle_type = Column(String)
     license_plate = Column(String)
-    confidence = Column(String)
+    confidence = Column(Float)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    # Bumped on every edit so clients can poll for changes (?since=)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, index=True)
     
     # New Columns
     toll_amount = Column(Integer, default=0)
-    status = Column(String, default="verified") # 'verified', 'pending_review'
-    image_path = Column(String, nullable=True)
+    status = Column(Enum(*migrations.DETECTION_STATUSES, name="detection_status", create_constraint=True), default="verified")
+    image_path = Column(String, nullable=True, index=True) # Full frame; may be evicted by retention
+    thumbnail_path = Column(String, nullable=True, index=True) # Plate crop for the review UI
 
     # Optional: Link to a known vehicle if found
     known_vehicle_id = Column(Integer, ForeignKey("vehicles.id"), nullable=True)
     is_authorized = Column(Integer, default=0) # 0=Unknown, 1=Authorized, -1=Unauthorized
+    # Queue job that wrote the row, so a redelivered job does not write it twice
+    source_key = Column(String, nullable=True, unique=True, index=True)
+
+    # Access paths of the listing endpoints; see migrations.DETECTION_INDEXES
+    __table_args__ = tuple(
+        Index(name, *columns) for name, columns in migrations.DETECTION_INDEXES
+        if len(columns) > 1
+    )
+
+class DetectionTombstone(Base):
+    __tablename__ = "detection_tombstones"
+
+    # Deleted detection ids, kept for a while so delta polls can drop them
+    detection_id = Column(Integer, primary_key=True)
+    deleted_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+# --- Analytics Rollups ---
+# Pre-aggregated detection counts, maintained by rollups.py whenever a
+# detection is created, edited or deleted, so the dashboard never scans
+# the detections table.
+
+class HourlyRollup(Base):
+    __tablename__ = "detection_rollup_hourly"
+
+    bucket = Column(DateTime, primary_key=True) # Start of the hour (UTC)
+    vehicle_type = Column(String, primary_key=True)
+    volume = Column(Integer, default=0)
+    revenue = Column(Integer, default=0)
+    confidence_sum = Column(Float, default=0.0)
+    pending_review = Column(Integer, default=0)
+
+class DailyRollup(Base):
+    __tablename__ = "detection_rollup_daily"
+
+    day = Column(Date, primary_key=True) # UTC date
+    vehicle_type = Column(String, primary_key=True)
+    volume = Column(Integer, default=0)
+    revenue = Column(Integer, default=0)
+    confidence_sum = Column(Float, default=0.0)
+    pending_review = Column(Integer, default=0)
+
+# --- Toll Ledger ---
+# Running toll balance per (plate, registered vehicle), maintained by
+# ledger.py alongside the rollups, so a status lookup reads a couple of
+# ledger rows instead of every detection of the vehicle.
+
+class TollLedger(Base):
+    __tablename__ = "toll_ledger"
+    __table_args__ = (Index("ix_toll_ledger_vehicle_id", "vehicle_id"),)
+
+    license_plate = Column(String, primary_key=True) # Detection.license_plate ("" if none)
+    vehicle_id = Column(Integer, primary_key=True)   # Detection.known_vehicle_id (0 if none)
+    detections = Column(Integer, default=0)
+    total_due = Column(Integer, default=0)
+
+# --- Detection Archive ---
+# Parquet files holding detections moved out of the detections table by
+# archive.py; a file is part of the archive once its row here is committed.
+
+class ArchiveSegment(Base):
+    __tablename__ = "detection_archive_segments"
+
+    id = Column(Integer, primary_key=True)
+    month = Column(String, index=True) # YYYY-MM (UTC) of every detection in the file
+    first_day = Column(Date, index=True)
+    last_day = Column(Date, index=True)
+    path = Column(String, unique=True) # Relative to the archive root
+    rows = Column(Integer)
+    first_id = Column(Integer)
+    last_id = Column(Integer)
+    bytes = Column(Integer)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
-def init_db():
-    Base.metadata.create_all(bind=engine)
+def init_db(bind=None):
+    bind = engine if bind is None else bind
+    fresh = not inspect(bind).has_table("detections")
+    Base.metadata.create_all(bind=bind)
+    migrations.upgrade(bind, fresh=fresh)
@@ -0,0 +1,135 @@
+import datetime
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+import config
+import metrics
+from database import Detection, Vehicle
+from ledger import apply_ledger
+from pipeline import TOLL_RATES, record_stages
+from rollups import apply_detection
+
+# Turning an analysed frame into a Detection row. Shared by /analyze, the
+# realtime tracker and offline jobs so they all price, flag and match plates
+# the same way; callers decide how the row is written.
+
+REGISTERED_MATCHES = metrics.counter(
+    "autotoll_detection_registered_matches_total", "Detections matched to a registered plate, by match kind",
+    labels=("kind",),
+)
+
+
+def find_known_vehicle(db, plate_index, license_plate):
+    """Match an OCR reading against the registry, tolerating common OCR misreads.
+
+    Returns (vehicle, match); match.kind tells how the plate was found.
+    """
+    match = plate_index.lookup(license_plate)
+    if match is None:
+        return None, None
+    return db.get(Vehicle, match.vehicle_id), match
+
+
+def build_detection(db, plate_index, image_store, vehicle_type, confidence, license_plate, contents,
+                    raw_shape=None, box=None, timestamp=None, pending=False):
+    """Queue the frame for storage and return an unsaved (detection, known_vehicle).
+
+    pending flags the detection for review whatever its confidence (its plate
+    has not been read yet, see set_plate).
+    """
+    # Check if vehicle is authorized/known
+    started = time.perf_counter()
+    known_vehicle, match = find_known_vehicle(db, plate_index, license_plate)
+    record_stages({"lookup": time.perf_counter() - started})
+    if known_vehicle:
+        REGISTERED_MATCHES.labels(match.kind).inc()
+        # Record the registered plate rather than the OCR reading
+        license_plate = known_vehicle.license_plate
+    is_authorized = 1 if known_vehicle else 0
+
+    # Determine Toll Amount (INR)
+    toll_amount = TOLL_RATES.get(vehicle_type, 50)
+
+    # Determine Status
+    status = 'verified'
+    if confidence < 0.90 or pending: # Bumped for testing
+        status = 'pending_review'
+
+    # Save the image for Review Queue / History (written in the background)
+    keep_full = config.STORAGE_KEEP_FULL != "pending_review" or status == 'pending_review'
+    image_path, thumbnail_path = image_store.store_frame(contents, raw_shape, box, keep_full)
+
+    detection = Detection(
+        vehicle_type=vehicle_type,
+        license_plate=license_plate,
+        confidence=round(float(confidence), 2),
+        timestamp=timestamp or datetime.datetime.utcnow(),
+        known_vehicle_id=known_vehicle.id if known_vehicle else None,
+        is_authorized=is_authorized,
+        toll_amount=toll_amount,
+        status=status,
+        image_path=image_path,
+        thumbnail_path=thumbnail_path
+    )
+    return detection, known_vehicle
+
+
+def written_detection(db, source_key):
+    """(detection, known_vehicle, False) for the row a queue job already wrote, or None."""
+    detection = db.query(Detection).filter(Detection.source_key == source_key).first()
+    if detection is None:
+        return None
+    known_vehicle = db.get(Vehicle, detection.known_vehicle_id) if detection.known_vehicle_id else None
+    return detection, known_vehicle, False
+
+
+def write_detection(db, plate_index, image_store, vehicle_type, confidence, license_plate, contents,
+                    raw_shape=None, box=None, source_key=None, pending=False):
+    """Write one Detection with its rollup and ledger updates. Returns (detection, known_vehicle, created).
+
+    A source_key (the queue job id) makes the write idempotent: a job delivered
+    twice gets back the Detection written the first time.
+    """
+    if source_key:
+        written = written_detection(db, source_key)
+        if written:
+            return written
+    detection, known_vehicle = build_detection(
+        db, plate_index, image_store, vehicle_type, confidence, license_plate, contents, raw_shape, box,
+        pending=pending,
+    )
+    detection.source_key = source_key
+    db.add(detection)
+    apply_detection(db, detection)
+    apply_ledger(db, detection)
+    started = time.perf_counter()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another worker finished the same job first; its (content-addressed)
+        # images are the same files
+        db.rollback()
+        written = written_detection(db, source_key) if source_key else None
+        if written is None:
+            raise
+        return written
+    record_stages({"commit": time.perf_counter() - started})
+    return detection, known_vehicle, True
+
+
+def set_plate(db, plate_index, detection, license_plate):
+    """Record a plate read after the fact (deferred OCR) on a detection still awaiting review.
+
+    Returns whether the plate was recorded; the caller commits. Detections that
+    were reviewed or already have a plate are left alone.
+    """
+    if not license_plate or detection.license_plate or detection.status != "pending_review":
+        return False
+    known_vehicle, _ = find_known_vehicle(db, plate_index, license_plate)
+    apply_ledger(db, detection, -1)
+    detection.license_plate = known_vehicle.license_plate if known_vehicle else license_plate
+    detection.known_vehicle_id = known_vehicle.id if known_vehicle else None
+    detection.is_authorized = 1 if known_vehicle else 0
+    apply_ledger(db, detection, 1)
+    return True
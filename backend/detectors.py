@@ -0,0 +1,290 @@
+"""Vehicle detector backends.
+
+Every backend takes a list of BGR frames and returns, per frame, the vehicle
+boxes as [x1, y1, x2, y2, conf, cls_id], most confident first (the format of
+pipeline.vehicle_boxes), so the rest of the pipeline does not care which one
+runs:
+
+    torch     ultralytics + PyTorch on the .pt weights (the original path)
+    onnx      ONNX Runtime on an exported .onnx model
+    openvino  OpenVINO on an exported IR model
+
+onnx and openvino can run INT8-quantized exports (AUTOTOLL_DETECTOR_INT8).
+Neither imports torch or ultralytics at runtime: letterboxing and NMS are done
+here with numpy/OpenCV, matching ultralytics' defaults. Export the models once
+from the .pt weights:
+
+    python backend/detectors.py export [--backend onnx|openvino|all] [--int8] \\
+        [--calibration path/to/lane/frames]
+"""
+import argparse
+import glob
+import os
+import sys
+import threading
+
+import cv2
+import numpy as np
+
+import config
+from pipeline import VEHICLE_CLASSES, vehicle_boxes
+
+BACKENDS = ("torch", "onnx", "openvino")
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+
+# ultralytics predict() defaults, so exported backends agree with the torch path
+CONF_THRESHOLD = 0.25
+IOU_THRESHOLD = 0.7
+
+
+def artifact_path(model_path, backend, int8=False):
+    """Where the export for a backend lives, next to the .pt weights."""
+    stem = os.path.splitext(model_path)[0]
+    if backend == "torch":
+        return model_path
+    if backend == "onnx":
+        return f"{stem}-int8.onnx" if int8 else f"{stem}.onnx"
+    if backend == "openvino":
+        # ultralytics' export directory names
+        return f"{stem}_int8_openvino_model" if int8 else f"{stem}_openvino_model"
+    raise ValueError(f"Unknown detector backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+
+
+_buffers = threading.local()
+
+
+def input_buffer(batch_size, size):
+    """This thread's reusable NCHW input tensor for a batch size.
+
+    Each worker process or inference thread keeps one tensor per batch size
+    instead of allocating (and faulting in) a new one for every call.
+    """
+    by_shape = getattr(_buffers, "by_shape", None)
+    if by_shape is None:
+        by_shape = _buffers.by_shape = {}
+    if batch_size not in by_shape:
+        by_shape[batch_size] = np.empty((batch_size, 3, size, size), dtype=np.float32)
+    return by_shape[batch_size]
+
+
+def preprocess(frames, size, reuse=False):
+    """Letterbox frames into an NCHW float32 RGB batch in [0, 1].
+
+    Returns (batch, geometry) with the (ratio, (pad_x, pad_y), (h, w)) of each
+    frame. Each frame is resized (keeping the aspect ratio) and written straight
+    into its slot of the batch; with reuse=True that batch is input_buffer(),
+    valid until this thread's next call.
+    """
+    if reuse:
+        batch = input_buffer(len(frames), size)
+    else:
+        batch = np.empty((len(frames), 3, size, size), dtype=np.float32)
+    geometry = []
+    for slot, frame in zip(batch, frames):
+        h, w = frame.shape[:2]
+        ratio = min(size / h, size / w)
+        new_w, new_h = round(w * ratio), round(h * ratio)
+        if (new_w, new_h) != (w, h):
+            frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        left, top = round((size - new_w) / 2 - 0.1), round((size - new_h) / 2 - 0.1)
+        slot.fill(114 / 255.0)
+        # BGR HWC uint8 to RGB CHW float, in one pass
+        np.multiply(frame[..., ::-1].transpose(2, 0, 1), 1 / 255.0,
+                    out=slot[:, top:top + new_h, left:left + new_w], casting="unsafe")
+        geometry.append((ratio, (left, top), (h, w)))
+    return batch, geometry
+
+
+def postprocess(output, geometry, conf_threshold=CONF_THRESHOLD, iou_threshold=IOU_THRESHOLD):
+    """YOLOv8 head output (batch, 4 + classes, anchors) to vehicle boxes per frame."""
+    results = []
+    for preds, (ratio, (pad_x, pad_y), (h, w)) in zip(output, geometry):
+        preds = preds.T
+        scores = preds[:, 4:]
+        cls_ids = scores.argmax(axis=1)
+        confs = scores[np.arange(len(scores)), cls_ids]
+        keep = (confs >= conf_threshold) & np.isin(cls_ids, VEHICLE_CLASSES)
+        preds, cls_ids, confs = preds[keep], cls_ids[keep], confs[keep]
+        if not len(preds):
+            results.append([])
+            continue
+
+        cx, cy, bw, bh = preds[:, 0], preds[:, 1], preds[:, 2], preds[:, 3]
+        # Per-class NMS, as ultralytics does by default
+        xywh = np.stack([cx - bw / 2, cy - bh / 2, bw, bh], axis=1)
+        kept = cv2.dnn.NMSBoxesBatched(xywh.tolist(), confs.tolist(), cls_ids.tolist(), 0.0, iou_threshold)
+        boxes = []
+        for i in np.asarray(kept).reshape(-1):
+            x1 = (cx[i] - bw[i] / 2 - pad_x) / ratio
+            y1 = (cy[i] - bh[i] / 2 - pad_y) / ratio
+            x2 = (cx[i] + bw[i] / 2 - pad_x) / ratio
+            y2 = (cy[i] + bh[i] / 2 - pad_y) / ratio
+            boxes.append([
+                float(min(max(x1, 0), w)), float(min(max(y1, 0), h)),
+                float(min(max(x2, 0), w)), float(min(max(y2, 0), h)),
+                float(confs[i]), int(cls_ids[i]),
+            ])
+        boxes.sort(key=lambda b: b[4], reverse=True)
+        results.append(boxes)
+    return results
+
+
+class TorchDetector:
+    backend = "torch"
+
+    def __init__(self, model_path):
+        from ultralytics import YOLO
+        self.model = YOLO(model_path)
+
+    def detect(self, frames):
+        # One call for the whole list; ultralytics returns one Results per frame
+        return [vehicle_boxes([r]) for r in self.model(frames, verbose=False)]
+
+
+class OnnxDetector:
+    backend = "onnx"
+
+    def __init__(self, path, imgsz=640, threads=0):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.imgsz = imgsz
+
+    def detect(self, frames):
+        batch, geometry = preprocess(frames, self.imgsz, reuse=True)
+        (output,) = self.session.run(None, {self.input_name: batch})
+        return postprocess(output, geometry)
+
+
+class OpenVinoDetector:
+    backend = "openvino"
+
+    def __init__(self, path, imgsz=640, threads=0):
+        import openvino as ov
+        core = ov.Core()
+        if os.path.isdir(path):
+            path = glob.glob(os.path.join(path, "*.xml"))[0]
+        # One request per call (batched frames included) should use every core
+        properties = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            properties["INFERENCE_NUM_THREADS"] = threads
+        self.model = core.compile_model(core.read_model(path), "CPU", properties)
+        self.imgsz = imgsz
+
+    def detect(self, frames):
+        batch, geometry = preprocess(frames, self.imgsz, reuse=True)
+        output = self.model(batch)[self.model.output(0)]
+        return postprocess(output, geometry)
+
+
+def load_detector(model_path=None, backend=None, int8=None, imgsz=None, threads=None):
+    """Build the configured detector; arguments left as None come from config."""
+    model_path = config.YOLO_MODEL_PATH if model_path is None else model_path
+    backend = config.DETECTOR_BACKEND if backend is None else backend
+    int8 = config.DETECTOR_INT8 if int8 is None else int8
+    imgsz = config.DETECTOR_IMGSZ if imgsz is None else imgsz
+    threads = config.DETECTOR_THREADS if threads is None else threads
+
+    if backend == "torch":
+        if int8:
+            raise ValueError("INT8 needs the onnx or openvino detector backend")
+        return TorchDetector(model_path)
+    path = artifact_path(model_path, backend, int8)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"{path} not found; run `python backend/detectors.py export --backend {backend}"
+            f"{' --int8' if int8 else ''}` first"
+        )
+    if backend == "onnx":
+        return OnnxDetector(path, imgsz, threads)
+    return OpenVinoDetector(path, imgsz, threads)
+
+
+# --- Export ---
+
+def calibration_frames(directory, limit=300):
+    paths = []
+    for pattern in IMAGE_PATTERNS:
+        paths.extend(glob.glob(os.path.join(directory, pattern)))
+    frames = [cv2.imread(p) for p in sorted(paths)[:limit]]
+    return [f for f in frames if f is not None]
+
+
+def quantize_onnx(fp32_path, int8_path, calibration_dir, imgsz):
+    """Static QDQ INT8 quantization calibrated on real lane frames."""
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    frames = calibration_frames(calibration_dir)
+    if not frames:
+        raise ValueError(f"No calibration images found in {calibration_dir}")
+
+    class Frames(CalibrationDataReader):
+        def __init__(self, input_name):
+            self.batches = iter(preprocess([f], imgsz)[0] for f in frames)
+            self.input_name = input_name
+
+        def get_next(self):
+            batch = next(self.batches, None)
+            return None if batch is None else {self.input_name: batch}
+
+    import onnxruntime as ort
+    input_name = ort.InferenceSession(fp32_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    quantize_static(
+        fp32_path, int8_path, Frames(input_name),
+        quant_format=QuantFormat.QDQ, per_channel=True,
+        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+    )
+    return int8_path
+
+
+def export(model_path, backend, int8=False, imgsz=640, calibration=None, data=None):
+    """Export the .pt weights for a backend; returns the artifact path."""
+    target = artifact_path(model_path, backend, int8)
+    if backend == "onnx":
+        fp32 = artifact_path(model_path, "onnx")
+        if not os.path.exists(fp32):
+            from ultralytics import YOLO
+            # Dynamic axes so one model serves every batch size
+            fp32 = YOLO(model_path).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+        if not int8:
+            return fp32
+        if not calibration:
+            raise ValueError("--calibration is required for an INT8 ONNX export")
+        return quantize_onnx(fp32, target, calibration, imgsz)
+    if backend == "openvino":
+        from ultralytics import YOLO
+        # ultralytics calibrates INT8 through NNCF on a dataset yaml (coco8 by default)
+        options = {"int8": True, "data": data or "coco8.yaml"} if int8 else {}
+        return YOLO(model_path).export(format="openvino", imgsz=imgsz, dynamic=True, **options)
+    raise ValueError(f"Nothing to export for the {backend} backend")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the vehicle detector for the onnx / openvino backends.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    cmd = subcommands.add_parser("export", help="Export the .pt weights")
+    cmd.add_argument("--model", default=config.YOLO_MODEL_PATH, help="PyTorch weights to export")
+    cmd.add_argument("--backend", choices=("onnx", "openvino", "all"), default="all")
+    cmd.add_argument("--int8", action="store_true", help="Also write the INT8-quantized variant")
+    cmd.add_argument("--imgsz", type=int, default=config.DETECTOR_IMGSZ, help="Input size the model is exported for")
+    cmd.add_argument("--calibration", help="Directory of lane frames for ONNX INT8 calibration")
+    cmd.add_argument("--data", help="Dataset yaml for OpenVINO INT8 calibration (default coco8.yaml)")
+    args = parser.parse_args()
+
+    backends = ("onnx", "openvino") if args.backend == "all" else (args.backend,)
+    for backend in backends:
+        variants = (False, True) if args.int8 else (False,)
+        for int8 in variants:
+            try:
+                path = export(args.model, backend, int8, args.imgsz, args.calibration, args.data)
+            except (ImportError, ValueError) as e:
+                sys.exit(f"{backend}{' int8' if int8 else ''}: {e}")
+            print(f"{backend}{' int8' if int8 else ''}: {path}")
+
+
+if __name__ == "__main__":
+    main()
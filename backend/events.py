@@ -0,0 +1,112 @@
+import asyncio
+import datetime
+import itertools
+import json
+from collections import deque
+
+import metrics
+
+# In-process pub/sub for detection changes. Write endpoints publish
+# detection.created / detection.updated / detection.deleted events once; every
+# connected dashboard gets them from its own bounded queue through the
+# Server-Sent Events stream, instead of each tab polling the database.
+
+EVENTS_PUBLISHED = metrics.counter("autotoll_events_published_total", "Events published on the bus")
+EVENTS_DROPPED = metrics.counter("autotoll_events_dropped_total", "Events discarded because a subscriber fell behind")
+SUBSCRIBERS = metrics.gauge("autotoll_events_subscribers", "Connected event stream clients")
+
+# Sent instead of the missed events when a subscriber falls too far behind;
+# the client should reload its listings.
+RESYNC = "resync"
+
+
+def _json_default(value):
+    # Match FastAPI's ISO format so clients can merge events with listing rows
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+class Subscription:
+    def __init__(self, buffer_size):
+        self.queue = asyncio.Queue(maxsize=buffer_size)
+
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too slow: throw away the backlog and ask the client to resync
+            EVENTS_DROPPED.inc(self.queue.qsize())
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"id": event["id"], "type": RESYNC, "data": {}})
+
+
+class EventBus:
+    def __init__(self, client_buffer=256, replay_size=1024):
+        self.client_buffer = client_buffer
+        self._ids = itertools.count(1)
+        self._recent = deque(maxlen=replay_size)
+        self._subscribers = set()
+        self._loop = None
+
+    def bind(self, loop):
+        # Publishers running on the thread pool hop back onto this loop
+        self._loop = loop
+
+    def publish(self, event_type, data):
+        if self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._fan_out(event_type, data)
+        else:
+            self._loop.call_soon_threadsafe(self._fan_out, event_type, data)
+
+    def _fan_out(self, event_type, data):
+        event = {"id": next(self._ids), "type": event_type, "data": data}
+        self._recent.append(event)
+        EVENTS_PUBLISHED.inc()
+        for subscription in self._subscribers:
+            subscription.deliver(event)
+
+    def subscribe(self, last_event_id=None):
+        subscription = Subscription(self.client_buffer)
+        if last_event_id is not None:
+            # Reconnecting client: replay what it missed, or resync if that is gone
+            if self._recent and self._recent[0]["id"] > last_event_id + 1:
+                subscription.deliver({"id": self._recent[-1]["id"], "type": RESYNC, "data": {}})
+            else:
+                for event in self._recent:
+                    if event["id"] > last_event_id:
+                        subscription.deliver(event)
+        self._subscribers.add(subscription)
+        SUBSCRIBERS.set(len(self._subscribers))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscribers.discard(subscription)
+        SUBSCRIBERS.set(len(self._subscribers))
+
+    async def stream(self, last_event_id=None, keepalive_s=15.0):
+        """Yield Server-Sent Events text for one client until it disconnects."""
+        subscription = self.subscribe(last_event_id)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), keepalive_s)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                yield (
+                    f"id: {event['id']}\n"
+                    f"event: {event['type']}\n"
+                    f"data: {json.dumps(event['data'], default=_json_default)}\n\n"
+                )
+        finally:
+            self.unsubscribe(subscription)
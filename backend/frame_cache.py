@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+import metrics
+from motion import grayscale_thumbnail
+from pipeline import jpeg_size
+
+# Result cache for repeated and near-duplicate frames.
+#
+# Retries, a car waiting at the barrier and frozen camera feeds resubmit
+# (nearly) the same frame over and over. Each frame is reduced to a
+# difference hash: a small grayscale thumbnail where every bit says whether
+# a pixel is brighter than its right-hand neighbour. Frames whose hashes
+# differ in at most max_distance bits look the same, so the result computed
+# for the first one is reused instead of running YOLO, OCR and storage again.
+# Hashes are only compared with recent frames from the same camera and of the
+# same resolution, so cached boxes are always in the right pixel space.
+
+HITS = metrics.counter("autotoll_frame_cache_hits_total", "Frames answered from the duplicate frame cache")
+MISSES = metrics.counter("autotoll_frame_cache_misses_total", "Frames with no near-duplicate in the cache")
+ENTRIES = metrics.gauge("autotoll_frame_cache_entries", "Frame results currently cached")
+
+
+def _pack(bits):
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def frame_hash(contents, raw_shape=None, hash_size=16, min_contrast=2):
+    """Difference hash of a frame: (size, bits, strong).
+
+    bits and strong are hash_size * hash_size bit integers; strong marks the
+    pixel pairs that differ by more than min_contrast grey levels, since
+    elsewhere (flat road, sky) the bit is decided by sensor and JPEG noise.
+    """
+    gray = grayscale_thumbnail(contents, raw_shape, hash_size * 4)
+    if raw_shape is not None:
+        size = (raw_shape[1], raw_shape[0])
+    else:
+        size = jpeg_size(contents) or gray.shape[::-1]
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA).astype(np.int16)
+    diff = small[:, 1:] - small[:, :-1]
+    return size, _pack(diff > 0), _pack(np.abs(diff) > min_contrast)
+
+
+def hash_distance(a, b):
+    """Bits that differ between two frame hashes where either frame has a clear edge."""
+    if a[0] != b[0]:
+        return None
+    return ((a[1] ^ b[1]) & (a[2] | b[2])).bit_count()
+
+
+class FrameCache:
+    def __init__(self, max_distance=3, hash_size=16, ttl=10.0, per_camera=4, max_cameras=256):
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.ttl = ttl
+        self.per_camera = per_camera
+        self.max_cameras = max_cameras
+        self._cameras = OrderedDict()  # camera_id -> OrderedDict(hash -> (expires, value))
+        self._lock = threading.Lock()
+        self._size = 0
+
+    def hash(self, contents, raw_shape=None):
+        return frame_hash(contents, raw_shape, self.hash_size)
+
+    def lookup(self, camera_id, key):
+        """The value cached for a near-duplicate of the frame with this hash, or None."""
+        now = time.monotonic()
+        with self._lock:
+            entries = self._cameras.get(camera_id)
+            if entries:
+                for cached, (expires, value) in list(entries.items()):
+                    if expires <= now:
+                        del entries[cached]
+                        self._size -= 1
+                        continue
+                    distance = hash_distance(cached, key)
+                    if distance is not None and distance <= self.max_distance:
+                        entries.move_to_end(cached)
+                        self._cameras.move_to_end(camera_id)
+                        ENTRIES.set(self._size)
+                        HITS.inc()
+                        return value
+                ENTRIES.set(self._size)
+        MISSES.inc()
+        return None
+
+    def store(self, camera_id, key, value):
+        with self._lock:
+            entries = self._cameras.get(camera_id)
+            if entries is None:
+                entries = self._cameras[camera_id] = OrderedDict()
+                while len(self._cameras) > self.max_cameras:
+                    _, dropped = self._cameras.popitem(last=False)
+                    self._size -= len(dropped)
+            self._cameras.move_to_end(camera_id)
+            self._size += key not in entries
+            entries[key] = (time.monotonic() + self.ttl, value)
+            entries.move_to_end(key)
+            while len(entries) > self.per_camera:
+                entries.popitem(last=False)
+                self._size -= 1
+            ENTRIES.set(self._size)
+
+    def stats(self):
+        return {
+            "settings": {
+                "max_distance": self.max_distance,
+                "hash_bits": self.hash_size * self.hash_size,
+                "ttl": self.ttl,
+                "per_camera": self.per_camera,
+                "max_cameras": self.max_cameras,
+            },
+            "cameras": len(self._cameras),
+            "metrics": metrics.snapshot("autotoll_frame_cache_"),
+        }
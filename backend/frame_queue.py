@@ -0,0 +1,486 @@
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from sqlalchemy import (
+    Column, Float, Index, Integer, LargeBinary, MetaData, String, Table, Text,
+    and_, delete, exists, func, insert, or_, select, update,
+)
+
+import metrics
+from batching import QueueFullError
+
+# Durable frame queue for the "queue" execution mode.
+#
+# The API enqueues every frame as a job and waits for its result; standalone
+# workers (queue_worker.py), as many as wanted on any number of machines,
+# claim jobs under a lease and post results back. Delivery is at-least-once:
+# when a worker dies its lease runs out and the job is handed out again, so
+# the Detection a job writes is keyed by the job id and written only once.
+# Jobs of one camera (their stream) are handed out one at a time in enqueue
+# order, which keeps tracking fed in frame order; jobs without a stream
+# (one-off uploads) go to whichever worker is free.
+#
+# Backends: any SQLAlchemy URL (a local SQLite file by default, or
+# PostgreSQL to share it between machines), or redis:// for Redis or any
+# server speaking its protocol (the redis package is then required).
+
+ENQUEUED = metrics.counter("autotoll_queue_jobs_enqueued_total", "Frames put on the job queue")
+DELIVERED = metrics.counter("autotoll_queue_jobs_delivered_total", "Job results handed back to the waiting request")
+FAILED = metrics.counter("autotoll_queue_jobs_failed_total", "Jobs a worker gave up on")
+TIMED_OUT = metrics.counter("autotoll_queue_jobs_timed_out_total", "Requests that stopped waiting for their job")
+REJECTED = metrics.counter("autotoll_queue_jobs_rejected_total", "Frames refused because too many were waiting")
+WAITING = metrics.gauge("autotoll_queue_waiting", "Requests waiting for a job result")
+WAIT_SECONDS = metrics.histogram(
+    "autotoll_queue_wait_seconds", "Time from enqueue to result",
+    buckets=[0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0],
+)
+
+
+class QueueTimeoutError(Exception):
+    pass
+
+
+class JobFailedError(Exception):
+    pass
+
+
+class NoWorkersError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, id, kind, stream, payload, meta, attempts):
+        self.id = id
+        self.kind = kind
+        self.stream = stream
+        self.payload = payload
+        self.meta = meta
+        self.attempts = attempts
+
+
+def worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+# --- SQL backend ---
+
+_meta = MetaData()
+frame_jobs = Table(
+    "frame_jobs", _meta,
+    Column("seq", Integer, primary_key=True, autoincrement=True),
+    Column("id", String(32), nullable=False, unique=True),
+    Column("kind", String(16), nullable=False),
+    Column("stream", String, nullable=True),
+    Column("state", String(8), nullable=False),  # queued, leased, done, failed
+    Column("payload", LargeBinary, nullable=True),
+    Column("meta", Text, nullable=True),
+    Column("result", Text, nullable=True),
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("worker", String, nullable=True),
+    Column("lease_until", Float, nullable=True),
+    Column("finished_at", Float, nullable=True),
+    Index("ix_frame_jobs_state_seq", "state", "seq"),
+    Index("ix_frame_jobs_stream_seq", "stream", "seq"),
+)
+queue_workers = Table(
+    "frame_queue_workers", _meta,
+    Column("id", String, primary_key=True),
+    Column("last_seen", Float, nullable=False),
+    Column("info", Text, nullable=True),
+)
+
+
+class SqlFrameQueue:
+    def __init__(self, url, max_attempts=3):
+        from database import make_engine
+        self.url = url
+        self.engine = make_engine(url)
+        self.max_attempts = max_attempts
+
+    def setup(self):
+        _meta.create_all(self.engine)
+
+    def enqueue(self, job_id, kind, stream, payload, meta=None):
+        with self.engine.begin() as conn:
+            conn.execute(insert(frame_jobs).values(
+                id=job_id, kind=kind, stream=stream, state="queued", payload=payload,
+                meta=json.dumps(meta) if meta else None, attempts=0,
+            ))
+
+    def _claim_one(self, worker_id, lease_s):
+        now = time.time()
+        j = frame_jobs.alias("j")
+        earlier = frame_jobs.alias("earlier")
+        # Only the oldest unfinished job of a stream may run
+        blocked = exists().where(
+            earlier.c.stream == j.c.stream, earlier.c.seq < j.c.seq,
+            earlier.c.state.in_(("queued", "leased")),
+        )
+        candidate = select(j.c.seq).where(
+            or_(j.c.state == "queued", and_(j.c.state == "leased", j.c.lease_until < now)),
+            or_(j.c.stream.is_(None), ~blocked),
+        ).order_by(j.c.seq).limit(1)
+        if self.engine.dialect.name == "postgresql":
+            candidate = candidate.with_for_update(skip_locked=True)
+        stmt = update(frame_jobs).where(frame_jobs.c.seq == candidate.scalar_subquery()).values(
+            state="leased", worker=worker_id, lease_until=now + lease_s, attempts=frame_jobs.c.attempts + 1,
+        ).returning(
+            frame_jobs.c.id, frame_jobs.c.kind, frame_jobs.c.stream, frame_jobs.c.payload,
+            frame_jobs.c.meta, frame_jobs.c.attempts,
+        )
+        with self.engine.begin() as conn:
+            return conn.execute(stmt).first()
+
+    def claim(self, worker_id, lease_s):
+        """Lease the next runnable job, or None when there is none."""
+        while True:
+            row = self._claim_one(worker_id, lease_s)
+            if row is None:
+                return None
+            if row.attempts > self.max_attempts:
+                self.complete(row.id, error=f"Gave up after {row.attempts - 1} attempts")
+                continue
+            return Job(row.id, row.kind, row.stream, row.payload, json.loads(row.meta) if row.meta else {}, row.attempts)
+
+    def extend(self, job_id, worker_id, lease_s):
+        with self.engine.begin() as conn:
+            conn.execute(update(frame_jobs).where(
+                frame_jobs.c.id == job_id, frame_jobs.c.worker == worker_id, frame_jobs.c.state == "leased",
+            ).values(lease_until=time.time() + lease_s))
+
+    def complete(self, job_id, result=None, error=None):
+        # The first answer wins; a redelivered copy finishing later is ignored
+        with self.engine.begin() as conn:
+            conn.execute(update(frame_jobs).where(
+                frame_jobs.c.id == job_id, frame_jobs.c.state.in_(("queued", "leased")),
+            ).values(
+                state="failed" if error else "done", payload=None, finished_at=time.time(),
+                result=json.dumps({"error": error} if error else {"result": result}),
+            ))
+
+    def take_results(self, job_ids):
+        """{job_id: (ok, result or error)} for finished jobs, which are removed."""
+        with self.engine.begin() as conn:
+            rows = conn.execute(select(frame_jobs.c.id, frame_jobs.c.result).where(
+                frame_jobs.c.id.in_(job_ids), frame_jobs.c.state.in_(("done", "failed")),
+            )).all()
+            if rows:
+                conn.execute(delete(frame_jobs).where(frame_jobs.c.id.in_([r.id for r in rows])))
+        out = {}
+        for row in rows:
+            value = json.loads(row.result)
+            out[row.id] = ("error" not in value, value.get("result", value.get("error")))
+        return out
+
+    def cancel(self, job_id):
+        with self.engine.begin() as conn:
+            conn.execute(delete(frame_jobs).where(frame_jobs.c.id == job_id, frame_jobs.c.state == "queued"))
+
+    def heartbeat(self, worker_id, info):
+        with self.engine.begin() as conn:
+            conn.execute(delete(queue_workers).where(queue_workers.c.id == worker_id))
+            conn.execute(insert(queue_workers).values(id=worker_id, last_seen=time.time(), info=json.dumps(info)))
+
+    def workers(self, max_age):
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(queue_workers).where(queue_workers.c.last_seen >= time.time() - max_age))
+            return {row.id: json.loads(row.info or "{}") for row in rows}
+
+    def purge(self, older_than):
+        """Drop results nobody collected and workers gone for longer than older_than seconds."""
+        cutoff = time.time() - older_than
+        with self.engine.begin() as conn:
+            conn.execute(delete(frame_jobs).where(
+                frame_jobs.c.state.in_(("done", "failed")), frame_jobs.c.finished_at < cutoff,
+            ))
+            conn.execute(delete(queue_workers).where(queue_workers.c.last_seen < cutoff))
+
+    def depth(self):
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(frame_jobs.c.state, func.count()).group_by(frame_jobs.c.state))
+            return {state: count for state, count in rows}
+
+    def close(self):
+        self.engine.dispose()
+
+
+# --- Redis backend ---
+#
+# job:<id>       hash: kind, stream, seq, payload, meta, attempts, worker
+# queued         sorted set of job ids by enqueue sequence
+# leased         sorted set of job ids by lease expiry (ms)
+# stream_owner   hash: stream -> id of its job currently leased
+# result:<id>    finished job's result, kept for result_ttl seconds
+# workers        hash: worker id -> heartbeat JSON
+
+_CLAIM = """
+local p, now, lease_until, worker = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3]), ARGV[4]
+local max_attempts, scan, ttl = tonumber(ARGV[5]), tonumber(ARGV[6]), tonumber(ARGV[7])
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', p .. 'leased', '-inf', now)) do
+  redis.call('ZREM', p .. 'leased', id)
+  local job = p .. 'job:' .. id
+  local stream = redis.call('HGET', job, 'stream')
+  if stream and stream ~= '' and redis.call('HGET', p .. 'stream_owner', stream) == id then
+    redis.call('HDEL', p .. 'stream_owner', stream)
+  end
+  local seq = redis.call('HGET', job, 'seq')
+  if seq then redis.call('ZADD', p .. 'queued', seq, id) end
+end
+for _, id in ipairs(redis.call('ZRANGE', p .. 'queued', 0, scan - 1)) do
+  local job = p .. 'job:' .. id
+  local stream = redis.call('HGET', job, 'stream')
+  if not stream then
+    redis.call('ZREM', p .. 'queued', id)
+  elseif stream == '' or redis.call('HEXISTS', p .. 'stream_owner', stream) == 0 then
+    redis.call('ZREM', p .. 'queued', id)
+    local attempts = redis.call('HINCRBY', job, 'attempts', 1)
+    if attempts > max_attempts then
+      redis.call('SET', p .. 'result:' .. id,
+        cjson.encode({error = 'Gave up after ' .. (attempts - 1) .. ' attempts'}), 'EX', ttl)
+      redis.call('DEL', job)
+    else
+      if stream ~= '' then redis.call('HSET', p .. 'stream_owner', stream, id) end
+      redis.call('ZADD', p .. 'leased', lease_until, id)
+      redis.call('HSET', job, 'worker', worker)
+      local fields = redis.call('HMGET', job, 'kind', 'stream', 'payload', 'meta')
+      return {id, fields[1], fields[2], fields[3], fields[4], attempts}
+    end
+  end
+end
+return false
+"""
+
+_COMPLETE = """
+local p, id, result, ttl = ARGV[1], ARGV[2], ARGV[3], tonumber(ARGV[4])
+local job = p .. 'job:' .. id
+local stream = redis.call('HGET', job, 'stream')
+if not stream then return 0 end
+redis.call('ZREM', p .. 'leased', id)
+redis.call('ZREM', p .. 'queued', id)
+if stream ~= '' and redis.call('HGET', p .. 'stream_owner', stream) == id then
+  redis.call('HDEL', p .. 'stream_owner', stream)
+end
+redis.call('DEL', job)
+redis.call('SET', p .. 'result:' .. id, result, 'EX', ttl)
+return 1
+"""
+
+_EXTEND = """
+local p, id, worker, lease_until = ARGV[1], ARGV[2], ARGV[3], tonumber(ARGV[4])
+if redis.call('HGET', p .. 'job:' .. id, 'worker') == worker and redis.call('ZSCORE', p .. 'leased', id) then
+  redis.call('ZADD', p .. 'leased', lease_until, id)
+end
+return 0
+"""
+
+
+class RedisFrameQueue:
+    def __init__(self, url, max_attempts=3, prefix="autotoll:frames:", result_ttl=300, scan=1000):
+        import redis
+        self.url = url
+        self.client = redis.Redis.from_url(url)
+        self.max_attempts = max_attempts
+        self.prefix = prefix
+        self.result_ttl = result_ttl
+        self.scan = scan
+        self._claim = self.client.register_script(_CLAIM)
+        self._complete = self.client.register_script(_COMPLETE)
+        self._extend = self.client.register_script(_EXTEND)
+
+    def setup(self):
+        self.client.ping()
+
+    def enqueue(self, job_id, kind, stream, payload, meta=None):
+        p = self.prefix
+        seq = self.client.incr(p + "seq")
+        with self.client.pipeline() as pipe:
+            pipe.hset(p + "job:" + job_id, mapping={
+                "kind": kind, "stream": stream or "", "seq": seq, "payload": payload,
+                "meta": json.dumps(meta or {}), "attempts": 0,
+            })
+            pipe.zadd(p + "queued", {job_id: seq})
+            pipe.execute()
+
+    def claim(self, worker_id, lease_s):
+        now = int(time.time() * 1000)
+        row = self._claim(args=[
+            self.prefix, now, now + int(lease_s * 1000), worker_id, self.max_attempts, self.scan, self.result_ttl,
+        ])
+        if not row:
+            return None
+        job_id, kind, stream, payload, meta, attempts = row
+        return Job(job_id.decode(), kind.decode(), stream.decode() or None, payload, json.loads(meta), int(attempts))
+
+    def extend(self, job_id, worker_id, lease_s):
+        self._extend(args=[self.prefix, job_id, worker_id, int((time.time() + lease_s) * 1000)])
+
+    def complete(self, job_id, result=None, error=None):
+        value = json.dumps({"error": error} if error else {"result": result})
+        self._complete(args=[self.prefix, job_id, value, self.result_ttl])
+
+    def take_results(self, job_ids):
+        keys = [self.prefix + "result:" + job_id for job_id in job_ids]
+        values = self.client.mget(keys)
+        done = [(job_id, key, value) for job_id, key, value in zip(job_ids, keys, values) if value is not None]
+        if done:
+            self.client.delete(*[key for _, key, _ in done])
+        out = {}
+        for job_id, _, value in done:
+            value = json.loads(value)
+            out[job_id] = ("error" not in value, value.get("result", value.get("error")))
+        return out
+
+    def cancel(self, job_id):
+        if self.client.zrem(self.prefix + "queued", job_id):
+            self.client.delete(self.prefix + "job:" + job_id)
+
+    def heartbeat(self, worker_id, info):
+        self.client.hset(self.prefix + "workers", worker_id, json.dumps({**info, "last_seen": time.time()}))
+
+    def workers(self, max_age):
+        now = time.time()
+        out = {}
+        for worker_id, value in self.client.hgetall(self.prefix + "workers").items():
+            info = json.loads(value)
+            if now - info.pop("last_seen", 0) <= max_age:
+                out[worker_id.decode()] = info
+        return out
+
+    def purge(self, older_than):
+        # Results expire on their own; only departed workers need removing
+        now = time.time()
+        gone = [
+            worker_id for worker_id, value in self.client.hgetall(self.prefix + "workers").items()
+            if now - json.loads(value).get("last_seen", 0) > older_than
+        ]
+        if gone:
+            self.client.hdel(self.prefix + "workers", *gone)
+
+    def depth(self):
+        return {
+            "queued": self.client.zcard(self.prefix + "queued"),
+            "leased": self.client.zcard(self.prefix + "leased"),
+        }
+
+    def close(self):
+        self.client.close()
+
+
+def open_queue(url, max_attempts=3):
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisFrameQueue(url, max_attempts)
+    return SqlFrameQueue(url, max_attempts)
+
+
+# --- API side ---
+
+class QueueClient:
+    """Enqueues frames from the API and hands each request its job's result.
+
+    One poller thread collects the results of every waiting request in a
+    single backend call per tick.
+    """
+
+    mode = "queue"
+
+    def __init__(self, queue, max_pending=64, timeout=30.0, poll_interval=0.01, worker_timeout=15.0):
+        self.queue = queue
+        self.max_pending = max(1, max_pending)
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.worker_timeout = worker_timeout
+        self._waiting = {}  # job_id -> (loop, future)
+        self._workers = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.queue.setup()
+        self._workers = self.queue.workers(self.worker_timeout)
+        self._thread = threading.Thread(target=self._poll, name="frame-queue", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.queue.close()
+
+    async def submit(self, kind, contents, stream=None, meta=None):
+        """Run one job on a queue worker and return its result."""
+        if len(self._waiting) >= self.max_pending:
+            REJECTED.inc()
+            raise QueueFullError("Inference queue is full")
+        if not self._workers:
+            raise NoWorkersError("No queue workers are running")
+
+        loop = asyncio.get_running_loop()
+        job_id = uuid.uuid4().hex
+        future = loop.create_future()
+        self._waiting[job_id] = (loop, future)
+        WAITING.set(len(self._waiting))
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self.queue.enqueue, job_id, kind, stream, bytes(contents), meta)
+            ENQUEUED.inc()
+            ok, value = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            TIMED_OUT.inc()
+            # Not started yet: nobody needs it any more. Running: it still completes.
+            await asyncio.to_thread(self.queue.cancel, job_id)
+            raise QueueTimeoutError("No queue worker answered in time")
+        finally:
+            self._waiting.pop(job_id, None)
+            WAITING.set(len(self._waiting))
+        WAIT_SECONDS.observe(time.perf_counter() - started)
+        if not ok:
+            FAILED.inc()
+            raise JobFailedError(value)
+        DELIVERED.inc()
+        return value
+
+    def _poll(self):
+        last_workers = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - last_workers >= 1.0:
+                    self._workers = self.queue.workers(self.worker_timeout)
+                    last_workers = time.monotonic()
+                job_ids = list(self._waiting)
+                if job_ids:
+                    for job_id, outcome in self.queue.take_results(job_ids).items():
+                        waiter = self._waiting.get(job_id)
+                        if waiter:
+                            loop, future = waiter
+                            loop.call_soon_threadsafe(_resolve, future, outcome)
+            except Exception as e:
+                print(f"Frame queue error: {e}")
+                self._stop.wait(1.0)
+            self._stop.wait(self.poll_interval)
+
+    def stats(self):
+        try:
+            depth = self.queue.depth()
+        except Exception as e:
+            depth = {"error": str(e)}
+        return {
+            "settings": {
+                "backend": type(self.queue).__name__,
+                "max_pending": self.max_pending,
+                "timeout": self.timeout,
+            },
+            "waiting": len(self._waiting),
+            "depth": depth,
+            "workers": self._workers or {},
+            "metrics": metrics.snapshot("autotoll_queue_"),
+        }
+
+
+def _resolve(future, outcome):
+    if not future.done():
+        future.set_result(outcome)
@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, func, or_, select
+
+import metrics
+from database import Detection, TollLedger
+from rollups import upsert
+
+# Incrementally maintained toll ledger behind /api/vehicle/status.
+#
+# A vehicle's status covers every detection of its plate plus every detection
+# matched to the registered vehicle. The ledger keeps one row per
+# (plate, vehicle) pair, updated in the same transaction as the detection
+# (+1 on insert, -1 before delete, -1/+1 around an edit, like the rollups).
+# Each detection sits in exactly one row, so summing the rows whose plate or
+# vehicle matches gives the same totals as the old scan over detections, from
+# an index lookup on each key that touches one or two rows.
+#
+# Hot plates are kept in a small LRU cache. Every session that changes the
+# ledger records the keys it touched, and committing drops the cached status
+# of those plates and vehicles.
+
+CACHE_HITS = metrics.counter("autotoll_ledger_cache_hits_total", "Vehicle status lookups served from the ledger cache")
+CACHE_MISSES = metrics.counter("autotoll_ledger_cache_misses_total", "Vehicle status lookups read from the ledger table")
+CACHE_INVALIDATIONS = metrics.counter("autotoll_ledger_cache_invalidations_total", "Cached statuses dropped after a ledger write")
+
+_TOUCHED = "ledger_keys"
+
+
+def _key(detection):
+    return detection.license_plate or "", detection.known_vehicle_id or 0
+
+
+def _touch(db, keys):
+    db.info.setdefault(_TOUCHED, set()).update(keys)
+
+
+def apply_ledger(db, detection, sign=1):
+    """Add (sign=1) or remove (sign=-1) one detection from the ledger."""
+    plate, vehicle_id = key = _key(detection)
+    upsert(db, TollLedger, {"license_plate": plate, "vehicle_id": vehicle_id},
+           {"detections": sign, "total_due": sign * (detection.toll_amount or 0)})
+    _touch(db, [key])
+
+
+def apply_ledgers(db, detections):
+    """Add a batch of new detections to the ledger with one upsert per account."""
+    totals = {}
+    for detection in detections:
+        row = totals.setdefault(_key(detection), {"detections": 0, "total_due": 0})
+        row["detections"] += 1
+        row["total_due"] += detection.toll_amount or 0
+    for (plate, vehicle_id), deltas in totals.items():
+        upsert(db, TollLedger, {"license_plate": plate, "vehicle_id": vehicle_id}, deltas)
+    _touch(db, totals)
+
+
+def read_status(db, plate, vehicle_id=None):
+    """(history_count, total_due) for a plate and, if registered, its vehicle."""
+    where = TollLedger.license_plate == plate
+    if vehicle_id:
+        where = or_(where, TollLedger.vehicle_id == vehicle_id)
+    count, total = db.execute(
+        select(func.coalesce(func.sum(TollLedger.detections), 0),
+               func.coalesce(func.sum(TollLedger.total_due), 0)).where(where)
+    ).one()
+    return int(count), int(total)
+
+
+def _expected(db, archive=None):
+    """Ledger rows recomputed from the raw detections, archived ones included."""
+    plate = func.coalesce(Detection.license_plate, "")
+    vehicle_id = func.coalesce(Detection.known_vehicle_id, 0)
+    rows = db.query(
+        plate, vehicle_id, func.count(Detection.id), func.coalesce(func.sum(Detection.toll_amount), 0)
+    ).group_by(plate, vehicle_id)
+    expected = {(p, v): (int(count), int(total)) for p, v, count, total in rows}
+    if archive is not None:
+        for key, (count, total) in archive.ledger_totals(db).items():
+            have = expected.get(key, (0, 0))
+            expected[key] = (have[0] + count, have[1] + total)
+    return expected
+
+
+def rebuild_ledger(db, archive=None):
+    """Recompute the ledger from the raw detections (backfill / repair)."""
+    expected = _expected(db, archive)
+    db.query(TollLedger).delete()
+    db.bulk_insert_mappings(TollLedger, [
+        {"license_plate": p, "vehicle_id": v, "detections": count, "total_due": total}
+        for (p, v), (count, total) in expected.items()
+    ])
+    db.commit()
+    return {"ledger_rows": len(expected)}
+
+
+def reconcile_ledger(db, fix=False, limit=100, archive=None):
+    """Compare the ledger with the raw detections; rebuild it when fix is set and they differ."""
+    expected = _expected(db, archive)
+    actual = {
+        (row.license_plate, row.vehicle_id): (row.detections or 0, row.total_due or 0)
+        for row in db.query(TollLedger)
+    }
+    mismatched = []
+    for key in expected.keys() | actual.keys():
+        want, have = expected.get(key, (0, 0)), actual.get(key, (0, 0))
+        if want != have:
+            mismatched.append({
+                "license_plate": key[0], "vehicle_id": key[1],
+                "ledger": {"detections": have[0], "total_due": have[1]},
+                "detections": {"detections": want[0], "total_due": want[1]},
+            })
+    result = {"accounts": len(expected), "mismatched": len(mismatched), "examples": mismatched[:limit]}
+    if fix and mismatched:
+        result.update(rebuild_ledger(db, archive))
+    result["fixed"] = bool(fix and mismatched)
+    return result
+
+
+def ensure_ledger(db, archive=None):
+    """Backfill the ledger once for databases that predate it."""
+    has_ledger = db.query(TollLedger).first() is not None
+    has_detections = db.query(Detection.id).first() is not None or (archive is not None and archive.has_rows(db))
+    if has_detections and not has_ledger:
+        print("Backfilling toll ledger...")
+        rebuild_ledger(db, archive)
+
+
+class LedgerCache:
+    """LRU cache of vehicle statuses keyed by (plate, vehicle_id).
+
+    watch() hooks a session factory so committed ledger writes invalidate
+    the plates and vehicles they touched. Entries also expire after ttl
+    seconds, which bounds staleness from writers in other processes (the
+    offline CLI). A read that raced with an invalidation is not cached.
+    """
+
+    def __init__(self, max_size=4096, ttl=30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def watch(self, session_factory):
+        event.listen(session_factory, "after_commit", self._after_commit)
+        event.listen(session_factory, "after_rollback", lambda session: session.info.pop(_TOUCHED, None))
+
+    def _after_commit(self, session):
+        keys = session.info.pop(_TOUCHED, None)
+        if keys:
+            self.invalidate(keys)
+
+    def invalidate(self, keys):
+        plates = {plate for plate, _ in keys}
+        vehicles = {vehicle_id for _, vehicle_id in keys if vehicle_id}
+        with self._lock:
+            self._generation += 1
+            stale = [k for k in self._entries if k[0] in plates or k[1] in vehicles]
+            for k in stale:
+                del self._entries[k]
+        CACHE_INVALIDATIONS.inc(len(stale))
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def status(self, db, plate, vehicle_id=None):
+        """(history_count, total_due), from the cache or one ledger query."""
+        key = (plate, vehicle_id or 0)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                CACHE_HITS.inc()
+                return entry[1]
+            generation = self._generation
+        CACHE_MISSES.inc()
+
+        value = read_status(db, plate, vehicle_id)
+        if self.max_size > 0:
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = (now + self.ttl, value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        return {"size": size, "max_size": self.max_size, **metrics.snapshot("autotoll_ledger_")}
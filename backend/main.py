@@ -1,29 +1,103 @@
-from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException, WebSocket, Request, Response
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 import uvicorn
-from ultralytics import YOLO
-import easyocr
-import cv2
-import numpy as np
-from PIL import Image
-import io
+import asyncio
+from contextlib import asynccontextmanager
 import os
 import shutil
-import uuid
+import tempfile
 import datetime
-from sqlalchemy import func, Float
-import sqlalchemy
-import pandas as pd
+import time
+from sqlalchemy import func
 
 # Import Database Models
-from database import SessionLocal, engine, init_db, Owner, Vehicle, Detection
+from database import SessionLocal, engine, init_db, Owner, Vehicle, Detection, HourlyRollup, DailyRollup
+from rollups import apply_detection, rebuild_rollups, ensure_rollups
+from ledger import LedgerCache, apply_ledger, rebuild_ledger, reconcile_ledger, ensure_ledger
+from archive import DetectionArchive, detection_report, PERIOD_FORMATS
+from pagination import (
+    page_detections, list_detections, page_by_id, page_detection_ids, record_tombstone, detection_to_dict,
+    OWNER_COLUMNS, VEHICLE_COLUMNS,
+)
+from pipeline import decode_frame, classify_boxes, read_plate, matches_any, record_stages, scale_boxes, TOLL_RATES
+from batching import BatchScheduler, QueueFullError
+from workers import WorkerPool, PoolBusyError
+from frame_queue import QueueClient, QueueTimeoutError, NoWorkersError, JobFailedError, open_queue
+from tracker import TrackManager
+from stream import StreamSession
+from motion import MotionGate
+from frame_cache import FrameCache
+from events import EventBus
+from plate_index import PlateIndex
+from storage import ImageStore, evict_full_images
+from registry_import import RegistryImporter, ImportFileError, file_kind, check_columns
+from detections import write_detection, find_known_vehicle, set_plate
+from offline import OfflineAnalyzer, OfflineFileError, source_kind, probe
+from models import ModelRegistry, ModelsNotReadyError, record_inference
+from profiler import SlowRequestProfiler
+from admission import (
+    AdmissionController, OcrBacklog, OverloadedError, StaleFrameError,
+    LEVELS, NORMAL, REDUCED_RESOLUTION, DEFERRED_OCR,
+)
+import config
+import metrics
+
+# Registered plates are matched in memory on every frame (loaded at startup)
+plate_index = PlateIndex(max_distance=config.PLATE_FUZZY_MAX_DISTANCE)
 
-# Initialize DB Tables
-init_db()
+# Vehicle statuses of hot plates; committed ledger writes invalidate them
+ledger_cache = LedgerCache(max_size=config.LEDGER_CACHE_SIZE, ttl=config.LEDGER_CACHE_TTL_S)
+ledger_cache.watch(SessionLocal)
+
+# Old settled detections move to Parquet files; see archive.py
+detection_archive = DetectionArchive(
+    config.ARCHIVE_DIR, batch_size=config.ARCHIVE_BATCH_SIZE, compact_after=config.ARCHIVE_COMPACT_AFTER,
+)
 
-app = FastAPI()
+def prepare_database():
+    # Initialize DB Tables
+    init_db()
+    with SessionLocal() as db:
+        ensure_rollups(db, detection_archive)
+        ensure_ledger(db, detection_archive)
+        plate_index.load(db.query(Vehicle.license_plate, Vehicle.id).yield_per(50000))
+
+@asynccontextmanager
+async def lifespan(app):
+    # Startup work lives here rather than at import time, so importing main
+    # stays cheap for worker processes, reload=True restarts and tools
+    await run_in_threadpool(prepare_database)
+    loop = asyncio.get_running_loop()
+    event_bus.bind(loop)
+    tasks = [loop.create_task(flush_lost_tracks())]
+    if config.STORAGE_FULL_IMAGE_DAYS > 0:
+        tasks.append(loop.create_task(evict_images()))
+    if config.ARCHIVE_AFTER_DAYS > 0:
+        tasks.append(loop.create_task(archive_detections()))
+    if admission.enabled:
+        tasks.append(loop.create_task(rerun_deferred_ocr()))
+
+    if config.MODEL_BACKGROUND_LOAD:
+        # Liveness answers at once; readiness follows once the models are warm
+        loop.run_in_executor(None, model_registry.load)
+    else:
+        await run_in_threadpool(model_registry.load)
+
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        model_registry.shutdown()
+        offline_analyzer.shutdown()
+        registry_importer.shutdown()
+        image_store.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS
 app.add_middleware(
@@ -34,6 +108,45 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+HTTP_REQUESTS = metrics.counter(
+    "autotoll_http_requests_total", "HTTP requests by route and status", labels=("method", "route", "status")
+)
+HTTP_LATENCY = metrics.histogram(
+    "autotoll_http_request_seconds", "HTTP request latency until the response starts",
+    buckets=[0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0],
+    labels=("method", "route"),
+)
+HTTP_IN_FLIGHT = metrics.gauge("autotoll_http_requests_in_flight", "HTTP requests being handled")
+
+profiler = None
+if config.PROFILE_SLOW_REQUEST_MS > 0:
+    profiler = SlowRequestProfiler(
+        config.PROFILE_SLOW_REQUEST_MS,
+        interval_ms=config.PROFILE_INTERVAL_MS,
+        directory=config.PROFILE_DIR,
+        keep=config.PROFILE_KEEP,
+    )
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    started = time.perf_counter()
+    token = profiler.start() if profiler else None
+    HTTP_IN_FLIGHT.inc()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        # Label by route template, not the raw path, so ids do not explode the series
+        route = request.scope.get("route")
+        route = getattr(route, "path", "unmatched")
+        HTTP_REQUESTS.labels(request.method, route, status).inc()
+        HTTP_LATENCY.labels(request.method, route).observe(time.perf_counter() - started)
+        if profiler:
+            await run_in_threadpool(profiler.finish, token, f"{request.method} {route}")
+
 # Ensure uploads directory exists
 UPLOAD_DIR = "uploads"
 if not os.path.exists(UPLOAD_DIR):
@@ -42,6 +155,40 @@ if not os.path.exists(UPLOAD_DIR):
 # Mount uploads directory to serve images
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
+# Frames and photos are written by a background thread; see storage.py
+image_store = ImageStore(
+    UPLOAD_DIR,
+    SessionLocal,
+    quality=config.STORAGE_JPEG_QUALITY,
+    max_width=config.STORAGE_MAX_WIDTH,
+    thumb_width=config.STORAGE_THUMB_WIDTH,
+    queue_depth=config.STORAGE_QUEUE_DEPTH,
+)
+
+async def evict_images():
+    # Retention: drop old full frames of detections that no longer need review
+    while True:
+        await asyncio.sleep(config.STORAGE_EVICT_INTERVAL_S)
+        db = SessionLocal()
+        try:
+            await run_in_threadpool(evict_full_images, db, image_store, config.STORAGE_FULL_IMAGE_DAYS)
+        except Exception as e:
+            print(f"Image retention error: {e}")
+        finally:
+            db.close()
+
+async def archive_detections():
+    # Lifecycle: move old settled detections out of the hot table
+    while True:
+        await asyncio.sleep(config.ARCHIVE_INTERVAL_S)
+        db = SessionLocal()
+        try:
+            await run_in_threadpool(detection_archive.archive, db, config.ARCHIVE_AFTER_DAYS)
+        except Exception as e:
+            print(f"Detection archive error: {e}")
+        finally:
+            db.close()
+
 # Dependency to get DB session
 def get_db():
     db = SessionLocal()
@@ -51,14 +198,224 @@ def get_db():
         db.close()
 
 # Load Models
-# YOLOv8n (nano) is small and fast. It will download on first run.
-model = YOLO('yolov8n.pt') 
-reader = easyocr.Reader(['en'])
+# In "process" mode the worker processes own the models and the API process
+# stays light; in "queue" mode standalone workers (queue_worker.py) do, on
+# this machine or others; otherwise YOLO is shared and micro-batched in this
+# process.
+# Either way every endpoint goes through model_registry, which loads (and
+# warms up) the models from the lifespan; see models.py.
+batch_scheduler = None
+worker_pool = None
+queue_client = None
+
+def detect_batch(frames):
+    # One detector call for the whole batch; each frame also gets its share of the model time
+    detector, _ = model_registry.require()
+    started = time.perf_counter()
+    try:
+        detections = detector.detect(frames)
+    except Exception:
+        record_inference(len(frames), failed=True)
+        raise
+    record_inference(len(frames))
+    detect_s = (time.perf_counter() - started) / len(frames)
+    return [(boxes, detect_s) for boxes in detections]
+
+warmup_shape = (config.MODEL_WARMUP_WIDTH, config.MODEL_WARMUP_HEIGHT) if config.MODEL_WARMUP else None
+if config.EXECUTION_MODE == "process":
+    worker_pool = WorkerPool(
+        config.WORKER_PROCESSES,
+        config.WORKER_MAX_PENDING,
+        model_path=config.YOLO_MODEL_PATH,
+        ocr_languages=config.OCR_LANGUAGES,
+        warmup=warmup_shape,
+    )
+elif config.EXECUTION_MODE == "queue":
+    queue_client = QueueClient(
+        open_queue(config.QUEUE_URL, config.QUEUE_MAX_ATTEMPTS),
+        max_pending=config.QUEUE_MAX_PENDING,
+        timeout=config.QUEUE_TIMEOUT_S,
+        poll_interval=config.QUEUE_POLL_MS / 1000,
+        worker_timeout=config.QUEUE_WORKER_TIMEOUT_S,
+    )
+else:
+    batch_scheduler = BatchScheduler(
+        detect_batch,
+        max_batch_size=config.BATCH_MAX_SIZE,
+        max_wait_ms=config.BATCH_MAX_WAIT_MS,
+        max_queue_depth=config.BATCH_QUEUE_DEPTH,
+    )
+
+model_registry = ModelRegistry(
+    config.YOLO_MODEL_PATH,
+    config.OCR_LANGUAGES,
+    worker_pool=worker_pool or queue_client,
+    warmup=config.MODEL_WARMUP,
+    warmup_width=config.MODEL_WARMUP_WIDTH,
+    warmup_height=config.MODEL_WARMUP_HEIGHT,
+    # Warm the batched shape the scheduler will actually run too
+    warmup_batch_sizes=(1, config.BATCH_MAX_SIZE),
+)
+
+track_manager = TrackManager(
+    iou_threshold=config.TRACK_IOU_THRESHOLD,
+    max_misses=config.TRACK_MAX_MISSES,
+    lost_after_s=config.TRACK_LOST_AFTER_S,
+    min_readings=config.TRACK_MIN_READINGS,
+    min_agreement=config.TRACK_MIN_AGREEMENT,
+)
+
+motion_gate = None
+if config.MOTION_GATING:
+    motion_gate = MotionGate(
+        width=config.MOTION_WIDTH,
+        pixel_threshold=config.MOTION_PIXEL_THRESHOLD,
+        min_area=config.MOTION_MIN_AREA,
+        alpha=config.MOTION_BACKGROUND_ALPHA,
+        max_skip=config.MOTION_MAX_SKIP,
+    )
+
+# Results of recent frames per camera, reused for near-duplicate frames
+frame_cache = None
+if config.FRAME_CACHE:
+    frame_cache = FrameCache(
+        max_distance=config.FRAME_CACHE_MAX_DISTANCE,
+        hash_size=config.FRAME_CACHE_HASH_SIZE,
+        ttl=config.FRAME_CACHE_TTL_S,
+        per_camera=config.FRAME_CACHE_PER_CAMERA,
+        max_cameras=config.FRAME_CACHE_MAX_CAMERAS,
+    )
+
+# Latency of analysed frames against the SLO; under load the work is degraded
+# step by step, see admission.py
+admission = AdmissionController(
+    target_ms=config.ADMISSION_TARGET_MS,
+    percentile=config.ADMISSION_PERCENTILE,
+    window_s=config.ADMISSION_WINDOW_S,
+    recover_after_s=config.ADMISSION_RECOVER_AFTER_S,
+    max_level=config.ADMISSION_MAX_LEVEL,
+    retry_after_s=config.ADMISSION_RETRY_AFTER_S,
+)
+ocr_backlog = OcrBacklog(config.ADMISSION_OCR_BACKLOG)
+
+def degraded_width(level):
+    # Narrowest decode for the level (None = the configured decode)
+    if level < REDUCED_RESOLUTION:
+        return None
+    if config.DECODE_REDUCED:
+        return min(config.DECODE_MIN_WIDTH, config.ADMISSION_DEGRADED_WIDTH)
+    return config.ADMISSION_DEGRADED_WIDTH
+
+async def run_detection(contents, skip_ocr_boxes=None, raw_shape=None, camera_id=None, level=NORMAL, ocr=True):
+    """Run decode, YOLO and OCR for one uploaded frame without blocking the event loop.
+
+    level is the admission control degradation level; ocr=False skips OCR (license_plate None).
+    """
+    _, reader = model_registry.require()
+    min_width = degraded_width(level)
+    if queue_client:
+        # The camera is the job's stream, so its frames are analysed in order
+        meta = {"skip_ocr_boxes": skip_ocr_boxes, "raw_shape": list(raw_shape) if raw_shape else None,
+                "min_width": min_width, "ocr": ocr}
+        detection = await queue_client.submit("frame", contents, stream=camera_id, meta=meta)
+        record_stages(detection["timings"])
+        admission.observe_stages(detection["timings"])
+        return detection
+    if worker_pool:
+        detection = await worker_pool.submit(contents, skip_ocr_boxes, raw_shape, min_width, ocr)
+        record_inference(1)
+        record_stages(detection["timings"])
+        admission.observe_stages(detection["timings"])
+        return detection
+
+    img_cv, scale, decode_s = await run_in_threadpool(
+        decode_frame, contents, raw_shape, True if min_width else None, min_width
+    )
+    # Boxes stay in decoded pixels for OCR and go back to source pixels for tracking and storage
+    boxes, detect_s = await batch_scheduler.submit(img_cv)
+    source_boxes = scale_boxes(boxes, scale)
+    vehicle_type, confidence = classify_boxes(source_boxes)
+    timings = {"decode": decode_s, "detect": detect_s}
+    if not ocr or (boxes and skip_ocr_boxes and matches_any(source_boxes[0], skip_ocr_boxes)):
+        license_plate = None
+    else:
+        # OCR only the vehicle regions YOLO found
+        license_plate = await run_in_threadpool(read_plate, reader, img_cv, boxes, timings=timings)
+    record_stages(timings)
+    admission.observe_stages(timings)
+    return {
+        "vehicle_type": vehicle_type,
+        "confidence": confidence,
+        "license_plate": license_plate,
+        "boxes": source_boxes,
+        "timings": timings,
+    }
+
+event_bus = EventBus(client_buffer=config.EVENTS_CLIENT_BUFFER, replay_size=config.EVENTS_REPLAY)
+
+@app.get("/api/events")
+def stream_events(request: Request):
+    # Live detection feed (Server-Sent Events) for the dashboards
+    last_event_id = request.headers.get("last-event-id")
+    last_event_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    return StreamingResponse(
+        event_bus.stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/")
 def read_root():
     return {"status": "ok", "model": "yolov8n", "database": "active"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    # Everything in metrics.REGISTRY, in the Prometheus text format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/health/live")
+def liveness():
+    # The process is up and its event loop answers; nothing else is checked
+    return {"status": "ok"}
+
+@app.get("/api/health/ready")
+def readiness(response: Response):
+    # Route traffic here only once the models are warm and the database answers
+    ready = model_registry.ready
+    try:
+        with engine.connect() as conn:
+            conn.exec_driver_sql("SELECT 1")
+        database = "ok"
+    except Exception as e:
+        ready = False
+        database = str(e)
+    if not ready:
+        response.status_code = 503
+    return {"status": "ready" if ready else "not_ready", "models": model_registry.stats(), "database": database}
+
+@app.get("/api/inference/stats")
+def get_inference_stats():
+    if worker_pool:
+        stats = {"mode": "process", **worker_pool.stats()}
+    elif queue_client:
+        stats = {"mode": "queue", **queue_client.stats()}
+    else:
+        stats = {"mode": "batch", **batch_scheduler.stats()}
+    stats["tracking"] = track_manager.stats()
+    stats["streaming"] = metrics.snapshot("autotoll_stream_")
+    stats["motion"] = motion_gate.stats() if motion_gate else None
+    stats["frame_cache"] = frame_cache.stats() if frame_cache else None
+    stats["plates"] = plate_index.stats()
+    stats["ledger"] = ledger_cache.stats()
+    stats["storage"] = image_store.stats()
+    stats["offline"] = offline_analyzer.stats()
+    stats["models"] = model_registry.stats()
+    stats["stages"] = metrics.snapshot("autotoll_stage_")
+    stats["database"] = metrics.snapshot("autotoll_db_")
+    stats["profiler"] = profiler.stats() if profiler else None
+    stats["admission"] = {**admission.stats(), "ocr_backlog": len(ocr_backlog)}
+    return stats
+
 # --- Database Endpoints ---
 
 @app.post("/api/owners")
@@ -70,12 +427,7 @@ async def create_owner(
 ):
     photo_path = ""
     if photo:
-        file_extension = photo.filename.split(".")[-1]
-        filename = f"{uuid.uuid4()}.{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(photo.file, buffer)
-        photo_path = f"/uploads/{filename}"
+        photo_path = image_store.store_photo(await photo.read())
 
     new_owner = Owner(name=name, contact_info=contact_info, photo_path=photo_path)
     db.add(new_owner)
@@ -84,8 +436,8 @@ async def create_owner(
     return new_owner
 
 @app.get("/api/owners")
-def get_owners(db: Session = Depends(get_db)):
-    return db.query(Owner).all()
+def get_owners(limit: int = None, cursor: str = None, db: Session = Depends(get_db)):
+    return page_by_id(db.query(*OWNER_COLUMNS), Owner.id, limit, cursor)
 
 @app.post("/api/vehicles")
 def create_vehicle(
@@ -104,17 +456,19 @@ def create_vehicle(
         db.add(new_vehicle)
         db.commit()
         db.refresh(new_vehicle)
+        plate_index.add(new_vehicle.license_plate, new_vehicle.id)
         return new_vehicle
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail="Vehicle with this plate likely already exists")
 
 @app.get("/api/vehicles")
-def get_vehicles(db: Session = Depends(get_db)):
-    return db.query(Vehicle).all()
+def get_vehicles(limit: int = None, cursor: str = None, db: Session = Depends(get_db)):
+    query = db.query(*VEHICLE_COLUMNS).outerjoin(Owner, Vehicle.owner_id == Owner.id)
+    return page_by_id(query, Vehicle.id, limit, cursor)
 
 @app.get("/api/vehicles/{vehicle_id}/history")
-def get_vehicle_history(vehicle_id: int, db: Session = Depends(get_db)):
+def get_vehicle_history(vehicle_id: int, limit: int = None, cursor: str = None, db: Session = Depends(get_db)):
     # Find vehicle first to ensure it exists
     vehicle = db.query(Vehicle).filter(Vehicle.id == vehicle_id).first()
     if not vehicle:
@@ -123,10 +477,10 @@ def get_vehicle_history(vehicle_id: int, db: Session = Depends(get_db)):
     # Get detections for this vehicle based on license plate match
     # linking by known_vehicle_id or license_plate string match
     # Ideally, we should rely on known_vehicle_id if populated, or fallback to plate string
-    return db.query(Detection).filter(
+    return page_detections(db, [
         (Detection.known_vehicle_id == vehicle_id) | 
         (Detection.license_plate == vehicle.license_plate)
-    ).order_by(Detection.timestamp.desc()).all()
+    ], limit, cursor)
 
 @app.post("/api/register")
 async def register_full(
@@ -140,12 +494,7 @@ async def register_full(
     # 1. Handle Photo Upload
     photo_path = ""
     if photo:
-        file_extension = photo.filename.split(".")[-1]
-        filename = f"{uuid.uuid4()}.{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(photo.file, buffer)
-        photo_path = f"/uploads/{filename}"
+        photo_path = image_store.store_photo(await photo.read())
 
     try:
         # 2. Create Owner
@@ -170,6 +519,7 @@ async def register_full(
         # 4. Commit transaction
         db.commit()
         db.refresh(new_owner)
+        plate_index.add(new_vehicle.license_plate, new_vehicle.id)
         
         return {"status": "success", "owner": new_owner, "vehicle": new_vehicle}
 
@@ -181,19 +531,23 @@ async def register_full(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/history")
-def get_history(db: Session = Depends(get_db)):
-    return db.query(Detection).order_by(Detection.timestamp.desc()).limit(50).all()
+def get_history(limit: int = None, cursor: str = None, since: str = None, db: Session = Depends(get_db)):
+    return list_detections(db, [], limit, cursor, since)
 
 @app.get("/api/summary")
 def get_summary(db: Session = Depends(get_db)):
-    total_vehicles = db.query(func.count(Detection.id)).scalar() or 0
-    total_revenue = db.query(func.sum(Detection.toll_amount)).scalar() or 0
-    
-    # Average confidence (convert string confidence to float if necessary, 
-    # but the model saves it as string in database.py, so we cast)
-    avg_confidence = db.query(func.avg(Detection.confidence.cast(Float))).scalar() or 0
-    
-    pending_review = db.query(func.count(Detection.id)).filter(Detection.status == 'pending_review').scalar() or 0
+    # Served from the daily rollups, so the cost does not grow with the detections table
+    totals = db.query(
+        func.sum(DailyRollup.volume).label('volume'),
+        func.sum(DailyRollup.revenue).label('revenue'),
+        func.sum(DailyRollup.confidence_sum).label('confidence_sum'),
+        func.sum(DailyRollup.pending_review).label('pending_review')
+    ).first()
+
+    total_vehicles = totals.volume or 0
+    total_revenue = totals.revenue or 0
+    avg_confidence = (totals.confidence_sum / total_vehicles) if total_vehicles else 0
+    pending_review = totals.pending_review or 0
     
     return {
         "total_vehicles": total_vehicles,
@@ -204,56 +558,61 @@ def get_summary(db: Session = Depends(get_db)):
 
 @app.get("/api/analytics")
 def get_analytics(db: Session = Depends(get_db)):
+    # Everything here reads the hourly/daily rollups maintained by rollups.py
+
     # 1. Revenue and Volume by Day (Past 7 Days)
     today = datetime.datetime.utcnow().date()
     seven_days_ago = today - datetime.timedelta(days=7)
     
     daily_stats = db.query(
-        func.date(Detection.timestamp).label('date'),
-        func.sum(Detection.toll_amount).label('revenue'),
-        func.count(Detection.id).label('volume')
-    ).filter(Detection.timestamp >= seven_days_ago).group_by(func.date(Detection.timestamp)).all()
+        DailyRollup.day,
+        func.sum(DailyRollup.revenue).label('revenue'),
+        func.sum(DailyRollup.volume).label('volume')
+    ).filter(DailyRollup.day >= seven_days_ago).group_by(DailyRollup.day).all()
+    daily_by_day = {item.day: item for item in daily_stats}
     
     revenue_trend = []
     for d in range(7, -1, -1):
         day = today - datetime.timedelta(days=d)
-        day_str = day.isoformat()
-        match = next((item for item in daily_stats if item.date == day_str), None)
+        match = daily_by_day.get(day)
         revenue_trend.append({
-            "date": day_str,
+            "date": day.isoformat(),
             "revenue": match.revenue if match else 0,
             "volume": match.volume if match else 0
         })
 
     # 2. Hourly Traffic (Current Day)
+    day_start = datetime.datetime.combine(today, datetime.time())
     hourly_stats = db.query(
-        func.strftime('%H', Detection.timestamp).label('hour'),
-        func.count(Detection.id).label('count')
-    ).filter(func.date(Detection.timestamp) == today.isoformat()).group_by(func.strftime('%H', Detection.timestamp)).all()
+        HourlyRollup.bucket,
+        func.sum(HourlyRollup.volume).label('count')
+    ).filter(
+        HourlyRollup.bucket >= day_start,
+        HourlyRollup.bucket < day_start + datetime.timedelta(days=1)
+    ).group_by(HourlyRollup.bucket).all()
+    hourly_by_hour = {item.bucket.hour: item.count for item in hourly_stats}
     
     hourly_traffic = []
     for h in range(24):
-        hour_str = f"{h:02d}"
-        match = next((item for item in hourly_stats if item.hour == hour_str), None)
         hourly_traffic.append({
-            "hour": f"{hour_str}:00",
-            "count": match.count if match else 0
+            "hour": f"{h:02d}:00",
+            "count": hourly_by_hour.get(h, 0)
         })
 
     # 3. Vehicle Type Distribution
     type_stats = db.query(
-        Detection.vehicle_type,
-        func.count(Detection.id).label('count')
-    ).group_by(Detection.vehicle_type).all()
+        DailyRollup.vehicle_type,
+        func.sum(DailyRollup.volume).label('count')
+    ).group_by(DailyRollup.vehicle_type).all()
     
     vehicle_distribution = [
-        {"type": t.vehicle_type, "value": t.count} for t in type_stats
+        {"type": t.vehicle_type, "value": t.count} for t in type_stats if t.count
     ]
 
     # 4. Summary Metrics
     total_stats = db.query(
-        func.sum(Detection.toll_amount).label('total_revenue'),
-        func.count(Detection.id).label('total_vehicles')
+        func.sum(DailyRollup.revenue).label('total_revenue'),
+        func.sum(DailyRollup.volume).label('total_vehicles')
     ).first()
 
     return {
@@ -267,9 +626,56 @@ def get_analytics(db: Session = Depends(get_db)):
         }
     }
 
+@app.get("/api/analytics/report")
+def get_analytics_report(start: str = None, end: str = None, period: str = "month", db: Session = Depends(get_db)):
+    # Long-range report over the Parquet archive and the hot table; start/end are
+    # ISO dates (end exclusive), the default is the last 365 days
+    if period not in PERIOD_FORMATS:
+        raise HTTPException(status_code=400, detail=f"period must be one of {', '.join(PERIOD_FORMATS)}")
+    tomorrow = datetime.datetime.combine(datetime.datetime.utcnow().date() + datetime.timedelta(days=1), datetime.time())
+    try:
+        end_at = datetime.datetime.fromisoformat(end) if end else tomorrow
+        start_at = datetime.datetime.fromisoformat(start) if start else end_at - datetime.timedelta(days=365)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be ISO dates, e.g. 2024-01-31")
+    if start_at >= end_at:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return detection_report(db, detection_archive, start_at, end_at, period)
+
+@app.post("/api/analytics/rebuild")
+def rebuild_analytics(db: Session = Depends(get_db)):
+    # Reconcile the rollups against the raw and archived detections
+    return {"status": "success", **rebuild_rollups(db, archive=detection_archive)}
+
+@app.get("/api/archive")
+def get_archive(db: Session = Depends(get_db)):
+    return {"after_days": config.ARCHIVE_AFTER_DAYS, **detection_archive.stats(db)}
+
+@app.post("/api/archive/run")
+def run_archive(older_than_days: int = None, db: Session = Depends(get_db)):
+    # Archive now instead of waiting for the next scheduled run
+    days = older_than_days if older_than_days is not None else config.ARCHIVE_AFTER_DAYS
+    if days <= 0:
+        raise HTTPException(status_code=400, detail="Set older_than_days or AUTOTOLL_ARCHIVE_AFTER_DAYS")
+    return {"status": "success", **detection_archive.archive(db, days)}
+
+@app.post("/api/ledger/reconcile")
+def reconcile_toll_ledger(fix: bool = False, db: Session = Depends(get_db)):
+    # Check the toll ledger against the raw detections; fix=true rebuilds it on a mismatch
+    result = reconcile_ledger(db, fix=fix, archive=detection_archive)
+    if result["fixed"]:
+        ledger_cache.clear()
+    return {"status": "success", **result}
+
+@app.post("/api/ledger/rebuild")
+def rebuild_toll_ledger(db: Session = Depends(get_db)):
+    result = rebuild_ledger(db, detection_archive)
+    ledger_cache.clear()
+    return {"status": "success", **result}
+
 @app.get("/api/review_queue")
-def get_review_queue(db: Session = Depends(get_db)):
-    return db.query(Detection).filter(Detection.status == 'pending_review').order_by(Detection.timestamp.desc()).all()
+def get_review_queue(limit: int = None, cursor: str = None, since: str = None, db: Session = Depends(get_db)):
+    return list_detections(db, [Detection.status == 'pending_review'], limit, cursor, since)
 
 @app.put("/api/detections/{detection_id}")
 def update_detection(
@@ -282,12 +688,23 @@ def update_detection(
     if not detection:
         raise HTTPException(status_code=404, detail="Detection not found")
     
+    apply_detection(db, detection, -1)
+    apply_ledger(db, detection, -1)
     detection.vehicle_type = vehicle_type
     detection.toll_amount = toll_amount
     detection.status = 'verified'
+    apply_detection(db, detection, 1)
+    apply_ledger(db, detection, 1)
+
+    # Reviewed detections keep only their plate crop unless every frame is kept
+    released = None
+    if config.STORAGE_KEEP_FULL == "pending_review":
+        released, detection.image_path = detection.image_path, None
     
     db.commit()
     db.refresh(detection)
+    image_store.release(released)
+    event_bus.publish("detection.updated", detection_to_dict(detection))
     return detection
 
 @app.delete("/api/detections/{detection_id}")
@@ -296,285 +713,347 @@ def delete_detection(detection_id: int, db: Session = Depends(get_db)):
     if not detection:
         raise HTTPException(status_code=404, detail="Detection not found")
     
-    # Delete image file if it exists
-    if detection.image_path:
-        filename = os.path.basename(detection.image_path)
-        full_path = os.path.join(UPLOAD_DIR, filename)
-        if os.path.exists(full_path):
-            try:
-                os.remove(full_path)
-            except Exception as e:
-                print(f"Error deleting file: {e}")
-
+    images = (detection.image_path, detection.thumbnail_path)
+    apply_detection(db, detection, -1)
+    apply_ledger(db, detection, -1)
+    record_tombstone(db, detection.id)
     db.delete(detection)
     db.commit()
+    # Image files go once no other detection shares them
+    image_store.release(*images)
+    event_bus.publish("detection.deleted", {"id": detection_id})
     return {"status": "success"}
 
 @app.get("/api/vehicle/status/{license_plate}")
 def get_vehicle_status(license_plate: str, db: Session = Depends(get_db)):
     vehicle = db.query(Vehicle).filter(Vehicle.license_plate == license_plate.upper()).first()
     
-    # Get all detections for this plate (verified and pending)
-    # Note: Using relaxed matching logic similar to history
-    detections = db.query(Detection).filter(
-        (Detection.license_plate == license_plate.upper()) |
-        (Detection.known_vehicle_id == (vehicle.id if vehicle else -1))
-    ).all()
-
-    total_due = sum(d.toll_amount for d in detections)
+    # Detections of this plate or of its registered vehicle (verified and pending),
+    # summed from the toll ledger rather than scanned
+    history_count, total_due = ledger_cache.status(db, license_plate.upper(), vehicle.id if vehicle else None)
     
     return {
         "found": vehicle is not None,
         "vehicle": vehicle,
         "owner": vehicle.owner if vehicle else None,
         "total_due": total_due,
-        "history_count": len(detections)
+        "history_count": history_count
     }
 
-@app.post("/api/import")
-async def import_data(file: UploadFile = File(...), db: Session = Depends(get_db)):
+registry_importer = RegistryImporter(
+    SessionLocal,
+    on_vehicles=plate_index.load,
+    chunk_size=config.IMPORT_CHUNK_SIZE,
+    max_errors=config.IMPORT_MAX_ERRORS,
+)
+
+@app.post("/api/import", status_code=202)
+def import_data(file: UploadFile = File(...)):
+    # Large fleet files are imported in the background; poll /api/import/{job_id}
     try:
-        contents = await file.read()
-        df = None
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(io.BytesIO(contents))
-        elif file.filename.endswith(('.xls', '.xlsx')):
-            df = pd.read_excel(io.BytesIO(contents))
-        else:
-            raise HTTPException(status_code=400, detail="Invalid file type. Only CSV and Excel are supported.")
+        kind = file_kind(file.filename)
+    except ImportFileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        required_columns = ['Full Name', 'Contact Info', 'License Plate', 'Make & Model']
-        # Normalize columns (case insensitive, strip whitespace)
-        df.columns = [c.strip() for c in df.columns]
-        
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            raise HTTPException(status_code=400, detail=f"Missing columns: {', '.join(missing_columns)}")
+    # Spool the upload to disk so it is never held in memory as a whole
+    fd, path = tempfile.mkstemp(suffix=f".{kind}")
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
+        check_columns(path, kind)
+    except Exception as e:
+        os.remove(path)
+        if isinstance(e, ImportFileError):
+            raise HTTPException(status_code=400, detail=str(e))
+        print(f"Import error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    job = registry_importer.submit(path, kind, file.filename)
+    return job.to_dict()
+
+@app.get("/api/import/{job_id}")
+def get_import_status(job_id: str):
+    job = registry_importer.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job.to_dict()
+
+# --- Analysis Endpoint ---
+
+def save_detection(db, vehicle_type, confidence, license_plate, contents, raw_shape=None, box=None, pending=False):
+    """Queue the frame for storage and write one Detection row. Returns (detection, known_vehicle)."""
+    # --- DB Integration: Save Detection ---
+    new_detection, known_vehicle, _ = write_detection(
+        db, plate_index, image_store, vehicle_type, confidence, license_plate, contents, raw_shape, box,
+        pending=pending,
+    )
+    event_bus.publish("detection.created", detection_to_dict(new_detection))
+    return new_detection, known_vehicle
+
+async def analyze_on_worker(db, contents, level=NORMAL, ocr=True):
+    """Queue mode: a worker analyses the frame and writes its Detection. Returns (detection, known_vehicle, confidence)."""
+    model_registry.require()
+    result = await queue_client.submit("analyze", contents, meta={"min_width": degraded_width(level), "ocr": ocr})
+    record_stages(result["timings"])
+    admission.observe_stages(result["timings"])
+    new_detection = db.get(Detection, result["detection_id"])
+    known_vehicle = db.get(Vehicle, new_detection.known_vehicle_id) if new_detection.known_vehicle_id else None
+    # Written by another process: drop the plate's cached status and tell the dashboards
+    ledger_cache.invalidate([(new_detection.license_plate or "", new_detection.known_vehicle_id or 0)])
+    event_bus.publish("detection.created", detection_to_dict(new_detection))
+    return new_detection, known_vehicle, result["confidence"]
+
+def build_response(vehicle_type, license_plate, confidence, status, known_vehicle, detection_id=None):
+    # Build Response
+    response_data = {
+        "id": detection_id,
+        "vehicleType": vehicle_type,
+        "licensePlate": license_plate,
+        "confidence": confidence,
+        "tollAmount": TOLL_RATES.get(vehicle_type, 50),
+        "status": status,
+        "color": "Detected", 
+        "makeModel": f"Detected {vehicle_type}", 
+        "description": f"A {vehicle_type.lower()} detected with {(confidence*100):.1f}% confidence."
+    }
+
+    if known_vehicle:
+        response_data["owner"] = {
+            "name": known_vehicle.owner.name,
+            "info": known_vehicle.owner.contact_info,
+            "photo": known_vehicle.owner.photo_path
+        }
+        response_data["description"] += f" OWNER MATCH: {known_vehicle.owner.name}"
+        response_data["makeModel"] = known_vehicle.make_model
+    
+    if status == 'pending_review':
+         response_data["description"] += " [FLAGGED FOR REVIEW]"
+
+    return response_data
+
+async def commit_track(db, track):
+    plate, _ = track.fused_plate()
+    contents, raw_shape, box = track.best_contents, track.best_raw_shape, track.best_box
+    # Marked before the write so frames analysed meanwhile do not commit the track again
+    track_manager.mark_committed(track, None)
+    detection, _ = await run_in_threadpool(
+        save_detection, db, track.vehicle_type, track.confidence, plate, contents, raw_shape, box
+    )
+    track.detection_id = detection.id
+    return detection
 
-        success_count = 0
-        error_count = 0
-        errors = []
+async def flush_lost_tracks():
+    # Cameras that stop sending frames still owe a Detection for their last vehicle
+    while True:
+        await asyncio.sleep(max(config.TRACK_LOST_AFTER_S / 2, 0.5))
+        lost = track_manager.expire()
+        if not lost:
+            continue
+        db = SessionLocal()
+        try:
+            for track in lost:
+                await commit_track(db, track)
+        except Exception as e:
+            print(f"Track flush error: {e}")
+        finally:
+            db.close()
 
-        for index, row in df.iterrows():
+def record_deferred_plate(db, detection_id, license_plate):
+    detection = db.get(Detection, detection_id)
+    if detection is None or not set_plate(db, plate_index, detection, license_plate):
+        return
+    db.commit()
+    db.refresh(detection)
+    event_bus.publish("detection.updated", detection_to_dict(detection))
+
+async def rerun_deferred_ocr():
+    # Plates skipped under load are read once the load is gone
+    while True:
+        await asyncio.sleep(1.0)
+        while len(ocr_backlog) and admission.level == NORMAL:
+            detection_id, contents, raw_shape = ocr_backlog.pop()
+            db = SessionLocal()
             try:
-                name = str(row['Full Name']).strip()
-                contact = str(row['Contact Info']).strip()
-                plate = str(row['License Plate']).strip().upper()
-                model = str(row['Make & Model']).strip()
-
-                if not name or not plate:
-                    continue
-
-                # Check if plate exists
-                existing_vehicle = db.query(Vehicle).filter(Vehicle.license_plate == plate).first()
-                if existing_vehicle:
-                    error_count += 1
-                    errors.append(f"Row {index+2}: Plate {plate} already exists")
-                    continue
-
-                # Create Owner (Check if owner with same name and contact exists to avoid duplicates?)
-                # For now, let's just create a new owner for simplicity as per standard registry behavior
-                new_owner = Owner(name=name, contact_info=contact, photo_path="")
-                db.add(new_owner)
-                db.flush()
-
-                new_vehicle = Vehicle(
-                    license_plate=plate,
-                    make_model=model,
-                    owner_id=new_owner.id
-                )
-                db.add(new_vehicle)
-                success_count += 1
+                detection = await run_detection(contents, raw_shape=raw_shape)
+                await run_in_threadpool(record_deferred_plate, db, detection_id, detection["license_plate"])
+                ocr_backlog.done()
             except Exception as e:
-                error_count += 1
-                errors.append(f"Row {index+2}: {str(e)}")
+                print(f"Deferred OCR error: {e}")
+            finally:
+                db.close()
 
-        db.commit()
-        return {
-            "status": "success",
-            "imported": success_count,
-            "failed": error_count,
-            "errors": errors[:10] # Return first 10 errors
-        }
+async def analyze_tracked(camera_id, contents, db, raw_shape=None, level=NORMAL):
+    # Empty, static lane: skip YOLO and OCR. While a vehicle is being tracked
+    # every frame is analysed so a car waiting at the barrier is not lost.
+    if motion_gate and not track_manager.has_tracks(camera_id):
+        has_motion = await run_in_threadpool(motion_gate.has_motion, camera_id, contents, raw_shape)
+        if not has_motion:
+            response_data = build_response("Unknown", "UNKNOWN", 0.0, "empty", None)
+            response_data["description"] = "No motion in lane."
+            response_data["trackId"] = None
+            response_data["skipped"] = True
+            return response_data
 
-    except HTTPException as e:
-        raise e
-    except Exception as e:
-        print(f"Import error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    # A near-duplicate of a recent frame (car waiting at the barrier, frozen
+    # feed) reuses its boxes and plate reading: the tracks advance as before,
+    # without YOLO, OCR or holding another review frame
+    frame_key = cached = None
+    if frame_cache:
+        frame_key = await run_in_threadpool(frame_cache.hash, contents, raw_shape)
+        cached = frame_cache.lookup(camera_id, frame_key)
+    if cached is not None:
+        boxes, license_plate = cached
+        primary, to_commit = track_manager.observe(camera_id, boxes, license_plate, None)
+    else:
+        # Frames whose vehicle already has a resolved plate skip OCR; under
+        # load, so do those whose vehicle has been read at least once
+        if level >= DEFERRED_OCR:
+            skip_ocr_boxes = track_manager.read_boxes(camera_id)
+        else:
+            skip_ocr_boxes = track_manager.resolved_boxes(camera_id)
+        detection = await run_detection(contents, skip_ocr_boxes, raw_shape, camera_id, level)
+        if frame_cache:
+            frame_cache.store(camera_id, frame_key, (detection["boxes"], detection["license_plate"]))
+        primary, to_commit = track_manager.observe(
+            camera_id, detection["boxes"], detection["license_plate"], contents, raw_shape=raw_shape
+        )
+    for track in to_commit:
+        await commit_track(db, track)
 
-# --- Analysis Endpoint ---
+    if primary is None:
+        response_data = build_response("Unknown", "UNKNOWN", 0.0, "empty", None)
+        response_data["description"] = "No vehicle in frame."
+        response_data["trackId"] = None
+        return response_data
+
+    plate, agreement = primary.fused_plate()
+    if primary.committed:
+        status = "committed"
+    else:
+        status = "tracking"
+    known_vehicle, _ = find_known_vehicle(db, plate_index, plate)
+    if known_vehicle:
+        plate = known_vehicle.license_plate
+    response_data = build_response(
+        primary.vehicle_type, plate, primary.confidence, status,
+        known_vehicle, primary.detection_id
+    )
+    response_data["trackId"] = primary.id
+    response_data["plateAgreement"] = agreement
+    response_data["framesSeen"] = primary.frames
+    return response_data
+
+def dropped_response():
+    response_data = build_response("Unknown", "UNKNOWN", 0.0, "dropped", None)
+    response_data["description"] = "A newer frame from this camera is being analysed, frame dropped."
+    response_data["trackId"] = None
+    response_data["skipped"] = True
+    return response_data
+
+async def process_stream_frame(camera_id, payload, raw_shape):
+    db = SessionLocal()
+    try:
+        with admission.admit(camera_id) as level:
+            response_data = await analyze_tracked(camera_id, payload, db, raw_shape, level)
+        return {**response_data, "degradation": LEVELS[level]}
+    except OverloadedError:
+        return {"status": "busy", "description": "Server overloaded, frame skipped", "degradation": LEVELS[-1]}
+    except StaleFrameError:
+        return {**dropped_response(), "degradation": LEVELS[admission.level]}
+    except QueueFullError:
+        return {"status": "busy", "description": "Inference queue is full, frame skipped"}
+    except PoolBusyError:
+        return {"status": "busy", "description": "All inference workers are busy, frame skipped"}
+    except ModelsNotReadyError:
+        return {"status": "busy", "description": "Models are still loading, frame skipped"}
+    except QueueTimeoutError:
+        return {"status": "busy", "description": "No queue worker answered in time, frame skipped"}
+    except NoWorkersError:
+        return {"status": "busy", "description": "No queue workers are running, frame skipped"}
+    except JobFailedError as e:
+        return {"status": "error", "description": f"Inference worker failed: {e}"}
+    finally:
+        db.close()
+
+@app.websocket("/ws/frames")
+async def stream_frames(websocket: WebSocket):
+    # Persistent camera feed; see stream.py for the frame format
+    await websocket.accept()
+    await StreamSession(websocket, process_stream_frame).run()
 
 @app.post("/analyze")
-async def analyze_image(file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def analyze_image(
+    file: UploadFile = File(...),
+    camera_id: str = Form(None),
+    db: Session = Depends(get_db)
+):
     try:
-        # Read image
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
-        # Convert to openCV format (numpy array)
-        img_np = np.array(image)
-        img_cv = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
-
-        # Run YOLO detection
-        results = model(img_cv)
-        
-        vehicle_type = "Unknown"
-        confidence = 0.0
-        
-        # classes for vehicles in COCO dataset
-        # 2: car, 3: motorcycle, 5: bus, 7: truck
-        vehicle_classes = [2, 3, 5, 7]
-        coco_map = {2: 'Car', 3: 'Motorcycle', 5: 'Bus', 7: 'Truck'}
-
-        for r in results:
-            for b in r.boxes:
-                cls_id = int(b.cls[0])
-                conf = float(b.conf[0])
-                
-                if cls_id in vehicle_classes:
-                    if conf > confidence:
-                        confidence = conf
-                        vehicle_type = coco_map[cls_id]
-
-        # OCR for License Plate
-        ocr_result = reader.readtext(img_cv, detail=1)
-        
-        candidates = []
-        for (bbox, text, prob) in ocr_result:
-            clean_text = ''.join(e for e in text if e.isalnum()).upper()
-            if 2 <= len(clean_text) <= 10:
-                # Calculate center and height
-                cx = sum([p[0] for p in bbox]) / 4
-                cy = sum([p[1] for p in bbox]) / 4
-                min_y = min([p[1] for p in bbox])
-                max_y = max([p[1] for p in bbox])
-                h = max_y - min_y
-                candidates.append({
-                    'text': clean_text,
-                    'cx': cx,
-                    'cy': cy,
-                    'h': h,
-                    'prob': prob
-                })
-
-        license_plate = "UNKNOWN"
-        if candidates:
-            # Sort by Y position
-            candidates.sort(key=lambda x: x['cy'])
-            
-            # Simple grouping logic: merge segments that are horizontally aligned and vertically close
-            merged_results = []
-            used_indices = set()
-            
-            for i in range(len(candidates)):
-                if i in used_indices: continue
-                
-                current_group = [candidates[i]]
-                used_indices.add(i)
-                
-                # Look for segments below this one that align horizontally
-                for j in range(i + 1, len(candidates)):
-                    if j in used_indices: continue
-                    
-                    # Heuristic: cx is close, and vertical distance is reasonable
-                    if abs(candidates[j]['cx'] - candidates[i]['cx']) < 50 and \
-                       abs(candidates[j]['cy'] - candidates[i]['cy']) < candidates[i]['h'] * 2.5:
-                        current_group.append(candidates[j])
-                        used_indices.add(j)
-                
-                # Combine text in the group (already sorted by cy)
-                merged_text = "".join([c['text'] for c in current_group])
-                merged_results.append(merged_text)
-            
-            # Pick the best merged result that looks like a plate
-            best_plate = "UNKNOWN"
-            best_score = 0
-            for plate in merged_results:
-                if 4 <= len(plate) <= 12:
-                    score = 0
-                    if any(c.isdigit() for c in plate): score += 1
-                    if any(c.isalpha() for c in plate): score += 1
-                    if score >= best_score:
-                        best_score = score
-                        best_plate = plate
-            
-            license_plate = best_plate
-
-        # Save the image for Review Queue / History
-        file_extension = "jpg" # Defaulting for simplicity, or could parse from filename if needed but we read content
-        # Better: use UUID
-        image_filename = f"{uuid.uuid4()}.{file_extension}"
-        image_save_path = os.path.join(UPLOAD_DIR, image_filename)
-        
-        # We already read 'contents', so write it back
-        with open(image_save_path, "wb") as f:
-            f.write(contents)
-            
-        db_image_path = f"/uploads/{image_filename}"
+        with admission.admit(camera_id) as level:
+            # Read image
+            started = time.perf_counter()
+            contents = await file.read()
+            record_stages({"read": time.perf_counter() - started})
 
-        # --- DB Integration: Save Detection ---
-        
-        # Check if vehicle is authorized/known
-        known_vehicle = None
-        is_authorized = 0
-        if license_plate != "UNKNOWN":
-            known_vehicle = db.query(Vehicle).filter(Vehicle.license_plate == license_plate).first()
-            if known_vehicle:
-                is_authorized = 1
-
-        # Determine Toll Amount (INR)
-        # Default Rates
-        rates = {'Car': 50, 'Motorcycle': 30, 'Bus': 100, 'Truck': 150}
-        toll_amount = rates.get(vehicle_type, 50)
-
-        # Determine Status
-        status = 'verified'
-        if confidence < 0.90: # Bumped for testing
-            status = 'pending_review'
-        
-        print(f"DEBUG: Analyzed {license_plate} (Conf: {confidence}). Status: {status}")
-
-        new_detection = Detection(
-            vehicle_type=vehicle_type,
-            license_plate=license_plate,
-            confidence=f"{confidence:.2f}",
-            timestamp=datetime.datetime.utcnow(),
-            known_vehicle_id=known_vehicle.id if known_vehicle else None,
-            is_authorized=is_authorized,
-            toll_amount=toll_amount,
-            status=status,
-            image_path=db_image_path
-        )
-        db.add(new_detection)
-        db.commit()
+            # Realtime streams are tracked so one passing vehicle becomes one Detection
+            if camera_id:
+                response_data = await analyze_tracked(camera_id, contents, db, level=level)
+                return {**response_data, "degradation": LEVELS[level]}
 
-        # Build Response
-        response_data = {
-            "id": new_detection.id,
-            "vehicleType": vehicle_type,
-            "licensePlate": license_plate,
-            "confidence": confidence,
-            "tollAmount": toll_amount,
-            "status": status,
-            "color": "Detected", 
-            "makeModel": f"Detected {vehicle_type}", 
-            "description": f"A {vehicle_type.lower()} detected with {(confidence*100):.1f}% confidence."
-        }
+            # Retried or repeated uploads of the same frame get the first result back
+            # instead of another inference pass and a duplicate Detection
+            frame_key = None
+            if frame_cache:
+                frame_key = await run_in_threadpool(frame_cache.hash, contents)
+                cached = frame_cache.lookup(None, frame_key)
+                if cached is not None:
+                    return {**cached, "cached": True, "degradation": LEVELS[level]}
 
-        if known_vehicle:
-            response_data["owner"] = {
-                "name": known_vehicle.owner.name,
-                "info": known_vehicle.owner.contact_info,
-                "photo": known_vehicle.owner.photo_path
-            }
-            response_data["description"] += f" OWNER MATCH: {known_vehicle.owner.name}"
-            response_data["makeModel"] = known_vehicle.make_model
-        
-        if status == 'pending_review':
-             response_data["description"] += " [FLAGGED FOR REVIEW]"
+            # Under load the plate is read later: the Detection waits in the review queue meanwhile
+            ocr = level < DEFERRED_OCR
+            if queue_client:
+                # A queue worker analyses the frame and writes the Detection
+                new_detection, known_vehicle, confidence = await analyze_on_worker(db, contents, level, ocr)
+                vehicle_type = new_detection.vehicle_type
+            else:
+                # Run YOLO detection and OCR off the event loop
+                detection = await run_detection(contents, level=level, ocr=ocr)
+                vehicle_type = detection["vehicle_type"]
+                confidence = detection["confidence"]
+                license_plate = detection["license_plate"]
+                box = detection["boxes"][0] if detection["boxes"] else None
 
-        return response_data
+                new_detection, known_vehicle = await run_in_threadpool(
+                    save_detection, db, vehicle_type, confidence, license_plate, contents, box=box, pending=not ocr
+                )
+            if not ocr:
+                ocr_backlog.put(new_detection.id, contents)
+            response_data = build_response(
+                vehicle_type, new_detection.license_plate, confidence, new_detection.status,
+                known_vehicle, new_detection.id
+            )
+            # Results without a plate reading are not handed to retries
+            if frame_cache and ocr:
+                frame_cache.store(None, frame_key, response_data)
+            return {**response_data, "degradation": LEVELS[level]}
 
+    except OverloadedError as e:
+        raise HTTPException(status_code=503, detail="Server overloaded, retry shortly",
+                            headers={"Retry-After": str(e.retry_after)})
+    except StaleFrameError:
+        return {**dropped_response(), "degradation": LEVELS[admission.level]}
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Inference queue is full, retry shortly")
+    except PoolBusyError:
+        raise HTTPException(status_code=429, detail="All inference workers are busy, retry shortly")
+    except ModelsNotReadyError:
+        raise HTTPException(status_code=503, detail="Models are still loading, retry shortly",
+                            headers={"Retry-After": "5"})
+    except QueueTimeoutError:
+        raise HTTPException(status_code=504, detail="No inference worker answered in time")
+    except NoWorkersError:
+        raise HTTPException(status_code=503, detail="No inference workers are running")
+    except JobFailedError as e:
+        raise HTTPException(status_code=502, detail=f"Inference worker failed: {e}")
     except Exception as e:
         print(f"Error: {e}")
         return {
@@ -586,5 +1065,74 @@ async def analyze_image(file: UploadFile = File(...), db: Session = Depends(get_
             "description": str(e)
         }
 
+# --- Offline Analysis (recorded video / image archives) ---
+
+def publish_offline_detections(detections):
+    for detection in detections:
+        event_bus.publish("detection.created", detection_to_dict(detection))
+
+offline_analyzer = OfflineAnalyzer(
+    SessionLocal,
+    plate_index,
+    image_store,
+    on_detections=publish_offline_detections,
+    processes=config.OFFLINE_PROCESSES,
+    batch_size=config.OFFLINE_BATCH_SIZE,
+    sample_fps=config.OFFLINE_SAMPLE_FPS,
+    max_width=config.OFFLINE_MAX_WIDTH,
+    model_path=config.YOLO_MODEL_PATH,
+    ocr_languages=config.OCR_LANGUAGES,
+)
+
+@app.post("/api/offline/jobs", status_code=202)
+def create_offline_job(
+    file: UploadFile = File(...),
+    sample_fps: float = Form(None),
+    recorded_at: datetime.datetime = Form(None),
+):
+    # Analysed in the background on the offline worker pool; poll /api/offline/jobs/{job_id}
+    try:
+        kind, extension = source_kind(file.filename)
+    except OfflineFileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if sample_fps is not None and sample_fps < 0:
+        raise HTTPException(status_code=400, detail="sample_fps must not be negative")
+
+    fd, path = tempfile.mkstemp(suffix=extension)
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
+        probe(path, kind, sample_fps or 0)
+    except Exception as e:
+        os.remove(path)
+        if isinstance(e, OfflineFileError):
+            raise HTTPException(status_code=400, detail=str(e))
+        print(f"Offline analysis error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if recorded_at and recorded_at.tzinfo:
+        recorded_at = recorded_at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    job = offline_analyzer.submit(path, kind, file.filename, sample_fps, recorded_at)
+    return job.to_dict()
+
+@app.get("/api/offline/jobs")
+def get_offline_jobs():
+    return [job.to_dict() for job in offline_analyzer.jobs()]
+
+@app.get("/api/offline/jobs/{job_id}")
+def get_offline_job(job_id: str):
+    job = offline_analyzer.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Offline job not found")
+    return job.to_dict()
+
+@app.get("/api/offline/jobs/{job_id}/detections")
+def get_offline_job_detections(job_id: str, limit: int = None, cursor: str = None, db: Session = Depends(get_db)):
+    job = offline_analyzer.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Offline job not found")
+    # In footage order; detections deleted since simply drop out of their page
+    return page_detection_ids(db, job.detection_ids, limit, cursor)
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,188 @@
+import threading
+
+# Small in-process metrics primitives. Everything registered here can be read
+# back through snapshot() for the JSON stats endpoints, or rendered in the
+# Prometheus text format for /metrics.
+
+REGISTRY = {}
+_lock = threading.Lock()
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+
+    def inc(self, amount=1):
+        with _lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self._function = None
+
+    def set_function(self, function):
+        """Read the value from function() whenever the gauge is read."""
+        self._function = function
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with _lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with _lock:
+            self.value -= amount
+
+    def snapshot(self):
+        return self._function() if self._function else self.value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = sorted(buckets)
+        # One slot per bucket plus the +Inf overflow slot
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        with _lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            else:
+                self.counts[-1] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        labels = [str(b) for b in self.buckets] + ["+Inf"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "sum": self.sum,
+            "count": self.count,
+            "avg": (self.sum / self.count) if self.count else 0,
+        }
+
+
+class Family:
+    """One metric per combination of label values, e.g. a histogram per endpoint."""
+
+    def __init__(self, metric_class, name, help_text, labels, **options):
+        self.metric_class = metric_class
+        self.kind = metric_class.kind
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.options = options
+        self.children = {}
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self.children.get(values)
+        if child is None:
+            with _lock:
+                child = self.children.setdefault(
+                    values, self.metric_class(self.name, self.help, **self.options)
+                )
+        return child
+
+    def snapshot(self):
+        return {",".join(values): child.snapshot() for values, child in list(self.children.items())}
+
+
+def _register(metric):
+    with _lock:
+        if metric.name in REGISTRY:
+            return REGISTRY[metric.name]
+        REGISTRY[metric.name] = metric
+        return metric
+
+
+def counter(name, help_text, labels=None):
+    if labels:
+        return _register(Family(Counter, name, help_text, labels))
+    return _register(Counter(name, help_text))
+
+
+def gauge(name, help_text, labels=None):
+    if labels:
+        return _register(Family(Gauge, name, help_text, labels))
+    return _register(Gauge(name, help_text))
+
+
+def histogram(name, help_text, buckets, labels=None):
+    if labels:
+        return _register(Family(Histogram, name, help_text, labels, buckets=buckets))
+    return _register(Histogram(name, help_text, buckets))
+
+
+def snapshot(prefix=""):
+    return {name: m.snapshot() for name, m in REGISTRY.items() if name.startswith(prefix)}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value is None:
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+def _render_metric(lines, metric, pairs):
+    if metric.kind != "histogram":
+        lines.append(f"{metric.name}{_label_text(pairs)} {_number(metric.snapshot())}")
+        return
+    with _lock:
+        counts, total, count = list(metric.counts), metric.sum, metric.count
+    cumulative = 0
+    bounds = [repr(float(b)) for b in metric.buckets] + ["+Inf"]
+    for bound, n in zip(bounds, counts):
+        cumulative += n
+        lines.append(f"{metric.name}_bucket{_label_text(pairs + [('le', bound)])} {cumulative}")
+    lines.append(f"{metric.name}_sum{_label_text(pairs)} {_number(float(total))}")
+    lines.append(f"{metric.name}_count{_label_text(pairs)} {count}")
+
+
+def render(prefix=""):
+    """Everything registered, in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, metric in sorted(REGISTRY.items()):
+        if not name.startswith(prefix):
+            continue
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        if isinstance(metric, Family):
+            for values, child in sorted(metric.children.items()):
+                _render_metric(lines, child, list(zip(metric.label_names, values)))
+        else:
+            _render_metric(lines, metric, [])
+    return "\n".join(lines) + "\n"
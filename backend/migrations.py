@@ -0,0 +1,144 @@
+import datetime
+
+from sqlalchemy import (
+    Column, DateTime, Enum, Float, ForeignKey, Integer, MetaData, String, Table, inspect, text,
+)
+
+# Versioned schema migrations.
+#
+# create_all() builds a new database straight at the current schema; existing
+# databases are brought forward by the migrations below, applied in order and
+# recorded in schema_migrations. Each migration runs in its own transaction
+# and uses a frozen description of the tables it touches, so it keeps working
+# when the ORM models change later.
+
+DETECTION_STATUSES = ("verified", "pending_review")
+
+_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _meta,
+    Column("version", String(64), primary_key=True),
+    Column("applied_at", DateTime, default=datetime.datetime.utcnow),
+)
+
+MIGRATIONS = []
+
+
+def migration(version):
+    def register(fn):
+        MIGRATIONS.append((version, fn))
+        return fn
+    return register
+
+
+def _columns(conn, table):
+    return {c["name"] for c in inspect(conn).get_columns(table)}
+
+
+@migration("0001_detection_updated_at")
+def add_updated_at(conn):
+    if "updated_at" not in _columns(conn, "detections"):
+        conn.execute(text("ALTER TABLE detections ADD COLUMN updated_at TIMESTAMP"))
+        conn.execute(text("UPDATE detections SET updated_at = timestamp"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_detections_updated_at ON detections (updated_at)"))
+
+
+@migration("0002_detection_thumbnail_path")
+def add_thumbnail_path(conn):
+    if "thumbnail_path" not in _columns(conn, "detections"):
+        conn.execute(text("ALTER TABLE detections ADD COLUMN thumbnail_path VARCHAR"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_detections_thumbnail_path ON detections (thumbnail_path)"))
+    # Image storage checks references by path before removing a file
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_detections_image_path ON detections (image_path)"))
+
+
+# Indexes matching the detection access paths:
+#   /api/history                    ORDER BY timestamp DESC, id DESC
+#   /api/review_queue               WHERE status = ? ORDER BY timestamp DESC, id DESC
+#   /api/vehicle/status, history    WHERE license_plate = ? OR known_vehicle_id = ?
+DETECTION_INDEXES = (
+    ("ix_detections_timestamp_id", ("timestamp", "id")),
+    ("ix_detections_status_timestamp_id", ("status", "timestamp", "id")),
+    ("ix_detections_plate_timestamp", ("license_plate", "timestamp")),
+    ("ix_detections_vehicle_timestamp", ("known_vehicle_id", "timestamp")),
+    ("ix_detections_id", ("id",)),
+    ("ix_detections_updated_at", ("updated_at",)),
+    ("ix_detections_image_path", ("image_path",)),
+    ("ix_detections_thumbnail_path", ("thumbnail_path",)),
+)
+
+
+@migration("0003_detection_types_and_indexes")
+def type_detection_columns(conn):
+    statuses = ", ".join(f"'{s}'" for s in DETECTION_STATUSES)
+    # Anything that is not a known status was accepted as verified
+    conn.execute(text(
+        f"UPDATE detections SET status = 'verified' WHERE status IS NULL OR status NOT IN ({statuses})"
+    ))
+
+    if conn.dialect.name == "postgresql":
+        # create_all() may already have created the type for the ORM model
+        if not conn.execute(text("SELECT 1 FROM pg_type WHERE typname = 'detection_status'")).first():
+            conn.execute(text(f"CREATE TYPE detection_status AS ENUM ({statuses})"))
+        conn.execute(text(
+            "ALTER TABLE detections ALTER COLUMN status TYPE detection_status "
+            "USING status::detection_status"
+        ))
+        conn.execute(text(
+            "ALTER TABLE detections ALTER COLUMN confidence TYPE DOUBLE PRECISION "
+            "USING CASE WHEN confidence ~ '^\\s*[0-9]*\\.?[0-9]+\\s*$' "
+            "THEN confidence::double precision END"
+        ))
+    else:
+        # SQLite cannot change a column type: rebuild the table and copy the rows
+        meta = MetaData()
+        Table("vehicles", meta, Column("id", Integer, primary_key=True))
+        new = Table(
+            "detections_new", meta,
+            Column("id", Integer, primary_key=True),
+            Column("vehicle_type", String),
+            Column("license_plate", String),
+            Column("confidence", Float),
+            Column("timestamp", DateTime),
+            Column("updated_at", DateTime),
+            Column("toll_amount", Integer),
+            Column("status", Enum(*DETECTION_STATUSES, name="detection_status", create_constraint=True)),
+            Column("image_path", String),
+            Column("thumbnail_path", String),
+            Column("known_vehicle_id", Integer, ForeignKey("vehicles.id")),
+            Column("is_authorized", Integer),
+        )
+        new.create(conn)
+        columns = ", ".join(c.name for c in new.columns)
+        source = columns.replace(
+            "confidence", "CAST(NULLIF(TRIM(confidence), '') AS REAL)", 1
+        )
+        conn.execute(text(f"INSERT INTO detections_new ({columns}) SELECT {source} FROM detections"))
+        conn.execute(text("DROP TABLE detections"))
+        conn.execute(text("ALTER TABLE detections_new RENAME TO detections"))
+
+    for name, columns in DETECTION_INDEXES:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON detections ({', '.join(columns)})"))
+
+
+@migration("0004_detection_source_key")
+def add_source_key(conn):
+    if "source_key" not in _columns(conn, "detections"):
+        conn.execute(text("ALTER TABLE detections ADD COLUMN source_key VARCHAR"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_detections_source_key ON detections (source_key)"))
+
+
+def upgrade(engine, fresh=False):
+    """Apply pending migrations; a database just built by create_all() is only stamped."""
+    schema_migrations.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        applied = {row.version for row in conn.execute(schema_migrations.select())}
+
+    for version, fn in MIGRATIONS:
+        if version in applied:
+            continue
+        with engine.begin() as conn:
+            if not fresh:
+                print(f"Applying migration {version}...")
+                fn(conn)
+            conn.execute(schema_migrations.insert().values(version=version))
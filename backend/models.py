@@ -0,0 +1,139 @@
+import time
+
+import cv2
+import numpy as np
+
+import metrics
+from pipeline import read_plate
+
+# Model lifecycle for the API process.
+#
+# One ModelRegistry owns the detector and OCR reader every endpoint uses (or,
+# in "process" mode, the worker pool that owns them). Loading happens from the
+# app's lifespan rather than at import, optionally followed by a warm-up pass
+# on a synthetic frame so the first real request does not pay for lazy
+# initialisation, kernel selection and allocator growth. The detector backend
+# (detectors.py) and easyocr, with torch behind them, are only imported when
+# the models load.
+
+LOAD_SECONDS = metrics.gauge("autotoll_models_load_seconds", "Time spent loading the detector and EasyOCR")
+WARMUP_SECONDS = metrics.gauge("autotoll_models_warmup_seconds", "Time spent on warm-up inference")
+INFERENCE_CALLS = metrics.counter("autotoll_models_inference_calls_total", "Detector calls (a batch counts once)")
+INFERENCE_FRAMES = metrics.counter("autotoll_models_inference_frames_total", "Frames run through the detector")
+INFERENCE_ERRORS = metrics.counter("autotoll_models_inference_errors_total", "Detector calls that raised")
+
+
+class ModelsNotReadyError(Exception):
+    pass
+
+
+def record_inference(frames, failed=False):
+    INFERENCE_CALLS.inc()
+    if failed:
+        INFERENCE_ERRORS.inc()
+    else:
+        INFERENCE_FRAMES.inc(frames)
+
+
+def load_models(model_path, ocr_languages):
+    """(detector, reader) with the configured detector backend."""
+    from detectors import load_detector
+    import easyocr
+    return load_detector(model_path), easyocr.Reader(list(ocr_languages))
+
+
+def warmup_frame(width, height):
+    """A synthetic lane frame: a vehicle-sized block with a plate-like text patch.
+
+    Returns (frame, box) where box covers the block, in vehicle_boxes() format.
+    """
+    frame = np.full((height, width, 3), 90, dtype=np.uint8)
+    x1, y1, x2, y2 = width // 4, height // 4, width * 3 // 4, height * 7 // 8
+    cv2.rectangle(frame, (x1, y1), (x2, y2), (150, 150, 150), -1)
+    plate_w, plate_h = (x2 - x1) // 2, max(16, (y2 - y1) // 8)
+    px1, py1 = (x1 + x2 - plate_w) // 2, y2 - plate_h * 2
+    cv2.rectangle(frame, (px1, py1), (px1 + plate_w, py1 + plate_h), (255, 255, 255), -1)
+    cv2.putText(frame, "KA01AB1234", (px1 + 4, py1 + plate_h - 6), cv2.FONT_HERSHEY_SIMPLEX,
+                plate_h / 40, (0, 0, 0), 2)
+    return frame, [float(x1), float(y1), float(x2), float(y2), 1.0, 2]
+
+
+def warm_up(detector, reader, width=1280, height=720, batch_sizes=(1,)):
+    """Run the detector at each batch size and both OCR paths once; returns seconds taken."""
+    started = time.perf_counter()
+    frame, box = warmup_frame(width, height)
+    for size in sorted(set(batch_sizes)):
+        detector.detect([frame] * size)
+    read_plate(reader, frame, [box], mode="roi")
+    read_plate(reader, frame, mode="full")
+    return time.perf_counter() - started
+
+
+class ModelRegistry:
+    def __init__(self, model_path="yolov8n.pt", ocr_languages=("en",), worker_pool=None,
+                 warmup=True, warmup_width=1280, warmup_height=720, warmup_batch_sizes=(1,)):
+        self.model_path = model_path
+        self.ocr_languages = list(ocr_languages)
+        # In "process" and "queue" modes the workers hold the models; loading
+        # means starting the pool, or connecting to the queue
+        self.worker_pool = worker_pool
+        self.warmup = warmup
+        self.warmup_width = warmup_width
+        self.warmup_height = warmup_height
+        self.warmup_batch_sizes = tuple(warmup_batch_sizes)
+        self.detector = None
+        self.reader = None
+        self.state = "idle"  # idle, loading, warming_up, ready, failed
+        self.error = None
+        self.load_s = None
+        self.warmup_s = None
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def require(self):
+        """(detector, reader) for inference in this process; raises until they are loaded."""
+        if not self.ready:
+            raise ModelsNotReadyError(f"Models are not ready ({self.state})")
+        return self.detector, self.reader
+
+    def load(self):
+        """Load and warm up the models. Blocking; call it off the event loop."""
+        try:
+            self.state = "loading"
+            started = time.perf_counter()
+            if self.worker_pool:
+                # Each worker loads (and warms up) its own copy
+                self.worker_pool.start()
+            else:
+                self.detector, self.reader = load_models(self.model_path, self.ocr_languages)
+            self.load_s = time.perf_counter() - started
+            LOAD_SECONDS.set(self.load_s)
+
+            if self.warmup and not self.worker_pool:
+                self.state = "warming_up"
+                self.warmup_s = warm_up(
+                    self.detector, self.reader, self.warmup_width, self.warmup_height, self.warmup_batch_sizes
+                )
+                WARMUP_SECONDS.set(self.warmup_s)
+            self.state = "ready"
+        except Exception as e:
+            print(f"Model loading error: {e}")
+            self.state = "failed"
+            self.error = str(e)
+
+    def shutdown(self):
+        if self.worker_pool:
+            self.worker_pool.shutdown()
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "error": self.error,
+            "mode": self.worker_pool.mode if self.worker_pool else "batch",
+            "model_path": self.model_path,
+            "detector": self.detector.backend if self.detector else None,
+            "load_s": self.load_s,
+            "warmup_s": self.warmup_s,
+        }
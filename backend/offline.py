@@ -0,0 +1,510 @@
+"""Offline analysis of recorded video and image archives.
+
+    python backend/offline.py lane3.mp4 [--sample-fps 5] [--recorded-at 2024-05-01T08:00:00]
+    python backend/offline.py captures.zip [--processes 8] [--batch-size 16]
+
+The file is split into segments of a few sampled frames. Worker processes,
+each with its own YOLO + EasyOCR, decode their segment themselves and run the
+detector over the whole segment in one call, so decoding and inference both
+scale across cores. Results come back in order: video frames go through a
+vehicle tracker (one Detection per passing vehicle, timestamped from the
+footage), archive images become one Detection each, like /analyze. Every
+segment's detections are written with one bulk INSERT and one rollup and
+ledger upsert per bucket and account. The API runs the same jobs behind /api/offline/jobs.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import sys
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+from sqlalchemy import insert
+
+import config
+import metrics
+import workers
+from database import SessionLocal, Detection, Vehicle, init_db
+from detections import build_detection
+from pipeline import decode_frame
+from plate_index import PlateIndex
+from ledger import apply_ledgers
+from rollups import apply_detections
+from storage import ImageStore, downscale, encode
+from tracker import TrackManager
+
+FRAMES = metrics.counter("autotoll_offline_frames_total", "Frames analysed by offline jobs")
+FRAMES_FAILED = metrics.counter("autotoll_offline_frames_failed_total", "Archive images that could not be decoded")
+DETECTIONS = metrics.counter("autotoll_offline_detections_total", "Detections written by offline jobs")
+FRAME_RATE = metrics.gauge("autotoll_offline_frames_per_second", "Throughput of the latest offline job")
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".m4v", ".webm", ".mpg", ".mpeg", ".ts")
+ARCHIVE_EXTENSIONS = ((".zip", "zip"), (".tar", "tar"), (".tar.gz", "tar"), (".tgz", "tar"))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+
+
+class OfflineFileError(ValueError):
+    pass
+
+
+def source_kind(filename):
+    """("video" | "zip" | "tar", extension) for an upload name."""
+    name = filename.lower()
+    for extension, kind in ARCHIVE_EXTENSIONS:
+        if name.endswith(extension):
+            return kind, extension
+    for extension in VIDEO_EXTENSIONS:
+        if name.endswith(extension):
+            return "video", extension
+    raise OfflineFileError("Unsupported file type. Upload a video or a .zip/.tar archive of images.")
+
+
+def archive_names(path, kind):
+    try:
+        if kind == "zip":
+            with zipfile.ZipFile(path) as archive:
+                names = [info.filename for info in archive.infolist() if not info.is_dir()]
+        else:
+            with tarfile.open(path) as archive:
+                names = [member.name for member in archive.getmembers() if member.isfile()]
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise OfflineFileError(f"Could not read the archive: {e}")
+    return sorted(n for n in names if n.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def probe(path, kind, sample_fps):
+    """Check the file can be read; returns {"fps", "step", "frames", "names"}.
+
+    frames is the number of frames that will be analysed, estimated from the
+    container for videos (None when it does not say).
+    """
+    if kind != "video":
+        names = archive_names(path, kind)
+        if not names:
+            raise OfflineFileError("The archive contains no images")
+        return {"fps": None, "step": 1, "frames": len(names), "names": names}
+
+    cap = cv2.VideoCapture(path)
+    try:
+        ok = cap.isOpened() and cap.grab()
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        cap.release()
+    if not ok:
+        raise OfflineFileError("Could not decode the video")
+    # Some containers do not report a frame rate
+    fps = fps if fps and fps > 0 else 25.0
+    step = max(1, round(fps / sample_fps)) if sample_fps else 1
+    frames = math.ceil(count / step) if count > 0 else None
+    return {"fps": fps, "step": step, "frames": frames, "names": None}
+
+
+def segments(path, kind, source, batch_size):
+    """Units of work for the workers, batch_size analysed frames each."""
+    if kind == "video":
+        # The container's frame count is only an estimate; segments keep
+        # coming until one comes back short
+        for first in itertools.count(0, source["step"] * batch_size):
+            yield ("video", path, first, source["step"], batch_size, source["fps"])
+    else:
+        names = source["names"]
+        for start in range(0, len(names), batch_size):
+            yield (kind, path, names[start:start + batch_size])
+
+
+def read_video(path, first, step, count, fps):
+    """Yield (frame_index, offset_s, frame) for every step-th frame from first on."""
+    cap = cv2.VideoCapture(path)
+    try:
+        if first:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+        index = first
+        while count > 0:
+            if (index - first) % step == 0:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                yield index, index / fps, frame
+                count -= 1
+            elif not cap.grab():
+                # grab() skips the colour conversion and copy of unsampled frames
+                break
+            index += 1
+    finally:
+        cap.release()
+
+
+def read_archive(path, kind, names):
+    """Yield (name, encoded bytes) for the named archive members."""
+    if kind == "zip":
+        with zipfile.ZipFile(path) as archive:
+            for name in names:
+                yield name, archive.read(name)
+    else:
+        with tarfile.open(path) as archive:
+            for name in names:
+                yield name, archive.extractfile(name).read()
+
+
+def _analyze_segment(segment, max_width, jpeg_quality):
+    # Runs in a worker process started with workers._init_worker
+    frames = []  # (key, offset_s, frame, encoded bytes or None, source pixels per frame pixel)
+    failed = 0
+    if segment[0] == "video":
+        _, path, first, step, count, fps = segment
+        for index, offset_s, img in read_video(path, first, step, count, fps):
+            frames.append((index, offset_s, img, None, 1.0))
+        exhausted = len(frames) < count
+    else:
+        kind, path, names = segment
+        for name, data in read_archive(path, kind, names):
+            try:
+                # Frames are analysed at max_width at most, so large JPEGs can decode reduced
+                # (max_width 0 keeps full resolution, as in downscale)
+                img, scale, _ = decode_frame(data, reduced=bool(max_width), min_width=max_width)
+            except Exception:
+                failed += 1
+                continue
+            frames.append((name, 0.0, img, data, scale))
+        exhausted = False
+
+    results = []
+    if frames:
+        scaled = [downscale(img, max_width) for _, _, img, _, _ in frames]
+        # Still images get a full-frame OCR pass when no vehicle is found, as on /analyze
+        analyses = workers.analyze_frames(scaled, ocr_without_vehicle=segment[0] != "video")
+        for (key, offset_s, img, encoded, scale), small, analysis in zip(frames, scaled, analyses):
+            # Boxes back in source pixels, matching the frame that gets stored
+            ratio = scale * img.shape[1] / small.shape[1]
+            analysis["boxes"] = [
+                [x1 * ratio, y1 * ratio, x2 * ratio, y2 * ratio, conf, cls_id]
+                for x1, y1, x2, y2, conf, cls_id in analysis["boxes"]
+            ]
+            found = analysis["boxes"] or analysis["license_plate"] not in (None, "UNKNOWN")
+            if found and encoded is None:
+                encoded = encode(img, jpeg_quality)
+            analysis.update(key=key, offset_s=offset_s, contents=encoded if found else None)
+            results.append(analysis)
+    return {"frames": results, "failed": failed, "exhausted": exhausted}
+
+
+class OfflineJob:
+    def __init__(self, filename, kind, sample_fps=None, recorded_at=None):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.kind = kind
+        self.sample_fps = sample_fps if kind == "video" else None
+        # Detections are timestamped from here (plus their offset in the video)
+        self.recorded_at = recorded_at
+        self.status = "queued"  # queued, running, completed, failed
+        self.frames_total = None
+        self.frames = 0
+        self.frames_failed = 0
+        self.detection_ids = []
+        self.detail = None
+        self.created_at = datetime.datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+        self.elapsed_s = 0.0
+
+    @property
+    def frames_per_second(self):
+        return self.frames / self.elapsed_s if self.elapsed_s else 0.0
+
+    def to_dict(self):
+        progress = None
+        if self.status == "completed":
+            progress = 1.0
+        elif self.frames_total:
+            progress = min(1.0, self.frames / self.frames_total)
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "kind": self.kind,
+            "status": self.status,
+            "sample_fps": self.sample_fps,
+            "frames_total": self.frames_total,
+            "frames": self.frames,
+            "frames_failed": self.frames_failed,
+            "progress": progress,
+            "frames_per_second": round(self.frames_per_second, 2),
+            "elapsed_s": round(self.elapsed_s, 2),
+            "detections": len(self.detection_ids),
+            "detail": self.detail,
+            "recorded_at": self.recorded_at,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class OfflineAnalyzer:
+    def __init__(self, session_factory, plate_index, image_store, on_detections=None, processes=1,
+                 batch_size=16, sample_fps=5.0, max_width=1280, model_path="yolov8n.pt",
+                 ocr_languages=("en",), keep_jobs=50):
+        # on_detections([Detection, ...]) is called after each committed segment
+        self.session_factory = session_factory
+        self.plate_index = plate_index
+        self.image_store = image_store
+        self.on_detections = on_detections
+        self.processes = max(1, processes)
+        self.batch_size = max(1, batch_size)
+        self.sample_fps = sample_fps
+        self.max_width = max_width
+        self.model_path = model_path
+        self.ocr_languages = list(ocr_languages)
+        self.keep_jobs = keep_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+        # Jobs run one at a time; each one already uses every worker process
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="offline-analysis")
+
+    def submit(self, path, kind, filename, sample_fps=None, recorded_at=None, cleanup=True):
+        """Queue a job; with cleanup the (spooled) file is removed when it ends."""
+        sample_fps = self.sample_fps if sample_fps is None else sample_fps
+        job = OfflineJob(filename, kind, sample_fps, recorded_at)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.keep_jobs:
+                oldest = next(iter(self._jobs.values()))
+                if oldest.status in ("queued", "running"):
+                    break
+                self._jobs.popitem(last=False)
+        self._executor.submit(self._run, job, path, cleanup)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        return list(reversed(self._jobs.values()))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            "settings": {
+                "processes": self.processes,
+                "batch_size": self.batch_size,
+                "sample_fps": self.sample_fps,
+                "max_width": self.max_width,
+            },
+            "running": sum(1 for job in self._jobs.values() if job.status == "running"),
+            "metrics": metrics.snapshot("autotoll_offline_"),
+        }
+
+    def _get_pool(self):
+        # Started with the first job so the models only load once they are needed
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=workers._init_worker,
+                initargs=(self.model_path, self.ocr_languages),
+            )
+        return self._pool
+
+    def _run(self, job, path, cleanup):
+        job.status = "running"
+        job.started_at = datetime.datetime.utcnow()
+        started = time.perf_counter()
+        db = self.session_factory()
+        pending = deque()
+        tracker = None
+        if job.kind == "video":
+            tracker = TrackManager(
+                iou_threshold=config.TRACK_IOU_THRESHOLD,
+                max_misses=config.TRACK_MAX_MISSES,
+                lost_after_s=config.TRACK_LOST_AFTER_S,
+                min_readings=config.TRACK_MIN_READINGS,
+                min_agreement=config.TRACK_MIN_AGREEMENT,
+            )
+        try:
+            source = probe(path, job.kind, job.sample_fps)
+            job.frames_total = source["frames"]
+            pool = self._get_pool()
+            work = segments(path, job.kind, source, self.batch_size)
+            while True:
+                # Keep every worker busy with one more segment queued behind it
+                while work is not None and len(pending) < self.processes * 2:
+                    segment = next(work, None)
+                    if segment is None:
+                        work = None
+                        break
+                    pending.append(pool.submit(
+                        _analyze_segment, segment, self.max_width, self.image_store.quality
+                    ))
+                if not pending:
+                    break
+
+                result = pending.popleft().result()
+                if result["exhausted"]:
+                    work = None
+                self._write(db, job, self._collect(db, job, tracker, result["frames"]))
+                job.frames += len(result["frames"])
+                job.frames_failed += result["failed"]
+                job.elapsed_s = time.perf_counter() - started
+                FRAMES.inc(len(result["frames"]))
+                FRAMES_FAILED.inc(result["failed"])
+                FRAME_RATE.set(job.frames_per_second)
+
+            if tracker:
+                # Vehicles still in view when the footage ends
+                lost = tracker.expire(now=math.inf)
+                self._write(db, job, [self._from_track(db, job, tracker, track) for track in lost])
+            job.status = "completed"
+        except Exception as e:
+            db.rollback()
+            print(f"Offline analysis error: {e}")
+            job.status = "failed"
+            job.detail = str(e)
+            for future in pending:
+                future.cancel()
+            if isinstance(e, BrokenProcessPool):
+                # A worker died (e.g. out of memory); start fresh for the next job
+                self._pool = None
+        finally:
+            db.close()
+            job.elapsed_s = time.perf_counter() - started
+            job.finished_at = datetime.datetime.utcnow()
+            if cleanup:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _collect(self, db, job, tracker, frames):
+        """Unsaved detections owed for one segment's frames, in footage order."""
+        found = []
+        for frame in frames:
+            if tracker is None:
+                if frame["contents"] is not None:
+                    box = frame["boxes"][0] if frame["boxes"] else None
+                    found.append(self._build(
+                        db, job, frame["vehicle_type"], frame["confidence"], frame["license_plate"],
+                        frame["contents"], box, 0.0
+                    ))
+                continue
+            _, to_commit = tracker.observe(
+                job.id, frame["boxes"], frame["license_plate"], frame["contents"], now=frame["offset_s"]
+            )
+            for track in to_commit:
+                found.append(self._from_track(db, job, tracker, track))
+        return found
+
+    def _from_track(self, db, job, tracker, track):
+        plate, _ = track.fused_plate()
+        detection = self._build(
+            db, job, track.vehicle_type, track.confidence, plate,
+            track.best_contents, track.best_box, track.first_seen
+        )
+        tracker.mark_committed(track, None)
+        return detection
+
+    def _build(self, db, job, vehicle_type, confidence, license_plate, contents, box, offset_s):
+        timestamp = (job.recorded_at or job.started_at) + datetime.timedelta(seconds=offset_s)
+        detection, _ = build_detection(
+            db, self.plate_index, self.image_store, vehicle_type, confidence, license_plate,
+            contents, box=box, timestamp=timestamp
+        )
+        return detection
+
+    def _write(self, db, job, detections):
+        if not detections:
+            return
+        # Footage may be old, but the rows are new to clients polling ?since=
+        now = datetime.datetime.utcnow()
+        columns = [c.key for c in Detection.__table__.columns if c.key != "id"]
+        rows = []
+        for detection in detections:
+            detection.updated_at = now
+            rows.append({key: getattr(detection, key) for key in columns})
+        ids = db.scalars(insert(Detection).returning(Detection.id, sort_by_parameter_order=True), rows).all()
+        for detection, detection_id in zip(detections, ids):
+            detection.id = detection_id
+        apply_detections(db, detections)
+        apply_ledgers(db, detections)
+        db.commit()
+
+        job.detection_ids.extend(ids)
+        DETECTIONS.inc(len(ids))
+        if self.on_detections:
+            self.on_detections(detections)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse a recorded video or an archive of images.")
+    parser.add_argument("file", help="Video file, or a .zip/.tar archive of images")
+    parser.add_argument("--sample-fps", type=float, default=config.OFFLINE_SAMPLE_FPS,
+                        help="Video frames analysed per second of footage (0 = every frame)")
+    parser.add_argument("--processes", type=int, default=config.OFFLINE_PROCESSES, help="Worker processes")
+    parser.add_argument("--batch-size", type=int, default=config.OFFLINE_BATCH_SIZE, help="Frames per detector call")
+    parser.add_argument("--max-width", type=int, default=config.OFFLINE_MAX_WIDTH,
+                        help="Frames are downscaled to this width for analysis (0 = full resolution)")
+    parser.add_argument("--recorded-at", type=datetime.datetime.fromisoformat,
+                        help="UTC start of the recording (default: now)")
+    parser.add_argument("--uploads", default="uploads", help="Image store directory served by the API")
+    args = parser.parse_args()
+
+    try:
+        kind, _ = source_kind(args.file)
+        probe(args.file, kind, args.sample_fps)
+    except OfflineFileError as e:
+        parser.error(str(e))
+
+    init_db()
+    plate_index = PlateIndex(max_distance=config.PLATE_FUZZY_MAX_DISTANCE)
+    with SessionLocal() as db:
+        plate_index.load(db.query(Vehicle.license_plate, Vehicle.id).yield_per(50000))
+    image_store = ImageStore(
+        args.uploads,
+        SessionLocal,
+        quality=config.STORAGE_JPEG_QUALITY,
+        max_width=config.STORAGE_MAX_WIDTH,
+        thumb_width=config.STORAGE_THUMB_WIDTH,
+        queue_depth=config.STORAGE_QUEUE_DEPTH,
+    )
+    analyzer = OfflineAnalyzer(
+        SessionLocal, plate_index, image_store,
+        processes=args.processes,
+        batch_size=args.batch_size,
+        sample_fps=args.sample_fps,
+        max_width=args.max_width,
+        model_path=config.YOLO_MODEL_PATH,
+        ocr_languages=config.OCR_LANGUAGES,
+    )
+
+    job = analyzer.submit(os.path.abspath(args.file), kind, os.path.basename(args.file),
+                          recorded_at=args.recorded_at, cleanup=False)
+    while job.status in ("queued", "running"):
+        time.sleep(1)
+        total = job.frames_total or "?"
+        print(f"\r{job.status}: {job.frames}/{total} frames, {len(job.detection_ids)} detections, "
+              f"{job.frames_per_second:.1f} frames/s", end="", file=sys.stderr, flush=True)
+    print(file=sys.stderr)
+
+    image_store.flush()
+    image_store.shutdown()
+    analyzer.shutdown()
+    print(json.dumps(job.to_dict(), indent=2, default=str))
+    sys.exit(0 if job.status == "completed" else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import base64
+import datetime
+import json
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, not_
+
+from database import Detection, DetectionTombstone, Owner, Vehicle
+
+# Keyset pagination and delta sync for the list endpoints.
+#
+# Pages are ordered by (timestamp, id) descending for detections and by id for
+# the registry; the opaque cursor encodes the last row's sort key, so each page
+# is one index range scan no matter how deep the client goes.
+#
+# Every detection listing also returns a watermark. Passing it back as
+# ?since=<watermark> returns only rows changed after it, plus the ids that
+# were deleted or no longer match the listing (e.g. reviewed items).
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+# Watermarks trail the clock slightly so rows committed mid-query are not missed;
+# clients merge by id, so seeing a row twice is harmless.
+WATERMARK_OVERLAP = datetime.timedelta(seconds=2)
+TOMBSTONE_RETENTION = datetime.timedelta(days=7)
+
+DETECTION_COLUMNS = (
+    Detection.id,
+    Detection.vehicle_type,
+    Detection.license_plate,
+    Detection.confidence,
+    Detection.timestamp,
+    Detection.toll_amount,
+    Detection.status,
+    Detection.image_path,
+    Detection.thumbnail_path,
+    Detection.known_vehicle_id,
+    Detection.is_authorized,
+)
+OWNER_COLUMNS = (Owner.id, Owner.name, Owner.contact_info, Owner.photo_path, Owner.created_at)
+VEHICLE_COLUMNS = (
+    Vehicle.id, Vehicle.license_plate, Vehicle.make_model, Vehicle.owner_id,
+    Vehicle.created_at, Owner.name.label("owner_name"),
+)
+
+
+def detection_to_dict(detection):
+    """Same shape as the rows of the detection listings."""
+    return {column.key: getattr(detection, column.key) for column in DETECTION_COLUMNS}
+
+
+def clamp_limit(limit):
+    if limit is None:
+        return DEFAULT_LIMIT
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def encode_cursor(*values):
+    values = [v.isoformat() if isinstance(v, datetime.datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, *types):
+    """The values encoded by encode_cursor(), checked against the expected types."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != len(types) or not all(
+        isinstance(v, t) and not isinstance(v, bool) for v, t in zip(values, types)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def parse_watermark(since):
+    try:
+        return datetime.datetime.fromisoformat(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid since watermark")
+
+
+def _watermark():
+    return (datetime.datetime.utcnow() - WATERMARK_OVERLAP).isoformat()
+
+
+def page_detections(db, filters, limit=None, cursor=None):
+    limit = clamp_limit(limit)
+    watermark = _watermark()
+    query = db.query(*DETECTION_COLUMNS).filter(*filters)
+    if cursor:
+        ts, last_id = decode_cursor(cursor, str, int)
+        ts = parse_watermark(ts)
+        query = query.filter(or_(
+            Detection.timestamp < ts,
+            and_(Detection.timestamp == ts, Detection.id < last_id),
+        ))
+    rows = query.order_by(Detection.timestamp.desc(), Detection.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return {
+        "items": [row._asdict() for row in rows],
+        "next_cursor": next_cursor,
+        "watermark": watermark,
+    }
+
+
+def detection_changes(db, filters, since, limit=None):
+    """Rows changed after `since` that match the listing, and ids that left it."""
+    limit = clamp_limit(limit or MAX_LIMIT)
+    since = parse_watermark(since)
+    watermark = _watermark()
+
+    changed = Detection.updated_at > since
+    rows = db.query(*DETECTION_COLUMNS).filter(changed, *filters) \
+        .order_by(Detection.updated_at).limit(limit + 1).all()
+    removed = []
+    if filters:
+        removed = [row.id for row in db.query(Detection.id).filter(changed, not_(and_(*filters)))]
+    removed += [row.detection_id for row in
+                db.query(DetectionTombstone.detection_id).filter(DetectionTombstone.deleted_at > since)]
+
+    return {
+        "items": [row._asdict() for row in rows[:limit]],
+        "removed": removed,
+        "watermark": watermark,
+        # Too many changes for one response: the client should reload the listing
+        "truncated": len(rows) > limit,
+    }
+
+
+def list_detections(db, filters, limit=None, cursor=None, since=None):
+    if since:
+        return detection_changes(db, filters, since, limit)
+    return page_detections(db, filters, limit, cursor)
+
+
+def page_by_id(query, id_column, limit=None, cursor=None):
+    limit = clamp_limit(limit)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, int)
+        query = query.filter(id_column > last_id)
+    rows = query.order_by(id_column).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+    return {"items": [row._asdict() for row in rows], "next_cursor": next_cursor}
+
+
+def page_detection_ids(db, ids, limit=None, cursor=None):
+    """Page through a known list of detection ids (e.g. an offline job's results) in list order."""
+    limit = clamp_limit(limit)
+    start = 0
+    if cursor:
+        (start,) = decode_cursor(cursor, int)
+        if start < 0:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    chunk = ids[start:start + limit]
+    rows = db.query(*DETECTION_COLUMNS).filter(Detection.id.in_(chunk)).order_by(Detection.id).all() if chunk else []
+
+    end = start + len(chunk)
+    next_cursor = encode_cursor(end) if end < len(ids) else None
+    return {"items": [row._asdict() for row in rows], "next_cursor": next_cursor}
+
+
+def record_tombstone(db, detection_id):
+    now = datetime.datetime.utcnow()
+    db.merge(DetectionTombstone(detection_id=detection_id, deleted_at=now))
+    db.query(DetectionTombstone).filter(DetectionTombstone.deleted_at < now - TOMBSTONE_RETENTION).delete()
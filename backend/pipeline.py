@@ -0,0 +1,356 @@
+import io
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import config
+import metrics
+
+# Per-frame stages of the detection pipeline, shared by every execution path
+# (batched requests, worker processes, offline jobs).
+
+# classes for vehicles in COCO dataset
+# 2: car, 3: motorcycle, 5: bus, 7: truck
+VEHICLE_CLASSES = [2, 3, 5, 7]
+COCO_MAP = {2: 'Car', 3: 'Motorcycle', 5: 'Bus', 7: 'Truck'}
+
+# Default Rates (INR)
+TOLL_RATES = {'Car': 50, 'Motorcycle': 30, 'Bus': 100, 'Truck': 150}
+
+
+# Per-frame cost of each stage of an /analyze request, from reading the upload
+# to committing the detection. In batch mode detect is the batch's model time
+# divided by its size; store is the background image write.
+STAGES = ("read", "decode", "detect", "ocr", "merge", "lookup", "store", "commit")
+STAGE_SECONDS = {
+    stage: metrics.histogram(
+        f"autotoll_stage_{stage}_seconds", f"Per-frame {stage} time",
+        buckets=[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5],
+    )
+    for stage in STAGES
+}
+
+# cv2.imdecode flags for 1/2, 1/4 and 1/8 scale JPEG decoding
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+# Start-of-frame markers carry the JPEG dimensions (DHT, JPG and DAC share the range)
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def record_stages(timings):
+    for stage, seconds in timings.items():
+        STAGE_SECONDS[stage].observe(seconds)
+
+
+def jpeg_size(contents):
+    """(width, height) from the JPEG header, or None if contents is not a JPEG."""
+    data = memoryview(contents)
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte
+            i += 1
+            continue
+        if marker in SOF_MARKERS:
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+
+def decode_reduction(contents, min_width):
+    """Largest JPEG decode reduction (1, 2, 4 or 8) that keeps the frame at least min_width wide."""
+    size = jpeg_size(contents)
+    if size is None:
+        return 1
+    for factor in (8, 4, 2):
+        if size[0] // factor >= min_width:
+            return factor
+    return 1
+
+
+def decode_image(contents, raw_shape=None, reduction=1):
+    if raw_shape is not None:
+        # Raw BGR pixels from a streaming camera, no decode needed
+        return np.frombuffer(contents, dtype=np.uint8).reshape(raw_shape)
+    # Straight from the upload buffer to BGR; EXIF orientation is ignored, as before
+    buffer = np.frombuffer(memoryview(contents), dtype=np.uint8)
+    img = cv2.imdecode(buffer, REDUCED_FLAGS[reduction] | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img is not None:
+        return img
+    # Formats OpenCV cannot read
+    image = Image.open(io.BytesIO(contents)).convert("RGB")
+    return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+
+
+def decode_frame(contents, raw_shape=None, reduced=None, min_width=None):
+    """Decode a frame for analysis; returns (img_cv, scale, seconds).
+
+    With reduced decoding on, large JPEGs are decoded at 1/2, 1/4 or 1/8 scale
+    but no narrower than min_width; scale maps img_cv pixels back to the source.
+    """
+    reduced = config.DECODE_REDUCED if reduced is None else reduced
+    min_width = config.DECODE_MIN_WIDTH if min_width is None else min_width
+    started = time.perf_counter()
+    reduction = decode_reduction(contents, min_width) if reduced and raw_shape is None else 1
+    img_cv = decode_image(contents, raw_shape, reduction)
+    scale = 1.0
+    if reduction > 1:
+        scale = jpeg_size(contents)[0] / img_cv.shape[1]
+    return img_cv, scale, time.perf_counter() - started
+
+
+def scale_boxes(boxes, scale):
+    """Vehicle boxes from decoded pixels back to source pixels."""
+    if scale == 1.0:
+        return boxes
+    return [[x1 * scale, y1 * scale, x2 * scale, y2 * scale, conf, cls_id]
+            for x1, y1, x2, y2, conf, cls_id in boxes]
+
+
+def encode_jpeg(contents, raw_shape=None, quality=90):
+    """JPEG bytes for storage; encoded frames pass through untouched."""
+    if raw_shape is None:
+        return contents
+    img = np.frombuffer(contents, dtype=np.uint8).reshape(raw_shape)
+    ok, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode frame as JPEG")
+    return buffer.tobytes()
+
+
+def vehicle_boxes(results):
+    """Vehicle boxes as [x1, y1, x2, y2, conf, cls_id], most confident first."""
+    boxes = []
+    for r in results:
+        for b in r.boxes:
+            cls_id = int(b.cls[0])
+            if cls_id in VEHICLE_CLASSES:
+                x1, y1, x2, y2 = (float(v) for v in b.xyxy[0])
+                boxes.append([x1, y1, x2, y2, float(b.conf[0]), cls_id])
+    boxes.sort(key=lambda b: b[4], reverse=True)
+    return boxes
+
+
+def box_iou(a, b):
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    if inter == 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / (area_a + area_b - inter)
+
+
+def matches_any(box, others, iou_threshold=0.5):
+    return any(box_iou(box, other) >= iou_threshold for other in others)
+
+
+def classify_boxes(boxes):
+    """Return (vehicle_type, confidence) for the most confident vehicle box."""
+    if not boxes:
+        return "Unknown", 0.0
+    return COCO_MAP[boxes[0][5]], boxes[0][4]
+
+
+def classify_vehicle(results):
+    return classify_boxes(vehicle_boxes(results))
+
+
+def extract_candidates(ocr_result):
+    candidates = []
+    for (bbox, text, prob) in ocr_result:
+        clean_text = ''.join(e for e in text if e.isalnum()).upper()
+        if 2 <= len(clean_text) <= 10:
+            # Calculate center and height
+            cx = sum([p[0] for p in bbox]) / 4
+            cy = sum([p[1] for p in bbox]) / 4
+            min_y = min([p[1] for p in bbox])
+            max_y = max([p[1] for p in bbox])
+            h = max_y - min_y
+            candidates.append({
+                'text': clean_text,
+                'cx': cx,
+                'cy': cy,
+                'h': h,
+                'prob': prob
+            })
+    return candidates
+
+
+def merge_plate_candidates(candidates):
+    if not candidates:
+        return "UNKNOWN"
+
+    # Sort by Y position
+    candidates = sorted(candidates, key=lambda x: x['cy'])
+
+    # Simple grouping logic: merge segments that are horizontally aligned and vertically close
+    merged_results = []
+    used_indices = set()
+
+    for i in range(len(candidates)):
+        if i in used_indices: continue
+
+        current_group = [candidates[i]]
+        used_indices.add(i)
+
+        # Look for segments below this one that align horizontally
+        for j in range(i + 1, len(candidates)):
+            if j in used_indices: continue
+
+            # Heuristic: cx is close, and vertical distance is reasonable
+            if abs(candidates[j]['cx'] - candidates[i]['cx']) < 50 and \
+               abs(candidates[j]['cy'] - candidates[i]['cy']) < candidates[i]['h'] * 2.5:
+                current_group.append(candidates[j])
+                used_indices.add(j)
+
+        # Combine text in the group (already sorted by cy)
+        merged_text = "".join([c['text'] for c in current_group])
+        merged_results.append(merged_text)
+
+    # Pick the best merged result that looks like a plate
+    best_plate = "UNKNOWN"
+    best_score = 0
+    for plate in merged_results:
+        if 4 <= len(plate) <= 12:
+            score = 0
+            if any(c.isdigit() for c in plate): score += 1
+            if any(c.isalpha() for c in plate): score += 1
+            if score >= best_score:
+                best_score = score
+                best_plate = plate
+
+    return best_plate
+
+
+def plate_rois(img_cv, boxes, max_vehicles=None, lower_fraction=None, max_width=None):
+    """Crop (and downscale) the plate-bearing part of each vehicle box.
+
+    Returns (crop, x_offset, y_offset, scale) tuples so OCR boxes can be
+    mapped back to frame coordinates.
+    """
+    max_vehicles = config.OCR_ROI_MAX_VEHICLES if max_vehicles is None else max_vehicles
+    lower_fraction = config.OCR_ROI_LOWER_FRACTION if lower_fraction is None else lower_fraction
+    max_width = config.OCR_ROI_MAX_WIDTH if max_width is None else max_width
+
+    h, w = img_cv.shape[:2]
+    rois = []
+    for x1, y1, x2, y2, _, _ in boxes[:max_vehicles]:
+        x1, x2 = max(0, int(x1)), min(w, int(x2))
+        y2 = min(h, int(y2))
+        # Plates sit in the lower part of the vehicle
+        y1 = max(0, int(y2 - (y2 - y1) * lower_fraction))
+        if x2 - x1 < 16 or y2 - y1 < 16:
+            continue
+
+        crop = img_cv[y1:y2, x1:x2]
+        scale = 1.0
+        if crop.shape[1] > max_width:
+            scale = max_width / crop.shape[1]
+            crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        rois.append((crop, x1, y1, scale))
+    return rois
+
+
+def ocr_rois(reader, rois):
+    # Pad crops to a common size so EasyOCR recognises them all in one batch
+    height = max(crop.shape[0] for crop, _, _, _ in rois)
+    width = max(crop.shape[1] for crop, _, _, _ in rois)
+    padded = [
+        cv2.copyMakeBorder(crop, 0, height - crop.shape[0], 0, width - crop.shape[1],
+                           cv2.BORDER_CONSTANT, value=0)
+        for crop, _, _, _ in rois
+    ]
+    batched = reader.readtext_batched(padded, n_width=width, n_height=height, detail=1)
+
+    candidates = []
+    for (_, x_off, y_off, scale), ocr_result in zip(rois, batched):
+        # Back to full-frame coordinates so the merge heuristic sees real pixel distances
+        mapped = [
+            ([[x_off + px / scale, y_off + py / scale] for px, py in bbox], text, prob)
+            for bbox, text, prob in ocr_result
+        ]
+        candidates.extend(extract_candidates(mapped))
+    return candidates
+
+
+def read_plate(reader, img_cv, boxes=None, mode=None, timings=None):
+    """OCR the plate; when given a timings dict, adds the "ocr" and "merge" seconds to it."""
+    mode = config.OCR_MODE if mode is None else mode
+    started = time.perf_counter()
+    candidates = None
+    if mode == "roi" and boxes:
+        rois = plate_rois(img_cv, boxes)
+        if rois:
+            candidates = ocr_rois(reader, rois)
+    if candidates is None:
+        # OCR for License Plate (full frame)
+        ocr_result = reader.readtext(img_cv, detail=1)
+        candidates = extract_candidates(ocr_result)
+    read = time.perf_counter()
+    plate = merge_plate_candidates(candidates)
+    if timings is not None:
+        timings["ocr"] = timings.get("ocr", 0.0) + read - started
+        timings["merge"] = timings.get("merge", 0.0) + time.perf_counter() - read
+    return plate
+
+
+def analyze_frame(detector, reader, img_cv, skip_ocr_boxes=None, scale=1.0, ocr=True):
+    """Run detection and OCR on one decoded frame.
+
+    When the main vehicle overlaps one of skip_ocr_boxes (a track whose plate
+    is already resolved), or ocr is False, OCR is skipped and license_plate is None. scale maps
+    img_cv pixels to source pixels (see decode_frame); boxes come back in
+    source pixels, and "timings" holds the seconds spent per stage.
+    """
+    started = time.perf_counter()
+    boxes = scale_boxes(detector.detect([img_cv])[0], scale)
+    timings = {"detect": time.perf_counter() - started}
+    vehicle_type, confidence = classify_boxes(boxes)
+    if not ocr or (boxes and skip_ocr_boxes and matches_any(boxes[0], skip_ocr_boxes)):
+        license_plate = None
+    else:
+        license_plate = read_plate(reader, img_cv, scale_boxes(boxes, 1 / scale), timings=timings)
+    return {
+        "vehicle_type": vehicle_type,
+        "confidence": confidence,
+        "license_plate": license_plate,
+        "boxes": boxes,
+        "timings": timings,
+    }
+
+
+def analyze_batch(detector, reader, frames, ocr_without_vehicle=True):
+    """analyze_frame for a list of frames, with one detector call for the whole list.
+
+    With ocr_without_vehicle=False frames without a vehicle skip OCR and get
+    license_plate None.
+    """
+    started = time.perf_counter()
+    detections = detector.detect(frames)
+    detect_s = (time.perf_counter() - started) / max(1, len(frames))
+    analyses = []
+    for img_cv, boxes in zip(frames, detections):
+        vehicle_type, confidence = classify_boxes(boxes)
+        license_plate = None
+        timings = {"detect": detect_s}
+        if boxes or ocr_without_vehicle:
+            license_plate = read_plate(reader, img_cv, boxes, timings=timings)
+        analyses.append({
+            "vehicle_type": vehicle_type,
+            "confidence": confidence,
+            "license_plate": license_plate,
+            "boxes": boxes,
+            "timings": timings,
+        })
+    return analyses
@@ -0,0 +1,197 @@
+import threading
+
+import metrics
+
+# In-memory index of registered plates for per-frame owner lookup.
+#
+# Lookups try, in order:
+#   1. the exact plate
+#   2. the plate with OCR-confusable characters folded together (0/O/D/Q,
+#      1/I/L, 8/B, 5/S, 2/Z, 6/G)
+#   3. one substituted character, found through "masked segment" buckets:
+#      each key is split into segments and indexed once per segment with that
+#      segment blanked out, so any single-character difference still shares a
+#      bucket with the registered plate
+#   4. one spurious extra character read by OCR (query-side deletions)
+#
+# Every step is a handful of dict lookups, so cost stays flat with millions of
+# plates. A fuzzy lookup that matches more than one plate returns no match
+# rather than guessing the wrong owner.
+
+CONFUSIONS = str.maketrans({
+    "O": "0", "Q": "0", "D": "0",
+    "I": "1", "L": "1",
+    "Z": "2",
+    "S": "5",
+    "G": "6",
+    "B": "8",
+})
+
+LOOKUPS = metrics.counter("autotoll_plate_lookups_total", "Plate index lookups")
+FUZZY_MATCHES = metrics.counter("autotoll_plate_fuzzy_matches_total", "Lookups matched through OCR confusion or edit distance")
+
+
+def normalize_plate(plate):
+    if plate.isalnum() and plate.isupper():
+        return plate
+    return "".join(c for c in plate if c.isalnum()).upper()
+
+
+def confusion_key(plate):
+    return normalize_plate(plate).translate(CONFUSIONS)
+
+
+class PlateMatch:
+    def __init__(self, vehicle_id, plate, distance, kind):
+        self.vehicle_id = vehicle_id
+        self.plate = plate        # The registered plate
+        self.distance = distance  # Edits needed after folding confusable characters
+        self.kind = kind          # "exact", "confusion" or "edit"
+
+
+def _bucket_add(buckets, key, value):
+    # Buckets hold a bare value and only become a list on collision, which
+    # keeps millions of entries affordable
+    current = buckets.get(key)
+    if current is None:
+        buckets[key] = value
+    elif isinstance(current, list):
+        if value not in current:
+            current.append(value)
+    elif current != value:
+        buckets[key] = [current, value]
+
+
+def _bucket_remove(buckets, key, value):
+    current = buckets.get(key)
+    if isinstance(current, list):
+        if value in current:
+            current.remove(value)
+        if len(current) == 1:
+            buckets[key] = current[0]
+    elif current == value:
+        del buckets[key]
+
+
+def _bucket_values(buckets, key):
+    current = buckets.get(key)
+    if current is None:
+        return ()
+    return current if isinstance(current, list) else (current,)
+
+
+class PlateIndex:
+    def __init__(self, max_distance=1, segments=3):
+        # Edit matches try one substituted or one extra character, so 0 and 1 are the only distances
+        self.max_distance = min(max(max_distance, 0), 1)
+        self.segments = segments
+        self._plates = {}  # confusion key -> (plate, vehicle_id) or a list of them
+        self._masked = {}  # confusion key with one segment blanked -> confusion key(s)
+        self._count = 0
+        self._bounds = {}  # key length -> segment boundaries
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._count
+
+    def _masks(self, key):
+        n = len(key)
+        bounds = self._bounds.get(n)
+        if bounds is None:
+            edges = [round(i * n / self.segments) for i in range(self.segments + 1)]
+            bounds = self._bounds[n] = [
+                (start, end, "*" * (end - start)) for start, end in zip(edges, edges[1:]) if start < end
+            ]
+        return [key[:start] + stars + key[end:] for start, end, stars in bounds]
+
+    def _entries(self, key):
+        return _bucket_values(self._plates, key)
+
+    def add(self, plate, vehicle_id):
+        plate = normalize_plate(plate)
+        if not plate:
+            return
+        with self._lock:
+            self.remove(plate)
+            self._insert(plate, vehicle_id)
+
+    def _insert(self, plate, vehicle_id):
+        key = plate.translate(CONFUSIONS)
+        _bucket_add(self._plates, key, (plate, vehicle_id))
+        self._count += 1
+        if self.max_distance:
+            for mask in self._masks(key):
+                _bucket_add(self._masked, mask, key)
+
+    def remove(self, plate):
+        plate = normalize_plate(plate)
+        key = plate.translate(CONFUSIONS)
+        with self._lock:
+            entry = next((e for e in self._entries(key) if e[0] == plate), None)
+            if entry is None:
+                return
+            _bucket_remove(self._plates, key, entry)
+            self._count -= 1
+            if key not in self._plates:
+                for mask in self._masks(key):
+                    _bucket_remove(self._masked, mask, key)
+
+    def load(self, rows):
+        """Bulk load unique (plate, vehicle_id) pairs, e.g. streamed from the vehicles table."""
+        with self._lock:
+            for plate, vehicle_id in rows:
+                plate = normalize_plate(plate)
+                if plate:
+                    self._insert(plate, vehicle_id)
+
+    @staticmethod
+    def _unique(entries, distance, kind):
+        if len(entries) != 1:
+            return None
+        ((plate, vehicle_id),) = entries
+        return PlateMatch(vehicle_id, plate, distance, kind)
+
+    def lookup(self, plate):
+        LOOKUPS.inc()
+        plate = normalize_plate(plate or "")
+        if not plate or plate == "UNKNOWN":
+            return None
+
+        key = plate.translate(CONFUSIONS)
+        with self._lock:
+            entries = self._entries(key)
+            for entry in entries:
+                if entry[0] == plate:
+                    return PlateMatch(entry[1], plate, 0, "exact")
+
+            match = self._unique(entries, 0, "confusion")
+            if match is None and not entries and self.max_distance:
+                match = self._lookup_edit(key)
+        if match:
+            FUZZY_MATCHES.inc()
+        return match
+
+    def _lookup_edit(self, key):
+        # One substituted character
+        candidates = set()
+        for mask in self._masks(key):
+            for other in _bucket_values(self._masked, mask):
+                if len(other) == len(key) and sum(a != b for a, b in zip(key, other)) == 1:
+                    candidates.add(other)
+        # One extra character read by OCR
+        for i in range(len(key)):
+            shorter = key[:i] + key[i + 1:]
+            if shorter in self._plates:
+                candidates.add(shorter)
+
+        entries = []
+        for other in candidates:
+            entries.extend(self._entries(other))
+        return self._unique(entries, 1, "edit")
+
+    def stats(self):
+        return {
+            "plates": self._count,
+            "max_distance": self.max_distance,
+            "metrics": metrics.snapshot("autotoll_plate_"),
+        }
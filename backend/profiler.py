@@ -0,0 +1,122 @@
+import collections
+import datetime
+import os
+import re
+import sys
+import threading
+import time
+
+import metrics
+
+# Sampling profiler for slow requests.
+#
+# While at least one request is in flight a daemon thread samples the stack of
+# every thread in the process (event loop, request threadpool, the batch
+# inference thread, the storage writer) every interval. When a request takes
+# longer than the threshold, the samples taken during it are written out as
+# folded stacks ("thread;outer;...;inner count" per line), the input format of
+# flamegraph.pl, speedscope and inferno. Work done in worker processes is not
+# sampled.
+
+DUMPS = metrics.counter("autotoll_profiler_dumps_total", "Slow-request profiles written")
+SAMPLES = metrics.counter("autotoll_profiler_samples_total", "Stack samples taken")
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)})"
+
+
+def folded_stack(frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SlowRequestProfiler:
+    def __init__(self, threshold_ms, interval_ms=5.0, directory="profiles", keep=50, max_samples=20_000):
+        self.threshold = threshold_ms / 1000.0
+        self.interval = max(0.001, interval_ms / 1000.0)
+        self.directory = directory
+        self.keep = keep
+        # (time, thread name, folded stack); cleared whenever no request is in flight
+        self._samples = collections.deque(maxlen=max_samples)
+        self._active = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            self._wake.wait()
+            now = time.perf_counter()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self._samples.append((now, names.get(ident, str(ident)), folded_stack(frame)))
+                    SAMPLES.inc()
+            time.sleep(self.interval)
+
+    def start(self):
+        """Mark a request as started; returns the token to pass to finish()."""
+        with self._lock:
+            self._ensure_started()
+            self._active += 1
+            self._wake.set()
+        return time.perf_counter()
+
+    def finish(self, started, label):
+        """Mark a request as done; dumps its samples if it was slow. Returns the file written, if any."""
+        ended = time.perf_counter()
+        counts = None
+        if ended - started >= self.threshold:
+            counts = collections.Counter(
+                f"{thread};{stack}" for at, thread, stack in list(self._samples) if started <= at <= ended
+            )
+        with self._lock:
+            self._active -= 1
+            if not self._active:
+                self._wake.clear()
+                self._samples.clear()
+        if not counts:
+            return None
+        return self._dump(counts, label, ended - started)
+
+    def _dump(self, counts, label, elapsed):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S.%f")
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_")
+        path = os.path.join(self.directory, f"{stamp}-{slug}-{elapsed * 1000:.0f}ms.folded")
+        with open(path, "w") as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+        DUMPS.inc()
+        self._prune()
+        return path
+
+    def _prune(self):
+        profiles = sorted(n for n in os.listdir(self.directory) if n.endswith(".folded"))
+        for name in profiles[:max(0, len(profiles) - self.keep)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            "settings": {
+                "threshold_ms": self.threshold * 1000,
+                "interval_ms": self.interval * 1000,
+                "directory": self.directory,
+            },
+            "active_requests": self._active,
+            "metrics": metrics.snapshot("autotoll_profiler_"),
+        }
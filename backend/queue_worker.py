@@ -0,0 +1,191 @@
+"""Standalone inference worker for the "queue" execution mode.
+
+Loads YOLO and EasyOCR once, then takes frames off the job queue the API
+fills (see frame_queue.py) and posts the results back. One-off uploads are
+analysed and written as a Detection here, keyed by the job id so a job that
+is delivered twice still writes one row; camera frames are analysed only,
+since their tracks live in the API process. Run as many workers as the
+hardware allows, on this machine or others sharing the queue and database:
+
+    python backend/queue_worker.py [--queue sqlite:///./frame_queue.db] [--uploads uploads]
+
+Workers on other machines need the same database, queue (PostgreSQL or
+Redis rather than a local SQLite file) and uploads directory (a shared
+mount) as the API.
+"""
+import argparse
+import threading
+import time
+
+import config
+from database import SessionLocal, Vehicle, init_db
+from detections import write_detection, written_detection
+from frame_queue import open_queue, worker_name
+from models import load_models, warm_up
+from pipeline import decode_frame, analyze_frame
+from plate_index import PlateIndex
+from storage import ImageStore
+
+
+class QueueWorker:
+    def __init__(self, queue, worker_id, detector, reader, plate_index, image_store,
+                 lease_s=10.0, idle_s=0.05, heartbeat_s=2.0, plate_refresh_s=30.0, result_ttl=300.0):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.detector = detector
+        self.reader = reader
+        self.plate_index = plate_index
+        self.image_store = image_store
+        self.lease_s = lease_s
+        self.idle_s = idle_s
+        self.heartbeat_s = heartbeat_s
+        self.plate_refresh_s = plate_refresh_s
+        self.result_ttl = result_ttl
+        self.started = time.time()
+        self.jobs = 0
+        self.failed = 0
+        self.current = None
+        self._vehicle_watermark = 0
+        self._stop = threading.Event()
+
+    def load_plates(self):
+        # Vehicles registered through the API since the last load
+        with SessionLocal() as db:
+            rows = db.query(Vehicle.license_plate, Vehicle.id).filter(
+                Vehicle.id > self._vehicle_watermark
+            ).order_by(Vehicle.id).yield_per(50000).all()
+        self.plate_index.load(rows)
+        if rows:
+            self._vehicle_watermark = rows[-1][1]
+
+    def info(self):
+        return {"started": self.started, "jobs": self.jobs, "failed": self.failed, "detector": self.detector.backend}
+
+    def _background(self):
+        # Heartbeat, lease renewal for the job in hand, housekeeping
+        last_plates = last_purge = time.monotonic()
+        while not self._stop.wait(self.heartbeat_s):
+            try:
+                self.queue.heartbeat(self.worker_id, self.info())
+                if self.current:
+                    self.queue.extend(self.current, self.worker_id, self.lease_s)
+                if time.monotonic() - last_plates >= self.plate_refresh_s:
+                    self.load_plates()
+                    last_plates = time.monotonic()
+                if time.monotonic() - last_purge >= self.result_ttl:
+                    self.queue.purge(self.result_ttl)
+                    last_purge = time.monotonic()
+            except Exception as e:
+                print(f"Queue worker heartbeat error: {e}")
+
+    def handle(self, job):
+        if job.kind == "analyze" and job.attempts > 1:
+            # Redelivered: the first attempt may already have written the row
+            with SessionLocal() as db:
+                written = written_detection(db, job.id)
+                if written:
+                    return self._detection_result(written[0], None)
+
+        raw_shape = job.meta.get("raw_shape")
+        # Set by the API's admission control when it is degrading work
+        min_width = job.meta.get("min_width")
+        img_cv, scale, decode_s = decode_frame(job.payload, raw_shape, True if min_width else None, min_width)
+        analysis = analyze_frame(
+            self.detector, self.reader, img_cv, job.meta.get("skip_ocr_boxes"), scale, job.meta.get("ocr", True)
+        )
+        analysis["timings"]["decode"] = decode_s
+        if job.kind == "frame":
+            return analysis
+
+        box = analysis["boxes"][0] if analysis["boxes"] else None
+        with SessionLocal() as db:
+            detection, _, _ = write_detection(
+                db, self.plate_index, self.image_store, analysis["vehicle_type"], analysis["confidence"],
+                analysis["license_plate"], job.payload, raw_shape, box, source_key=job.id,
+                pending=not job.meta.get("ocr", True),
+            )
+            return self._detection_result(detection, analysis)
+
+    @staticmethod
+    def _detection_result(detection, analysis):
+        return {
+            "detection_id": detection.id,
+            "confidence": analysis["confidence"] if analysis else detection.confidence,
+            "timings": analysis["timings"] if analysis else {},
+        }
+
+    def run(self):
+        self.queue.heartbeat(self.worker_id, self.info())
+        threading.Thread(target=self._background, name="queue-heartbeat", daemon=True).start()
+        print(f"Queue worker {self.worker_id} waiting for frames")
+        idle = 0.001
+        try:
+            while not self._stop.is_set():
+                job = self.queue.claim(self.worker_id, self.lease_s)
+                if job is None:
+                    # Poll an empty queue less and less often, up to idle_s apart
+                    self._stop.wait(idle)
+                    idle = min(idle * 2, self.idle_s)
+                    continue
+                idle = 0.001
+                self.current = job.id
+                try:
+                    result = self.handle(job)
+                except Exception as e:
+                    print(f"Queue job {job.id} error: {e}")
+                    self.failed += 1
+                    self.queue.complete(job.id, error=str(e))
+                else:
+                    self.jobs += 1
+                    self.queue.complete(job.id, result)
+                finally:
+                    self.current = None
+        finally:
+            self._stop.set()
+
+    def stop(self):
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inference worker for AUTOTOLL_EXECUTION_MODE=queue.")
+    parser.add_argument("--queue", default=config.QUEUE_URL, help="Queue URL (SQLAlchemy URL or redis://)")
+    parser.add_argument("--uploads", default="uploads", help="Image store directory served by the API")
+    parser.add_argument("--worker-id", default=worker_name(), help="Name shown in /api/inference/stats")
+    parser.add_argument("--no-warmup", action="store_true", help="Skip the warm-up frame")
+    args = parser.parse_args()
+
+    init_db()
+    queue = open_queue(args.queue, config.QUEUE_MAX_ATTEMPTS)
+    queue.setup()
+    detector, reader = load_models(config.YOLO_MODEL_PATH, config.OCR_LANGUAGES)
+    if config.MODEL_WARMUP and not args.no_warmup:
+        warm_up(detector, reader, config.MODEL_WARMUP_WIDTH, config.MODEL_WARMUP_HEIGHT)
+    image_store = ImageStore(
+        args.uploads,
+        SessionLocal,
+        quality=config.STORAGE_JPEG_QUALITY,
+        max_width=config.STORAGE_MAX_WIDTH,
+        thumb_width=config.STORAGE_THUMB_WIDTH,
+        queue_depth=config.STORAGE_QUEUE_DEPTH,
+    )
+    worker = QueueWorker(
+        queue, args.worker_id, detector, reader,
+        PlateIndex(max_distance=config.PLATE_FUZZY_MAX_DISTANCE), image_store,
+        lease_s=config.QUEUE_LEASE_S,
+        heartbeat_s=config.QUEUE_HEARTBEAT_S,
+        result_ttl=config.QUEUE_RESULT_TTL_S,
+    )
+    worker.load_plates()
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        image_store.flush()
+        image_store.shutdown()
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import datetime
+import itertools
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import insert
+
+import metrics
+from database import Owner, Vehicle
+
+# Bulk registry import (CSV / Excel) as a background job.
+#
+# The upload is spooled to disk and read in chunks: CSV through pandas'
+# chunked reader, .xlsx through openpyxl's read-only row iterator. Each chunk
+# is cleaned with vectorized pandas operations, checked against existing
+# plates with one IN query, bulk-inserted (owners, then vehicles) and
+# committed on its own, so memory and transaction size stay flat however
+# large the file is. Jobs run one at a time on a dedicated thread.
+#
+# pandas is imported on first use, keeping it out of API startup.
+
+REQUIRED_COLUMNS = ['Full Name', 'Contact Info', 'License Plate', 'Make & Model']
+
+ROWS_IMPORTED = metrics.counter("autotoll_import_rows_imported_total", "Registry rows imported")
+ROWS_FAILED = metrics.counter("autotoll_import_rows_failed_total", "Registry rows rejected during import")
+
+
+class ImportFileError(ValueError):
+    pass
+
+
+def file_kind(filename):
+    if filename.endswith('.csv'):
+        return "csv"
+    if filename.endswith('.xlsx'):
+        return "xlsx"
+    if filename.endswith('.xls'):
+        return "xls"
+    raise ImportFileError("Invalid file type. Only CSV and Excel are supported.")
+
+
+def read_header(path, kind):
+    import pandas as pd
+    if kind == "csv":
+        columns = pd.read_csv(path, nrows=0).columns
+    elif kind == "xlsx":
+        import openpyxl
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            columns = next(workbook.active.iter_rows(max_row=1, values_only=True), ())
+        finally:
+            workbook.close()
+    else:
+        columns = pd.read_excel(path, nrows=0).columns
+    return [str(c).strip() for c in columns if c is not None]
+
+
+def check_columns(path, kind):
+    # Normalize columns (strip whitespace)
+    columns = read_header(path, kind)
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in columns]
+    if missing_columns:
+        raise ImportFileError(f"Missing columns: {', '.join(missing_columns)}")
+
+
+def read_chunks(path, kind, chunk_size):
+    """Yield DataFrames of at most chunk_size rows, with stripped column names."""
+    import pandas as pd
+    if kind == "csv":
+        reader = pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False)
+        for chunk in reader:
+            chunk.columns = [str(c).strip() for c in chunk.columns]
+            yield chunk
+    elif kind == "xlsx":
+        import openpyxl
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(c).strip() if c is not None else "" for c in next(rows, ())]
+            while True:
+                batch = list(itertools.islice(rows, chunk_size))
+                if not batch:
+                    break
+                yield pd.DataFrame(batch, columns=header)
+        finally:
+            workbook.close()
+    else:
+        # Legacy .xls has no streaming reader; load it once and slice
+        df = pd.read_excel(path, dtype=str)
+        df.columns = [str(c).strip() for c in df.columns]
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
+
+
+def clean_chunk(df, first_row):
+    """Vectorized cleanup; returns name/contact/plate/model columns plus the sheet row number."""
+    import pandas as pd
+    def column(name):
+        return df[name].fillna("").astype(str).str.strip()
+
+    frame = pd.DataFrame({
+        "name": column('Full Name'),
+        "contact": column('Contact Info'),
+        "plate": column('License Plate').str.upper(),
+        "model": column('Make & Model'),
+    })
+    # Header is row 1 in the sheet
+    frame["row"] = range(first_row, first_row + len(frame))
+    # Rows without a name or plate are skipped, as with a manual import
+    frame = frame[(frame["name"] != "") & (frame["plate"] != "")]
+    return frame
+
+
+class ImportJob:
+    def __init__(self, filename):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.status = "queued"  # queued, running, completed, failed
+        self.rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.detail = None
+        self.created_at = datetime.datetime.utcnow()
+        self.finished_at = None
+
+    def add_error(self, message, max_errors):
+        if len(self.errors) < max_errors:
+            self.errors.append(message)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "rows": self.rows,
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": self.errors,
+            "detail": self.detail,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class RegistryImporter:
+    def __init__(self, session_factory, on_vehicles=None, chunk_size=5000, max_errors=100, keep_jobs=50):
+        # on_vehicles([(plate, vehicle_id), ...]) is called after each committed chunk
+        self.session_factory = session_factory
+        self.on_vehicles = on_vehicles
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        self.keep_jobs = keep_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="registry-import")
+
+    def submit(self, path, kind, filename):
+        """Queue an import of a spooled upload; the file is removed when the job ends."""
+        job = ImportJob(filename)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.keep_jobs:
+                oldest = next(iter(self._jobs.values()))
+                if oldest.status in ("queued", "running"):
+                    break
+                self._jobs.popitem(last=False)
+        self._executor.submit(self._run, job, path, kind)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _run(self, job, path, kind):
+        job.status = "running"
+        db = self.session_factory()
+        try:
+            first_row = 2
+            for chunk in read_chunks(path, kind, self.chunk_size):
+                job.rows += len(chunk)
+                self._import_chunk(db, job, clean_chunk(chunk, first_row))
+                first_row += len(chunk)
+            job.status = "completed"
+        except Exception as e:
+            db.rollback()
+            print(f"Import error: {e}")
+            job.status = "failed"
+            job.detail = str(e)
+        finally:
+            db.close()
+            job.finished_at = datetime.datetime.utcnow()
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _reject(self, job, frame, message):
+        job.failed += len(frame)
+        ROWS_FAILED.inc(len(frame))
+        for row, plate in zip(frame["row"].iloc[:self.max_errors], frame["plate"].iloc[:self.max_errors]):
+            job.add_error(message.format(row=row, plate=plate), self.max_errors)
+
+    def _import_chunk(self, db, job, frame):
+        if frame.empty:
+            return
+
+        # One set-based query per chunk for plates already registered
+        plates = frame["plate"].unique().tolist()
+        existing = {p for (p,) in db.query(Vehicle.license_plate).filter(Vehicle.license_plate.in_(plates))}
+        clash = frame["plate"].isin(existing) | frame["plate"].duplicated()
+        self._reject(job, frame[clash], "Row {row}: Plate {plate} already exists")
+        frame = frame[~clash]
+        if frame.empty:
+            return
+
+        try:
+            owner_ids = db.scalars(
+                insert(Owner).returning(Owner.id, sort_by_parameter_order=True),
+                [
+                    {"name": name, "contact_info": contact, "photo_path": ""}
+                    for name, contact in zip(frame["name"], frame["contact"])
+                ],
+            ).all()
+            vehicle_ids = db.scalars(
+                insert(Vehicle).returning(Vehicle.id, sort_by_parameter_order=True),
+                [
+                    {"license_plate": plate, "make_model": model, "owner_id": owner_id}
+                    for plate, model, owner_id in zip(frame["plate"], frame["model"], owner_ids)
+                ],
+            ).all()
+            db.commit()
+        except Exception as e:
+            # e.g. a plate registered by hand while this chunk was being checked
+            db.rollback()
+            first, last = frame["row"].iloc[0], frame["row"].iloc[-1]
+            job.failed += len(frame)
+            ROWS_FAILED.inc(len(frame))
+            job.add_error(f"Rows {first}-{last}: {e}", self.max_errors)
+            return
+
+        job.imported += len(frame)
+        ROWS_IMPORTED.inc(len(frame))
+        if self.on_vehicles:
+            self.on_vehicles(list(zip(frame["plate"], vehicle_ids)))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,126 @@
+from sqlalchemy.dialects import sqlite, postgresql
+
+from database import Detection, HourlyRollup, DailyRollup
+
+# Incremental maintenance of the hourly/daily analytics rollups.
+#
+# Every write path calls apply_detection() inside its own transaction:
+# +1 after inserting a detection, -1 before deleting one, and -1/+1 around
+# an edit. The dashboard endpoints then aggregate a few hundred rollup rows
+# instead of the whole detections table. Detections moved to the Parquet
+# archive stay counted.
+
+MEASURES = ("volume", "revenue", "confidence_sum", "pending_review")
+
+
+def _confidence(detection):
+    try:
+        return float(detection.confidence or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _deltas(detection, sign):
+    return {
+        "volume": sign,
+        "revenue": sign * (detection.toll_amount or 0),
+        "confidence_sum": sign * _confidence(detection),
+        "pending_review": sign if detection.status == "pending_review" else 0,
+    }
+
+
+def upsert(db, model, keys, deltas):
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        table = model.__table__
+        stmt = insert(table).values(**keys, **deltas)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: table.c[name] + stmt.excluded[name] for name in deltas},
+        )
+        db.execute(stmt)
+        return
+
+    row = db.get(model, tuple(keys.values()))
+    if row is None:
+        db.add(model(**keys, **deltas))
+    else:
+        for name, value in deltas.items():
+            setattr(row, name, (getattr(row, name) or 0) + value)
+
+
+def apply_detection(db, detection, sign=1):
+    """Add (sign=1) or remove (sign=-1) one detection from the rollups."""
+    ts = detection.timestamp
+    vehicle_type = detection.vehicle_type or "Unknown"
+    deltas = _deltas(detection, sign)
+    upsert(db, HourlyRollup,
+            {"bucket": ts.replace(minute=0, second=0, microsecond=0), "vehicle_type": vehicle_type},
+            deltas)
+    upsert(db, DailyRollup, {"day": ts.date(), "vehicle_type": vehicle_type}, deltas)
+
+
+def _totals(detections):
+    """Sum the deltas of many detections per (hour, type) and (day, type) bucket."""
+    hourly = {}
+    daily = {}
+    for detection in detections:
+        vehicle_type = detection.vehicle_type or "Unknown"
+        deltas = _deltas(detection, 1)
+        for buckets, key in (
+            (hourly, (detection.timestamp.replace(minute=0, second=0, microsecond=0), vehicle_type)),
+            (daily, (detection.timestamp.date(), vehicle_type)),
+        ):
+            totals = buckets.setdefault(key, dict.fromkeys(MEASURES, 0))
+            for name, value in deltas.items():
+                totals[name] += value
+    return hourly, daily
+
+
+def apply_detections(db, detections):
+    """Add a batch of new detections to the rollups with one upsert per bucket."""
+    hourly, daily = _totals(detections)
+    for (bucket, vehicle_type), totals in hourly.items():
+        upsert(db, HourlyRollup, {"bucket": bucket, "vehicle_type": vehicle_type}, totals)
+    for (day, vehicle_type), totals in daily.items():
+        upsert(db, DailyRollup, {"day": day, "vehicle_type": vehicle_type}, totals)
+
+
+def _merge(buckets, more):
+    for key, deltas in more.items():
+        totals = buckets.setdefault(key, dict.fromkeys(MEASURES, 0))
+        for name, value in deltas.items():
+            totals[name] += value
+
+
+def rebuild_rollups(db, batch_size=10000, archive=None):
+    """Recompute both rollup tables from the raw detections (backfill / reconciliation).
+
+    Detections moved to the Parquet archive (archive.py) are counted too.
+    """
+    hourly, daily = _totals(db.query(Detection).yield_per(batch_size))
+    if archive is not None:
+        archived_hourly, archived_daily = archive.rollup_totals(db)
+        _merge(hourly, archived_hourly)
+        _merge(daily, archived_daily)
+
+    db.query(HourlyRollup).delete()
+    db.query(DailyRollup).delete()
+    db.bulk_insert_mappings(HourlyRollup, [
+        {"bucket": bucket, "vehicle_type": vt, **totals} for (bucket, vt), totals in hourly.items()
+    ])
+    db.bulk_insert_mappings(DailyRollup, [
+        {"day": day, "vehicle_type": vt, **totals} for (day, vt), totals in daily.items()
+    ])
+    db.commit()
+    return {"hourly_rows": len(hourly), "daily_rows": len(daily)}
+
+
+def ensure_rollups(db, archive=None):
+    """Backfill the rollups once for databases that predate them."""
+    has_rollups = db.query(DailyRollup).first() is not None
+    has_detections = db.query(Detection.id).first() is not None or (archive is not None and archive.has_rows(db))
+    if has_detections and not has_rollups:
+        print("Backfilling analytics rollups...")
+        rebuild_rollups(db, archive=archive)
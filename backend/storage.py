@@ -0,0 +1,260 @@
+import datetime
+import hashlib
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+
+import metrics
+from database import Detection, Owner
+from pipeline import decode_image, plate_rois, record_stages
+
+# Image storage for detection frames and owner photos.
+#
+# Files are content addressed: the name is a hash of the uploaded bytes, so a
+# frame or photo that arrives twice is stored once. The URL is known as soon as
+# the bytes are hashed; decoding, downscaling, JPEG re-encoding, plate-crop
+# thumbnails and the disk writes happen on a writer thread fed by a bounded
+# queue, so requests never wait on the filesystem. Removals go through the
+# same queue and only delete a file once no detection or owner refers to it.
+#
+# Layout: <root>/<2 hex chars>/<digest>.jpg and <digest>-plate.jpg
+
+WRITES = metrics.counter("autotoll_storage_writes_total", "Images written to disk")
+DEDUPLICATED = metrics.counter("autotoll_storage_deduplicated_total", "Images already stored under the same content hash")
+BYTES_WRITTEN = metrics.counter("autotoll_storage_bytes_written_total", "Bytes written by the image store")
+REMOVED = metrics.counter("autotoll_storage_removed_total", "Unreferenced images removed")
+INLINE_WRITES = metrics.counter("autotoll_storage_inline_writes_total", "Images written in the request because the writer queue was full")
+QUEUE_DEPTH = metrics.gauge("autotoll_storage_queue_depth", "Storage operations waiting for the writer thread")
+
+
+def encode(img, quality):
+    ok, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode image as JPEG")
+    return buffer.tobytes()
+
+
+def downscale(img, max_width):
+    if max_width and img.shape[1] > max_width:
+        scale = max_width / img.shape[1]
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return img
+
+
+class ImageStore:
+    def __init__(self, root, session_factory, url_prefix="/uploads", quality=85, max_width=1280,
+                 thumb_width=320, queue_depth=256, release_grace_s=60.0):
+        self.root = root
+        self.session_factory = session_factory
+        self.url_prefix = url_prefix.rstrip("/")
+        self.quality = quality
+        self.max_width = max_width
+        self.thumb_width = thumb_width
+        # A file stored again this recently may belong to a detection that is
+        # not committed yet, so a removal request for it is ignored
+        self.release_grace_s = release_grace_s
+        self._queue = queue.Queue(maxsize=queue_depth)
+        self._touched = OrderedDict()  # url -> (last stored, times stored), oldest first
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="image-store", daemon=True)
+        self._thread.start()
+
+    # --- Naming ---
+
+    def _digest(self, contents, raw_shape):
+        h = hashlib.blake2b(contents, digest_size=16)
+        if raw_shape is not None:
+            h.update(repr(raw_shape).encode())
+        return h.hexdigest()
+
+    def _url(self, name):
+        return f"{self.url_prefix}/{name[:2]}/{name}.jpg"
+
+    def _path(self, url):
+        """Filesystem path for a stored URL, or None for anything outside the store."""
+        if not url or not url.startswith(self.url_prefix + "/"):
+            return None
+        relative = url[len(self.url_prefix) + 1:]
+        path = os.path.normpath(os.path.join(self.root, relative))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            return None
+        return path
+
+    # --- Public API ---
+
+    def store_frame(self, contents, raw_shape=None, box=None, keep_full=True):
+        """Queue a detection frame; returns (image_url, thumbnail_url).
+
+        box is the vehicle box whose plate region becomes the thumbnail.
+        image_url is None when retention says the full frame is not kept.
+        """
+        digest = self._digest(contents, raw_shape)
+        image_url = self._url(digest) if keep_full else None
+        thumb_url = self._url(f"{digest}-plate") if box is not None else None
+        if image_url or thumb_url:
+            self._touch(image_url, thumb_url)
+            self._submit(("frame", contents, raw_shape, box, image_url, thumb_url))
+        return image_url, thumb_url
+
+    def store_photo(self, contents):
+        """Queue an owner photo; returns its URL."""
+        url = self._url(self._digest(contents, None))
+        self._touch(url)
+        self._submit(("frame", contents, None, None, url, None))
+        return url
+
+    def release(self, *urls):
+        """Remove stored images once nothing refers to them any more."""
+        urls = [u for u in urls if self._path(u)]
+        if urls:
+            self._submit(("release", urls))
+
+    def flush(self):
+        """Block until every queued operation has been applied."""
+        self._queue.join()
+
+    def shutdown(self):
+        self._submit(None)
+        self._thread.join(timeout=10)
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "metrics": metrics.snapshot("autotoll_storage_"),
+        }
+
+    # --- Writer thread ---
+
+    def _touch(self, *urls):
+        now = time.monotonic()
+        with self._lock:
+            for url in urls:
+                if url:
+                    _, count = self._touched.pop(url, (now, 0))
+                    self._touched[url] = (now, count + 1)
+            while self._touched:
+                url, (stored, _) = next(iter(self._touched.items()))
+                if now - stored < self.release_grace_s:
+                    break
+                self._touched.popitem(last=False)
+
+    def _submit(self, op):
+        try:
+            self._queue.put_nowait(op)
+        except queue.Full:
+            # Never drop an image; the request pays for the write instead
+            if op is None:
+                self._queue.put(op)
+                return
+            INLINE_WRITES.inc()
+            self._apply(op)
+        QUEUE_DEPTH.set(self._queue.qsize())
+
+    def _run(self):
+        while True:
+            op = self._queue.get()
+            try:
+                if op is None:
+                    return
+                self._apply(op)
+            except Exception as e:
+                print(f"Storage error: {e}")
+            finally:
+                self._queue.task_done()
+                QUEUE_DEPTH.set(self._queue.qsize())
+
+    def _apply(self, op):
+        if op[0] == "frame":
+            started = time.perf_counter()
+            self._write_frame(*op[1:])
+            record_stages({"store": time.perf_counter() - started})
+        else:
+            self._release(op[1])
+
+    def _write(self, url, data):
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        WRITES.inc()
+        BYTES_WRITTEN.inc(len(data))
+
+    def _write_frame(self, contents, raw_shape, box, image_url, thumb_url):
+        todo = []
+        for url in (image_url, thumb_url):
+            if url and os.path.exists(self._path(url)):
+                DEDUPLICATED.inc()
+            elif url:
+                todo.append(url)
+        if not todo:
+            return
+
+        try:
+            img = decode_image(contents, raw_shape)
+        except Exception:
+            img = None
+        if img is None:
+            # Not an image we can decode; keep the upload as it came
+            if image_url in todo and raw_shape is None:
+                self._write(image_url, contents)
+            return
+
+        if image_url in todo:
+            self._write(image_url, encode(downscale(img, self.max_width), self.quality))
+        if thumb_url in todo:
+            rois = plate_rois(img, [box], max_vehicles=1, max_width=self.thumb_width)
+            if rois:
+                self._write(thumb_url, encode(rois[0][0], self.quality))
+
+    def _release(self, urls):
+        now = time.monotonic()
+        db = self.session_factory()
+        try:
+            for url in urls:
+                with self._lock:
+                    stored, count = self._touched.get(url, (None, 0))
+                    if count > 1 and now - stored < self.release_grace_s:
+                        continue
+                    self._touched.pop(url, None)
+                in_use = (
+                    db.query(Detection.id).filter(
+                        (Detection.image_path == url) | (Detection.thumbnail_path == url)
+                    ).first()
+                    or db.query(Owner.id).filter(Owner.photo_path == url).first()
+                )
+                path = self._path(url)
+                if in_use or not os.path.exists(path):
+                    continue
+                os.remove(path)
+                REMOVED.inc()
+        finally:
+            db.close()
+
+
+def evict_full_images(db, store, older_than_days, batch_size=1000):
+    """Drop full frames of settled (non pending_review) detections past the retention window.
+
+    Plate-crop thumbnails are kept. Returns the number of detections trimmed.
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=older_than_days)
+    trimmed = 0
+    while True:
+        rows = db.query(Detection.id, Detection.image_path).filter(
+            Detection.image_path.isnot(None),
+            Detection.status != 'pending_review',
+            Detection.timestamp < cutoff,
+        ).limit(batch_size).all()
+        if not rows:
+            return trimmed
+        db.query(Detection).filter(Detection.id.in_([r.id for r in rows])).update(
+            {Detection.image_path: None}, synchronize_session=False
+        )
+        db.commit()
+        store.release(*{r.image_path for r in rows})
+        trimmed += len(rows)
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import struct
+import time
+
+from starlette.websockets import WebSocketDisconnect
+
+import metrics
+
+# Persistent frame ingestion over a WebSocket.
+#
+# Each binary message is one frame:
+#
+#     [4-byte big-endian header length][JSON header][payload]
+#
+# Header fields:
+#     camera_id  lane/camera the frame belongs to (required)
+#     ts         client timestamp, echoed back untouched
+#     format     "jpeg" (default) or "bgr" for raw 8-bit BGR pixels
+#     width, height  required when format is "bgr"
+#
+# Every processed frame is answered with a JSON text message carrying the
+# detection result. Each camera keeps only its newest unprocessed frame: when
+# a client sends faster than inference can keep up, older frames are dropped
+# instead of queueing up latency.
+
+HEADER_LENGTH = struct.Struct("!I")
+
+FRAMES_RECEIVED = metrics.counter("autotoll_stream_frames_received_total", "Frames received over WebSocket")
+FRAMES_DROPPED = metrics.counter("autotoll_stream_frames_dropped_total", "Stale frames replaced before inference")
+OPEN_STREAMS = metrics.gauge("autotoll_stream_connections", "Open frame streaming connections")
+
+
+class FrameError(ValueError):
+    pass
+
+
+def parse_frame(message):
+    """Split one binary message into (header, payload, raw_shape)."""
+    if len(message) < HEADER_LENGTH.size:
+        raise FrameError("Frame too short")
+    (header_length,) = HEADER_LENGTH.unpack_from(message, 0)
+    body_start = HEADER_LENGTH.size + header_length
+    try:
+        header = json.loads(message[HEADER_LENGTH.size:body_start])
+    except ValueError:
+        raise FrameError("Invalid frame header")
+    if not isinstance(header, dict) or not header.get("camera_id"):
+        raise FrameError("Frame header needs a camera_id")
+
+    payload = message[body_start:]
+    raw_shape = None
+    if header.get("format", "jpeg") == "bgr":
+        try:
+            raw_shape = (int(header["height"]), int(header["width"]), 3)
+        except (KeyError, TypeError, ValueError):
+            raise FrameError("Raw BGR frames need width and height")
+        if raw_shape[0] * raw_shape[1] * 3 != len(payload):
+            raise FrameError("Raw BGR payload does not match width x height x 3")
+    return header, payload, raw_shape
+
+
+class FrameMailbox:
+    """Holds only the newest frame for one camera."""
+
+    def __init__(self):
+        self._frame = None
+        self._ready = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, frame):
+        if self._frame is not None:
+            self.dropped += 1
+            FRAMES_DROPPED.inc()
+        self._frame = frame
+        self._ready.set()
+
+    async def get(self):
+        await self._ready.wait()
+        self._ready.clear()
+        frame, self._frame = self._frame, None
+        return frame
+
+
+class StreamSession:
+    def __init__(self, websocket, process_frame):
+        # process_frame(camera_id, payload, raw_shape) -> result dict
+        self.websocket = websocket
+        self.process_frame = process_frame
+        self._mailboxes = {}
+        self._tasks = []
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, message):
+        async with self._send_lock:
+            await self.websocket.send_text(json.dumps(message))
+
+    async def run(self):
+        OPEN_STREAMS.inc()
+        try:
+            while True:
+                event = await self.websocket.receive()
+                if event["type"] == "websocket.disconnect":
+                    break
+                message = event.get("bytes")
+                if message is None:
+                    await self.send({"type": "error", "detail": "Frames must be sent as binary messages"})
+                    continue
+                FRAMES_RECEIVED.inc()
+                try:
+                    header, payload, raw_shape = parse_frame(message)
+                except FrameError as e:
+                    await self.send({"type": "error", "detail": str(e)})
+                    continue
+
+                camera_id = str(header["camera_id"])
+                mailbox = self._mailboxes.get(camera_id)
+                if mailbox is None:
+                    mailbox = self._mailboxes[camera_id] = FrameMailbox()
+                    self._tasks.append(asyncio.create_task(self._process(camera_id, mailbox)))
+                mailbox.put((header, payload, raw_shape, time.perf_counter()))
+        except WebSocketDisconnect:
+            pass
+        finally:
+            OPEN_STREAMS.dec()
+            for task in self._tasks:
+                task.cancel()
+
+    async def _process(self, camera_id, mailbox):
+        while True:
+            header, payload, raw_shape, received = await mailbox.get()
+            try:
+                result = await self.process_frame(camera_id, payload, raw_shape)
+                message = {"type": "detection", **result}
+            except Exception as e:
+                message = {"type": "error", "detail": str(e)}
+            message.update({
+                "cameraId": camera_id,
+                "ts": header.get("ts"),
+                "latencyMs": (time.perf_counter() - received) * 1000,
+                "dropped": mailbox.dropped,
+            })
+            try:
+                await self.send(message)
+            except (WebSocketDisconnect, RuntimeError):
+                return
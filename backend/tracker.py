@@ -0,0 +1,193 @@
+import itertools
+import time
+from collections import Counter
+
+import metrics
+from pipeline import box_iou, COCO_MAP
+
+# Multi-frame vehicle tracking for the realtime stream. Frames from the same
+# camera are matched to existing tracks by IoU of their YOLO boxes; every plate
+# reading on a track adds per-character votes, and the track produces a single
+# Detection once its plate is confidently resolved or the vehicle leaves.
+
+TRACKS_OPENED = metrics.counter("autotoll_tracks_opened_total", "Vehicle tracks started")
+TRACKS_COMMITTED = metrics.counter("autotoll_tracks_committed_total", "Tracks written as a Detection")
+OCR_SKIPPED = metrics.counter("autotoll_tracks_ocr_skipped_total", "Frames whose OCR was skipped because the track was resolved")
+ACTIVE_TRACKS = metrics.gauge("autotoll_tracks_active", "Tracks currently alive")
+
+_track_ids = itertools.count(1)
+
+
+class Track:
+    def __init__(self, camera_id, box, now):
+        self.id = next(_track_ids)
+        self.camera_id = camera_id
+        self.box = box
+        self.first_seen = now
+        self.last_seen = now
+        self.frames = 0
+        self.misses = 0
+        self.confidence = 0.0
+        self.type_votes = Counter()
+        # Plate readings vote per length, then per character position
+        self.length_votes = Counter()
+        self.char_votes = {}
+        self.readings = 0
+        # Best-looking frame is kept for the review image
+        self.best_contents = None
+        self.best_raw_shape = None
+        self.best_box = None
+        self.best_confidence = -1.0
+        self.committed = False
+        self.detection_id = None
+
+    def update(self, box, vehicle_type, confidence, contents, now, raw_shape=None):
+        self.box = box
+        self.last_seen = now
+        self.frames += 1
+        self.misses = 0
+        self.type_votes[vehicle_type] += confidence
+        self.confidence = max(self.confidence, confidence)
+        if contents is not None and confidence > self.best_confidence:
+            self.best_confidence = confidence
+            self.best_contents = contents
+            self.best_raw_shape = raw_shape
+            self.best_box = box
+
+    def add_plate(self, plate):
+        if not plate or plate == "UNKNOWN":
+            return
+        self.readings += 1
+        self.length_votes[len(plate)] += 1
+        positions = self.char_votes.setdefault(len(plate), [Counter() for _ in plate])
+        for i, ch in enumerate(plate):
+            positions[i][ch] += 1
+
+    @property
+    def vehicle_type(self):
+        return self.type_votes.most_common(1)[0][0] if self.type_votes else "Unknown"
+
+    def fused_plate(self):
+        """Return (plate, agreement) where agreement is the mean share of votes per character."""
+        if not self.length_votes:
+            return "UNKNOWN", 0.0
+        length = self.length_votes.most_common(1)[0][0]
+        positions = self.char_votes[length]
+        chars = []
+        agreement = 0.0
+        for votes in positions:
+            ch, count = votes.most_common(1)[0]
+            chars.append(ch)
+            agreement += count / sum(votes.values())
+        # Readings of a different length count against the fused plate
+        length_share = self.length_votes[length] / self.readings
+        return "".join(chars), (agreement / length) * length_share
+
+    def is_resolved(self, min_readings, min_agreement):
+        if self.readings < min_readings:
+            return False
+        return self.fused_plate()[1] >= min_agreement
+
+
+class TrackManager:
+    def __init__(self, iou_threshold=0.3, max_misses=2, lost_after_s=5.0,
+                 min_readings=3, min_agreement=0.7):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.lost_after_s = lost_after_s
+        self.min_readings = min_readings
+        self.min_agreement = min_agreement
+        self._tracks = {}  # camera_id -> [Track]
+
+    def has_tracks(self, camera_id):
+        return bool(self._tracks.get(camera_id))
+
+    def resolved_boxes(self, camera_id):
+        """Boxes of tracks whose plate is settled; frames matching them can skip OCR."""
+        return [t.box for t in self._tracks.get(camera_id, []) if t.committed]
+
+    def read_boxes(self, camera_id):
+        """Boxes of tracks with at least one plate reading; OCR skips them when load is shed."""
+        return [t.box for t in self._tracks.get(camera_id, []) if t.committed or t.readings]
+
+    def observe(self, camera_id, boxes, license_plate, contents, now=None, raw_shape=None):
+        """Feed one analysed frame.
+
+        Returns (primary_track, tracks_to_commit); the caller writes a Detection
+        for each track to commit and reports it back through mark_committed().
+        """
+        now = time.time() if now is None else now
+        tracks = self._tracks.setdefault(camera_id, [])
+
+        # Greedy IoU association, most confident boxes first (boxes arrive sorted)
+        matched = {}
+        free = list(tracks)
+        for i, box in enumerate(boxes):
+            best, best_iou = None, self.iou_threshold
+            for track in free:
+                iou = box_iou(box, track.box)
+                if iou >= best_iou:
+                    best, best_iou = track, iou
+            if best is None:
+                best = Track(camera_id, box, now)
+                tracks.append(best)
+                TRACKS_OPENED.inc()
+            else:
+                free.remove(best)
+            matched[i] = best
+
+        for track in free:
+            track.misses += 1
+
+        primary = None
+        for i, track in matched.items():
+            box = boxes[i]
+            track.update(box, COCO_MAP[box[5]], box[4], contents, now, raw_shape)
+            if i == 0:
+                # The frame's plate reading belongs to the most confident box
+                primary = track
+                if license_plate is None:
+                    OCR_SKIPPED.inc()
+                else:
+                    track.add_plate(license_plate)
+
+        to_commit = []
+        if primary and not primary.committed and primary.is_resolved(self.min_readings, self.min_agreement):
+            to_commit.append(primary)
+
+        to_commit.extend(self.expire(now))
+        return primary, to_commit
+
+    def mark_committed(self, track, detection_id):
+        track.committed = True
+        track.detection_id = detection_id
+        # The review image has been written; no need to hold the frame any longer
+        track.best_contents = None
+        TRACKS_COMMITTED.inc()
+
+    def expire(self, now=None):
+        """Drop lost tracks on every camera; returns the ones still owed a Detection."""
+        now = time.time() if now is None else now
+        pending = []
+        active = 0
+        for camera_id, tracks in list(self._tracks.items()):
+            alive = []
+            for track in tracks:
+                lost = track.misses > self.max_misses or now - track.last_seen > self.lost_after_s
+                if not lost:
+                    alive.append(track)
+                elif not track.committed and track.frames > 0:
+                    pending.append(track)
+            if alive:
+                self._tracks[camera_id] = alive
+            else:
+                del self._tracks[camera_id]
+            active += len(alive)
+        ACTIVE_TRACKS.set(active)
+        return pending
+
+    def stats(self):
+        return {
+            "cameras": len(self._tracks),
+            "metrics": metrics.snapshot("autotoll_tracks_"),
+        }
@@ -0,0 +1,94 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from models import load_models, warm_up
+from pipeline import decode_frame, analyze_frame, analyze_batch
+
+# Process-pool execution mode for /analyze. Each worker process loads its own
+# YOLO model and EasyOCR reader once, then handles whole frames (decode,
+# detection, OCR) so the API process only does I/O and DB work.
+
+IN_FLIGHT = metrics.gauge("autotoll_worker_in_flight", "Frames dispatched to the worker pool")
+REJECTED = metrics.counter("autotoll_worker_rejected_total", "Frames refused because every worker was busy")
+
+# Per-process model handles, filled in by _init_worker
+_detector = None
+_reader = None
+
+
+def _init_worker(model_path, ocr_languages, warmup=None):
+    global _detector, _reader
+    _detector, _reader = load_models(model_path, ocr_languages)
+    if warmup:
+        # (width, height) of the synthetic warm-up frame
+        warm_up(_detector, _reader, *warmup)
+
+
+def _ping():
+    return _detector is not None
+
+
+def _analyze_bytes(contents, skip_ocr_boxes=None, raw_shape=None, min_width=None, ocr=True):
+    img_cv, scale, decode_s = decode_frame(contents, raw_shape, True if min_width else None, min_width)
+    analysis = analyze_frame(_detector, _reader, img_cv, skip_ocr_boxes, scale, ocr)
+    analysis["timings"]["decode"] = decode_s
+    return analysis
+
+
+def analyze_frames(frames, ocr_without_vehicle=True):
+    """Batched analysis with this worker's models, for tasks defined in other modules."""
+    return analyze_batch(_detector, _reader, frames, ocr_without_vehicle)
+
+
+class PoolBusyError(Exception):
+    pass
+
+
+class WorkerPool:
+    mode = "process"
+
+    def __init__(self, processes, max_pending, model_path="yolov8n.pt", ocr_languages=("en",), warmup=None):
+        self.processes = max(1, processes)
+        self.max_pending = max(0, max_pending)
+        self._in_flight = 0
+        # spawn, not fork: torch state in the parent must not leak into workers
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_path, list(ocr_languages), warmup),
+        )
+
+    def start(self):
+        # Spawn every worker now so model loading happens at startup, not on the first frame
+        futures = [self._executor.submit(_ping) for _ in range(self.processes)]
+        for f in futures:
+            f.result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def submit(self, contents, skip_ocr_boxes=None, raw_shape=None, min_width=None, ocr=True):
+        if self._in_flight >= self.processes + self.max_pending:
+            REJECTED.inc()
+            raise PoolBusyError("All inference workers are busy")
+
+        self._in_flight += 1
+        IN_FLIGHT.set(self._in_flight)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, _analyze_bytes, contents, skip_ocr_boxes, raw_shape, min_width, ocr
+            )
+        finally:
+            self._in_flight -= 1
+            IN_FLIGHT.set(self._in_flight)
+
+    def stats(self):
+        return {
+            "settings": {"processes": self.processes, "max_pending": self.max_pending},
+            "in_flight": self._in_flight,
+            "metrics": metrics.snapshot("autotoll_worker_"),
+        }
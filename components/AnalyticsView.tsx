@@ -4,6 +4,7 @@ import {
     XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer, Legend
 } from 'recharts';
 import { Activity, IndianRupee, Car, Clock, TrendingUp, Filter, RefreshCw } from 'lucide-react';
+import { subscribeDetectionEvents } from '../services/api';
 
 const API_BASE = "http://localhost:8000";
 
@@ -41,8 +42,20 @@ export const AnalyticsView: React.FC = () => {
 
     useEffect(() => {
         fetchAnalytics();
-        const interval = setInterval(fetchAnalytics, 30000); // Refresh every 30s
-        return () => clearInterval(interval);
+        // Refresh when detections change, at most once every 5s
+        let pending: ReturnType<typeof setTimeout> | null = null;
+        const unsubscribe = subscribeDetectionEvents(() => {
+            if (!pending) {
+                pending = setTimeout(() => {
+                    pending = null;
+                    fetchAnalytics();
+                }, 5000);
+            }
+        });
+        return () => {
+            unsubscribe();
+            if (pending) clearTimeout(pending);
+        };
     }, []);
 
     const CustomTooltip = ({ active, payload, label, prefix = "" }: any) => {
@@ -1,13 +1,15 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Clock, Car, AlertTriangle, User, RefreshCw, Trash2 } from 'lucide-react';
+import { syncList, subscribeDetectionEvents, applyDetectionEvent } from '../services/api';
 
 const API_BASE = "http://localhost:8000";
+const HISTORY_LIMIT = 50;
 
 interface Detection {
     id: number;
     vehicle_type: string;
     license_plate: string;
-    confidence: string;
+    confidence: number;
     timestamp: string;
     is_authorized: number;
 }
@@ -19,21 +21,33 @@ interface HistoryProps {
 export function History({ onRegister }: HistoryProps) {
     const [logs, setLogs] = useState<Detection[]>([]);
     const [isLoading, setIsLoading] = useState(false);
+    // Rows and watermark from the last sync; polls only fetch what changed since
+    const logsRef = useRef<Detection[]>([]);
+    const watermarkRef = useRef<string | null>(null);
 
     useEffect(() => {
-        fetchHistory();
-        // Poll every 5 seconds for new entries
-        const interval = setInterval(fetchHistory, 5000);
-        return () => clearInterval(interval);
+        fetchHistory(true);
+        // New, edited and deleted detections are pushed by the server
+        return subscribeDetectionEvents(event => {
+            if (event.type === 'resync') {
+                fetchHistory(true);
+                return;
+            }
+            logsRef.current = applyDetectionEvent(logsRef.current, event, HISTORY_LIMIT);
+            setLogs(logsRef.current);
+        });
     }, []);
 
-    const fetchHistory = async () => {
+    const fetchHistory = async (full = false) => {
         setIsLoading(true);
         try {
-            const res = await fetch(`${API_BASE}/api/history`);
-            if (res.ok) {
-                const data = await res.json();
-                setLogs(data);
+            const synced = await syncList<Detection>(
+                '/api/history', logsRef.current, full ? null : watermarkRef.current, HISTORY_LIMIT
+            );
+            if (synced) {
+                logsRef.current = synced.rows;
+                watermarkRef.current = synced.watermark;
+                setLogs(synced.rows);
             }
         } catch (e) {
             console.error("Failed to fetch history", e);
@@ -67,7 +81,7 @@ export function History({ onRegister }: HistoryProps) {
                     Detection Logs
                 </h2>
                 <button
-                    onClick={fetchHistory}
+                    onClick={() => fetchHistory(true)}
                     className="p-2 text-zinc-400 hover:text-white bg-zinc-800 border border-zinc-700 rounded-lg hover:bg-zinc-700 transition-colors"
                     title="Refresh Logs"
                 >
@@ -144,7 +158,7 @@ export function History({ onRegister }: HistoryProps) {
                                             )}
                                         </td>
                                         <td className="p-4 text-zinc-400">
-                                            {(parseFloat(log.confidence) * 100).toFixed(0)}%
+                                            {(Number(log.confidence) * 100).toFixed(0)}%
                                         </td>
                                         <td className="p-4 text-right">
                                             <button
@@ -14,6 +14,8 @@ export function RealtimeDetectionView() {
 
     // Config
     const detectionIntervalMs = 2000; // Check every 2 seconds
+    // Identifies this feed to the server-side tracker
+    const cameraIdRef = useRef(`browser-${Math.random().toString(36).slice(2, 10)}`);
 
     useEffect(() => {
         let interval: NodeJS.Timeout;
@@ -70,7 +72,7 @@ export function RealtimeDetectionView() {
                         const file = new File([blob], "realtime_frame.jpg", { type: "image/jpeg" });
                         try {
                             // We use the existing analyze function
-                            const result = await analyzeVehicleImageLocal(file);
+                            const result = await analyzeVehicleImageLocal(file, cameraIdRef.current);
                             // Only update if we found something with decent confidence or if it's different
                             if (result.licensePlate !== "UNKNOWN" && result.confidence > 0.4) {
                                 setLastResult(result);
@@ -8,12 +8,7 @@ interface RegistryItem {
     license_plate: string;
     make_model: string;
     owner_id: number;
-    owner_name?: string; // We'll map this manually or modify API to return it
-}
-
-interface Owner {
-    id: number;
-    name: string;
+    owner_name?: string;
 }
 
 interface RegistryProps {
@@ -22,7 +17,7 @@ interface RegistryProps {
 
 export function Registry({ initialPlate }: RegistryProps) {
     const [vehicles, setVehicles] = useState<RegistryItem[]>([]);
-    const [owners, setOwners] = useState<Owner[]>([]);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
 
     // History State
     const [expandedVehicleId, setExpandedVehicleId] = useState<number | null>(null);
@@ -50,25 +45,21 @@ export function Registry({ initialPlate }: RegistryProps) {
         }
     }, [initialPlate]);
 
-    const loadData = async () => {
+    const loadData = async (cursor: string | null = null) => {
         try {
-            const [vRes, oRes] = await Promise.all([
-                fetch(`${API_BASE}/api/vehicles`),
-                fetch(`${API_BASE}/api/owners`)
-            ]);
+            // Vehicles come with their owner's name; pages are appended on "Load more"
+            const query = cursor ? `?limit=200&cursor=${encodeURIComponent(cursor)}` : '?limit=200';
+            const vRes = await fetch(`${API_BASE}/api/vehicles${query}`);
 
-            if (vRes.ok && oRes.ok) {
+            if (vRes.ok) {
                 const vData = await vRes.json();
-                const oData = await oRes.json();
-
-                // Map owner names to vehicles
-                const mappedVehicles = vData.map((v: any) => ({
+                const mappedVehicles = vData.items.map((v: any) => ({
                     ...v,
-                    owner_name: oData.find((o: any) => o.id === v.owner_id)?.name || "Unknown"
+                    owner_name: v.owner_name || "Unknown"
                 }));
 
-                setVehicles(mappedVehicles);
-                setOwners(oData);
+                setVehicles(prev => cursor ? [...prev, ...mappedVehicles] : mappedVehicles);
+                setNextCursor(vData.next_cursor || null);
             }
         } catch (e) {
             console.error("Load failed", e);
@@ -121,7 +112,7 @@ export function Registry({ initialPlate }: RegistryProps) {
                 const res = await fetch(`http://localhost:8000/api/vehicles/${vehicleId}/history`);
                 if (res.ok) {
                     const data = await res.json();
-                    setVehicleHistories(prev => ({ ...prev, [vehicleId]: data }));
+                    setVehicleHistories(prev => ({ ...prev, [vehicleId]: data.items }));
                 }
             } catch (e) {
                 console.error("Failed to load history", e);
@@ -148,11 +139,23 @@ export function Registry({ initialPlate }: RegistryProps) {
             });
 
             if (res.ok) {
-                const data = await res.json();
-                setStatus({
-                    type: 'success',
-                    text: `Import complete: ${data.imported} success, ${data.failed} failed.`
-                });
+                // The import runs in the background; poll its progress
+                let job = await res.json();
+                while (job.status === 'queued' || job.status === 'running') {
+                    setStatus({ type: 'success', text: `Importing... ${job.rows} rows read, ${job.imported} imported.` });
+                    await new Promise(resolve => setTimeout(resolve, 1000));
+                    const poll = await fetch(`${API_BASE}/api/import/${job.job_id}`);
+                    if (!poll.ok) throw new Error("Lost track of import job");
+                    job = await poll.json();
+                }
+                if (job.status === 'completed') {
+                    setStatus({
+                        type: 'success',
+                        text: `Import complete: ${job.imported} success, ${job.failed} failed.`
+                    });
+                } else {
+                    setStatus({ type: 'error', text: job.detail || "Import failed" });
+                }
                 loadData();
             } else {
                 const err = await res.json();
@@ -354,6 +357,14 @@ export function Registry({ initialPlate }: RegistryProps) {
                                 </div>
                             ))
                         )}
+                        {nextCursor && (
+                            <button
+                                onClick={() => loadData(nextCursor)}
+                                className="w-full mt-4 py-2 text-xs text-zinc-400 hover:text-zinc-200 border border-zinc-800 rounded hover:bg-zinc-900 transition-colors"
+                            >
+                                Load more
+                            </button>
+                        )}
                     </div>
                 </div>
             </div>
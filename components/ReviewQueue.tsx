@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { AlertTriangle, CheckSquare, Car, Truck, Bus } from 'lucide-react';
+import { subscribeDetectionEvents, applyDetectionEvent } from '../services/api';
 
 const API_BASE = "http://localhost:8000";
 
@@ -7,11 +8,12 @@ interface Detection {
     id: number;
     vehicle_type: string;
     license_plate: string;
-    confidence: string;
+    confidence: number;
     timestamp: string;
     toll_amount: number;
     status: string;
     image_path?: string;
+    thumbnail_path?: string;
 }
 
 interface ReviewQueueProps {
@@ -24,6 +26,14 @@ export function ReviewQueue({ onProcessed }: ReviewQueueProps) {
 
     useEffect(() => {
         loadQueue();
+        // Keep the queue live: new low-confidence detections appear, reviewed ones drop out
+        return subscribeDetectionEvents(event => {
+            if (event.type === 'resync') {
+                loadQueue();
+                return;
+            }
+            setQueue(prev => applyDetectionEvent(prev, event, 500, row => row.status === 'pending_review'));
+        });
     }, []);
 
     const handleItemProcessed = () => {
@@ -35,7 +45,8 @@ export function ReviewQueue({ onProcessed }: ReviewQueueProps) {
         try {
             const res = await fetch(`${API_BASE}/api/review_queue`);
             if (res.ok) {
-                setQueue(await res.json());
+                const data = await res.json();
+                setQueue(data.items);
             }
         } catch (e) {
             console.error(e);
@@ -147,9 +158,16 @@ const ReviewCard: React.FC<ReviewCardProps> = ({ item, onProcessed }) => {
                             <span className="text-xs text-zinc-500">{new Date(item.timestamp).toLocaleString()}</span>
                         </div>
                         <h3 className="text-xl font-mono font-bold text-white tracking-wide">{item.license_plate}</h3>
+                        {item.thumbnail_path && (
+                            <img
+                                src={`${API_BASE}${item.thumbnail_path}`}
+                                alt="Plate region"
+                                className="mt-2 h-12 rounded border border-zinc-800"
+                            />
+                        )}
                         <p className="text-sm text-red-400 mt-1 flex items-center gap-1">
                             <AlertTriangle size={12} />
-                            Low Confidence: {(parseFloat(item.confidence) * 100).toFixed(1)}%
+                            Low Confidence: {(Number(item.confidence) * 100).toFixed(1)}%
                         </p>
                     </div>
                 </div>
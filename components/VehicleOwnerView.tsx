@@ -66,7 +66,7 @@ function StatusCheck() {
         setResult(null);
 
         try {
-            const res = await fetch(`http://localhost:8000/api/vehicle/status/${plate}`);
+            const res = await fetch(`http://localhost:8000/api/vehicle/status/${encodeURIComponent(plate.trim())}`);
             if (res.ok) {
                 const data = await res.json();
                 setResult(data);
@@ -2,9 +2,91 @@ import { AnalysisResult } from '../types';
 
 const API_URL = 'http://localhost:8000';
 
-export const analyzeVehicleImageLocal = async (file: File): Promise<AnalysisResult> => {
+// Envelope returned by the paginated list endpoints (/api/history, /api/review_queue, ...)
+export interface Page<T> {
+  items: T[];
+  next_cursor?: string | null;
+  watermark?: string;
+  // Only in ?since= delta responses
+  removed?: number[];
+  truncated?: boolean;
+}
+
+// Apply a ?since= delta to a newest-first list, keeping at most `limit` rows.
+export const mergeDelta = <T extends { id: number; timestamp: string }>(current: T[], delta: Page<T>, limit: number): T[] => {
+  const removed = new Set(delta.removed || []);
+  const byId = new Map<number, T>();
+  current.forEach(row => { if (!removed.has(row.id)) byId.set(row.id, row); });
+  delta.items.forEach(row => byId.set(row.id, row));
+  return Array.from(byId.values())
+    .sort((a, b) => b.timestamp.localeCompare(a.timestamp) || b.id - a.id)
+    .slice(0, limit);
+};
+
+export type DetectionEventType = 'detection.created' | 'detection.updated' | 'detection.deleted' | 'resync';
+
+export interface DetectionEvent {
+  type: DetectionEventType;
+  data: any;
+}
+
+// Live detection feed pushed by the backend (Server-Sent Events). The browser
+// reconnects on its own and the server replays what was missed, or sends
+// 'resync' when the listing should be reloaded. Returns an unsubscribe function.
+export const subscribeDetectionEvents = (onEvent: (event: DetectionEvent) => void): (() => void) => {
+  const source = new EventSource(`${API_URL}/api/events`);
+  const types: DetectionEventType[] = ['detection.created', 'detection.updated', 'detection.deleted', 'resync'];
+  types.forEach(type => {
+    source.addEventListener(type, (e) => {
+      onEvent({ type, data: JSON.parse((e as MessageEvent).data) });
+    });
+  });
+  return () => source.close();
+};
+
+// Apply one live event to a newest-first list. Rows failing `keep` are removed.
+export const applyDetectionEvent = <T extends { id: number; timestamp: string }>(
+  rows: T[], event: DetectionEvent, limit: number, keep?: (row: T) => boolean
+): T[] => {
+  if (event.type === 'detection.deleted') {
+    return mergeDelta(rows, { items: [], removed: [event.data.id] }, limit);
+  }
+  const row = event.data as T;
+  if (keep && !keep(row)) {
+    return mergeDelta(rows, { items: [], removed: [row.id] }, limit);
+  }
+  return mergeDelta(rows, { items: [row] }, limit);
+};
+
+// Fetch a newest-first listing: the full first page when there is no watermark
+// yet, otherwise only what changed since the last call.
+export const syncList = async <T extends { id: number; timestamp: string }>(
+  path: string, current: T[], watermark: string | null, limit: number
+): Promise<{ rows: T[]; watermark: string | null } | null> => {
+  const url = watermark
+    ? `${API_URL}${path}?since=${encodeURIComponent(watermark)}`
+    : `${API_URL}${path}?limit=${limit}`;
+  const res = await fetch(url);
+  if (!res.ok) return null;
+  const data: Page<T> = await res.json();
+  if (watermark && data.truncated) {
+    // Too much changed; start over from a full page
+    return syncList(path, [], null, limit);
+  }
+  return {
+    rows: watermark ? mergeDelta(current, data, limit) : data.items,
+    watermark: data.watermark || null,
+  };
+};
+
+// Pass a cameraId for continuous streams: the backend then tracks vehicles
+// across frames and records one toll per passing vehicle.
+export const analyzeVehicleImageLocal = async (file: File, cameraId?: string): Promise<AnalysisResult> => {
   const formData = new FormData();
   formData.append('file', file);
+  if (cameraId) {
+    formData.append('camera_id', cameraId);
+  }
 
   try {
     const response = await fetch(`${API_URL}/analyze`, {